@@ -0,0 +1,169 @@
+# This file contains the checkpoints of a run of the master, so
+# that a killed or preempted run can be resumed (see --resume of
+# run_single.py) instead of starting again from scratch. Each run
+# has its own checkpoint, a JSON file Checkpoints/<run>.json (the
+# run id starts with the name of the instance file), so that a new
+# run never overwrites the checkpoint of a killed one:
+#
+#   {"version": 1, "finished": false,
+#    "cuts": [{"pattern": "x1f x2a ...", "cells": [[team, slot], ...] or null}, ...],
+#    "outcomes": {"<pattern>": {"status": "feasible", "core": ... or null}, ...},
+#    "best": {"objective": 12, "games": [[h, a, slot], ...]} or null}
+#
+# cuts is the pool of no-good cuts of the master, outcomes the
+# outcome of the slave (or of the pattern checks) for each explored
+# pattern. The patterns with a cut but without an outcome were
+# still being solved by the slaves when the run stopped.
+#
+# A resumed run continues the last checkpoint of the instance, in
+# the same file.
+
+import os, sys, time
+import glob
+import json
+import signal
+import atexit
+import threading
+from TwoRRProblem import atomic_open
+from TwoRRProtocol import pack_pattern, unpack_pattern
+from TwoRRSlaveCache import solution_games, games_solution
+
+CHECKPOINT_DIR = "Checkpoints"
+# Must be increased whenever the format of the checkpoints changes
+CHECKPOINT_VERSION = 1
+# Minimum time between two checkpoints, in seconds
+CHECKPOINT_INTERVAL = 60
+
+# Outcome of the patterns rejected by the pattern checks
+REJECTED = "rejected"
+
+def checkpoint_filename(run_id, directory=CHECKPOINT_DIR):
+    return os.path.join(directory, run_id + ".json")
+
+def last_checkpoint(problem_filename, directory=CHECKPOINT_DIR):
+    # The file of the last checkpoint written for the instance, None if there is none
+    names = glob.glob(os.path.join(directory, glob.escape(os.path.basename(problem_filename)) + "_*.json"))
+    return max(names, key=os.path.getmtime, default=None)
+
+class MasterCheckpoint():
+    # The state of a run of the master. The master records its cuts,
+    # the outcomes of the patterns and its best schedule, and save()
+    # writes them at most every interval seconds (always with
+    # force=True). The state is also written on exit and on SIGTERM,
+    # to the checkpoint of the run run_id. With resume=True the state
+    # is loaded from the last checkpoint of the instance, if any, and
+    # written back to it.
+    def __init__(self, problem_filename, n_slots, run_id, resume=False, interval=CHECKPOINT_INTERVAL,
+                 directory=CHECKPOINT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.file_name = checkpoint_filename(run_id, directory)
+        if resume:
+            self.file_name = last_checkpoint(problem_filename, directory) or self.file_name
+        self.n_slots = n_slots
+        self.interval = interval
+        # Reentrant: save() may be called by the SIGTERM handler while
+        # the main thread holds the lock
+        self.lock = threading.RLock()
+        self.cuts = []
+        self.outcomes = dict()
+        self.best = None
+        self.finished = False
+        self.resumed = False
+        if resume:
+            self.load()
+        self.saved = time.time()
+        self.dirty = False
+        atexit.register(self.save, True)
+        self.previous_handler = flush_on_sigterm(self)
+
+    def load(self):
+        try:
+            with open(self.file_name) as myfile:
+                state = json.load(myfile)
+        except FileNotFoundError:
+            return
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise Exception(f"Checkpoint {self.file_name} has version {state.get('version')}, expected {CHECKPOINT_VERSION}")
+        self.cuts = state["cuts"]
+        self.outcomes = state["outcomes"]
+        self.best = state["best"]
+        self.finished = state["finished"]
+        self.resumed = True
+
+    def add_cut(self, solution, cells=None):
+        with self.lock:
+            self.cuts.append({"pattern": pack_pattern(solution).strip(),
+                              "cells": None if cells is None else [list(cell) for cell in cells]})
+            self.dirty = True
+
+    def add_outcome(self, solution, status, core=None):
+        with self.lock:
+            self.outcomes[pack_pattern(solution).strip()] = {
+                "status": status, "core": None if core is None else [list(cell) for cell in core]}
+            self.dirty = True
+
+    def set_best(self, objective, solution):
+        with self.lock:
+            self.best = {"objective": objective, "games": solution_games(solution)}
+            self.dirty = True
+
+    def restored_cuts(self):
+        # The (pattern, cells) of the cuts, cells is a list of (team, slot) or None
+        return [(unpack_pattern(cut["pattern"], self.n_slots),
+                 None if cut["cells"] is None else [tuple(cell) for cell in cut["cells"]])
+                for cut in self.cuts]
+
+    def pending_patterns(self):
+        # The patterns cut without an outcome, in the order of their cuts
+        pending = []
+        for cut in self.cuts:
+            if cut["pattern"] not in self.outcomes and cut["pattern"] not in pending:
+                pending.append(cut["pattern"])
+        return [unpack_pattern(pattern, self.n_slots) for pattern in pending]
+
+    def restored_best(self):
+        # (objective, solution) of the best schedule, or None
+        if self.best is None:
+            return None
+        return self.best["objective"], games_solution(self.best["games"])
+
+    def save(self, force=False, finished=None):
+        with self.lock:
+            if finished is not None:
+                self.finished = finished
+                self.dirty = True
+            if not self.dirty or (not force and time.time() - self.saved < self.interval):
+                return
+            state = {"version": CHECKPOINT_VERSION, "finished": self.finished,
+                     "cuts": self.cuts, "outcomes": self.outcomes, "best": self.best}
+            with atomic_open(self.file_name) as myfile:
+                json.dump(state, myfile)
+            self.saved = time.time()
+            self.dirty = False
+
+    def close(self, finished=True):
+        # Last checkpoint of the run
+        self.save(True, finished)
+        atexit.unregister(self.save)
+        if self.previous_handler is not None:
+            signal.signal(signal.SIGTERM, self.previous_handler)
+
+def flush_on_sigterm(checkpoint):
+    # On SIGTERM the checkpoint is written before anything else:
+    # the exit waits for the slave threads, which may take hours
+    # (and run_batch.py kills the run after a grace period). The
+    # previous handler (e.g. the one of TwoRRRun) is then called.
+    # Returns the previous handler, None if it was not replaced.
+    if threading.current_thread() is not threading.main_thread():
+        return None
+    previous = signal.getsignal(signal.SIGTERM)
+    if previous is None or previous == signal.SIG_IGN:
+        return None
+    def handler(signum, frame):
+        checkpoint.save(True)
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            sys.exit(128 + signum)
+    signal.signal(signal.SIGTERM, handler)
+    return previous
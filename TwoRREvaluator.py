@@ -0,0 +1,550 @@
+# Incremental evaluation of the constraints of a TwoRRProblem
+# for local search. The evaluator keeps a schedule together with
+# running counts for every constraint, computes the exact change
+# of the hard and soft penalties for a neighbourhood move, and
+# updates its state in place when a move is accepted.
+#
+# The semantics are the same of TwoRRValidator.validate_constraint.
+# The schedule must be a valid compact double round robin, i.e.,
+# each team plays exactly one game in each slot, which is
+# preserved by all the moves below.
+#
+# Moves are tuples:
+#   ("SwapHomes", t1, t2)            swaps home and away of the two games between t1 and t2
+#   ("SwapRounds", s1, s2)           swaps all the games of slots s1 and s2
+#   ("SwapTeams", t1, t2)            swaps the schedules of t1 and t2 (except their mutual games)
+#   ("PartialSwapRounds", t, s1, s2) swaps the games of t in slots s1 and s2, and then of
+#                                    all the teams needed to repair the schedule
+#   ("PartialSwapTeams", t1, t2, s)  swaps the games of t1 and t2 in slot s, and then in
+#                                    all the slots needed to repair the schedule
+
+import numpy as np
+from TwoRRProblem import TwoRRProblem, Mode
+from TwoRRValidator import ScheduleTensors, validate_constraint_tensor
+
+MOVES = ["SwapHomes", "SwapRounds", "SwapTeams", "PartialSwapRounds", "PartialSwapTeams"]
+
+# Bound used for the counters that have no lower or upper limit
+NO_BOUND = 1 << 40
+
+
+class DeltaEvaluator():
+    # Stateful evaluator. The constraints are compiled into "counters",
+    # i.e., integer linear combinations of three kinds of inputs:
+    #   games:  1 if h plays home against a in slot s
+    #   flags:  1 if team t plays home (away) in slot s
+    #   breaks: 1 if team t has a home (away) break in slot s
+    # The diff of a counter with value c is max(c - hi, 0) + max(lo - c, 0)
+    # (using |c| for the separation counters) and the diff of a constraint
+    # is the sum of the diffs of its counters. The fairness constraints (FA2)
+    # take a maximum over the slots, so they are recomputed whenever one of
+    # their teams changes its home-away pattern.
+    def __init__(self, prob: TwoRRProblem, solution):
+        self.prob = prob
+        self.n_teams = len(prob.teams)
+        self.n_slots = len(prob.slots)
+
+        n_teams = self.n_teams
+        n_slots = self.n_slots
+
+        # Schedule: opponent[t, s] and home[t, s] (True if t plays home in s)
+        self.opponent = np.zeros((n_teams, n_slots), dtype=np.int64)
+        self.home = np.zeros((n_teams, n_slots), dtype=bool)
+        for slot, games in enumerate(solution):
+            for h, a in games:
+                self.opponent[h, slot] = a
+                self.opponent[a, slot] = h
+                self.home[h, slot] = True
+                self.home[a, slot] = False
+
+        self._compile()
+
+        self.counts = np.zeros(len(self.counter_hi), dtype=np.int64)
+        for layer, state in zip(self.layers, self._layer_states()):
+            inputs, counters, coefs = layer.coo
+            np.add.at(self.counts, counters, coefs * state[inputs])
+        self.fa2_diff = np.array([self._fa2_diff(fa2, self.home) for fa2 in self.fa2], dtype=np.int64)
+
+        counter_diff = self._counter_diff(self.counts)
+        self.hard_penalty = int((counter_diff * self.counter_penalty * self.counter_hard).sum())
+        self.soft_penalty = int((counter_diff * self.counter_penalty * ~self.counter_hard).sum())
+        for fa2, diff in zip(self.fa2, self.fa2_diff):
+            if fa2.hard:
+                self.hard_penalty += fa2.penalty * int(diff)
+            else:
+                self.soft_penalty += fa2.penalty * int(diff)
+
+    def _compile(self):
+        # Translates the constraints of the problem into counters
+        n_teams = self.n_teams
+        n_slots = self.n_slots
+
+        games = _Layer(n_teams * n_teams * n_slots)
+        flags = _Layer(n_teams * n_slots * 2)
+        breaks = _Layer(n_teams * n_slots * 2)
+        self.layers = [games, flags, breaks]
+        self.fa2 = []
+
+        counter_hi = []
+        counter_lo = []
+        counter_abs = []
+        counter_constraint = []
+
+        def game(h, a, s):
+            return (h * n_teams + a) * n_slots + s
+
+        def cell(t, s, away=False):
+            return (t * n_slots + s) * 2 + int(away)
+
+        def new_counter(ind, hi=NO_BOUND, lo=-NO_BOUND, absolute=False):
+            counter_hi.append(hi)
+            counter_lo.append(lo)
+            counter_abs.append(absolute)
+            counter_constraint.append(ind)
+            return len(counter_hi) - 1
+
+        def against(counter, team, other_teams, slots, mode):
+            # Terms counting the games of team against the other teams,
+            # in the same way of plays_home_against
+            for other in other_teams:
+                if other == team:
+                    continue
+                for slot in slots:
+                    if mode != Mode.H:
+                        games.add(game(other, team, slot), counter)
+                    if mode != Mode.A:
+                        games.add(game(team, other, slot), counter)
+
+        for (ind, constraint) in enumerate(self.prob.constraints):
+            c_name = constraint.name
+            # Capacity constraints:
+            if c_name == "CA1":
+                slots = constraint.slots
+                teams = constraint.teams
+                c_min = constraint.min
+                c_max = constraint.max
+                if (c_min > 0):
+                    raise Exception("Min value in CA1 not implemented!")
+                if constraint.mode not in [Mode.A, Mode.H]:
+                    raise Exception("Mode HA for CA1 not implemented!")
+                for team in teams:
+                    counter = new_counter(ind, hi=c_max)
+                    for slot in slots:
+                        flags.add(cell(team, slot, away=constraint.mode == Mode.A), counter)
+
+            if c_name == "CA2":
+                slots = constraint.slots
+                teams1 = constraint.teams1
+                teams2 = constraint.teams2
+                c_min = constraint.min
+                c_max = constraint.max
+                if (c_min > 0):
+                    raise Exception("Min value in CA2 not implemented!")
+                for team in teams1:
+                    counter = new_counter(ind, hi=c_max)
+                    against(counter, team, teams2, slots, constraint.mode1)
+
+            if c_name == "CA3":
+                teams1 = constraint.teams1
+                teams2 = constraint.teams2
+                c_min = constraint.min
+                c_max = constraint.max
+                intp = constraint.intp
+                if (c_min > 0):
+                    raise Exception("Min value in CA3 not implemented!")
+                for team in teams1:
+                    for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
+                        counter = new_counter(ind, hi=c_max)
+                        against(counter, team, teams2, slots, constraint.mode1)
+
+            if c_name == "CA4":
+                slots = constraint.slots
+                teams1 = constraint.teams1
+                teams2 = constraint.teams2
+                c_min = constraint.min
+                c_max = constraint.max
+                if (c_min > 0):
+                    raise Exception("Min value in CA4 not implemented!")
+                if constraint.mode2 == Mode.GLOBAL:
+                    counter = new_counter(ind, hi=c_max)
+                    for team in teams1:
+                        against(counter, team, teams2, slots, constraint.mode1)
+                else:
+                    for slot in slots:
+                        counter = new_counter(ind, hi=c_max)
+                        for team in teams1:
+                            against(counter, team, teams2, [slot], constraint.mode1)
+
+            # Game constraints
+            if c_name == "GA1":
+                slots = constraint.slots
+                meetings = constraint.meetings
+                c_min = constraint.min
+                c_max = constraint.max
+                counter = new_counter(ind, hi=c_max, lo=c_min)
+                for i, j in meetings:
+                    for slot in slots:
+                        games.add(game(i, j, slot), counter)
+
+            # Break constraints
+            if c_name == "BR1":
+                teams = constraint.teams
+                slots = [s for s in constraint.slots if s != 0]
+                intp = constraint.intp
+                for team in teams:
+                    if constraint.mode2 == Mode.A:
+                        away_counter = new_counter(ind, hi=intp)
+                        home_counter = new_counter(ind, hi=intp)
+                    else:
+                        away_counter = home_counter = new_counter(ind, hi=intp)
+                    for slot in slots:
+                        breaks.add(cell(team, slot, away=True), away_counter)
+                        breaks.add(cell(team, slot, away=False), home_counter)
+
+            if c_name == "BR2":
+                teams = constraint.teams
+                slots = [s for s in constraint.slots if s != 0]
+                intp = constraint.intp
+                counter = new_counter(ind, hi=intp)
+                for team in teams:
+                    for slot in slots:
+                        breaks.add(cell(team, slot, away=True), counter)
+                        breaks.add(cell(team, slot, away=False), counter)
+
+            # Fairness constraints
+            if c_name == "FA2":
+                self.fa2.append(_Fairness(ind, constraint))
+
+            # Separation constraints
+            if c_name == "SE1":
+                teams = constraint.teams
+                c_min = constraint.min
+                for i in range(len(teams)):
+                    for j in range(i + 1, len(teams)):
+                        counter = new_counter(ind, lo=c_min + 1, absolute=True)
+                        for slot in range(n_slots):
+                            games.add(game(teams[i], teams[j], slot), counter, slot)
+                            games.add(game(teams[j], teams[i], slot), counter, -slot)
+
+        for layer in self.layers:
+            layer.finalize()
+
+        penalties = [constraint.penalty for constraint in self.prob.constraints]
+        hard = [constraint.hard for constraint in self.prob.constraints]
+        self.counter_hi = np.array(counter_hi, dtype=np.int64)
+        self.counter_lo = np.array(counter_lo, dtype=np.int64)
+        self.counter_abs = np.array(counter_abs, dtype=bool)
+        self.counter_constraint = np.array(counter_constraint, dtype=np.int64)
+        self.counter_penalty = np.array(penalties + [0], dtype=np.int64)[self.counter_constraint]
+        self.counter_hard = np.array(hard + [False], dtype=bool)[self.counter_constraint]
+        for fa2 in self.fa2:
+            fa2.penalty = penalties[fa2.ind]
+            fa2.hard = hard[fa2.ind]
+
+    def _layer_states(self, home=None, opponent=None):
+        # Values of the inputs of the three layers for a schedule
+        if home is None:
+            home = self.home
+            opponent = self.opponent
+        n_teams = self.n_teams
+        n_slots = self.n_slots
+        teams, slots = np.nonzero(home)
+        game_state = np.zeros(n_teams * n_teams * n_slots, dtype=np.int64)
+        game_state[(teams * n_teams + opponent[teams, slots]) * n_slots + slots] = 1
+        flag_state = np.stack([home, ~home], axis=2).astype(np.int64).ravel()
+        previous = np.roll(home, 1, axis=1)
+        break_state = np.stack([home & previous, ~home & ~previous], axis=2).astype(np.int64).ravel()
+        return [game_state, flag_state, break_state]
+
+    def _counter_diff(self, counts):
+        values = np.where(self.counter_abs, np.abs(counts), counts)
+        return np.maximum(values - self.counter_hi, 0) + np.maximum(self.counter_lo - values, 0)
+
+    def _fa2_diff(self, fa2, home):
+        # Same as the FA2 branch of validate_constraint_tensor
+        home_games = np.cumsum(home, axis=1)[np.ix_(fa2.teams, fa2.slots)]
+        gaps = np.maximum(np.abs(home_games[:, None, :] - home_games[None, :, :]) - fa2.intp, 0)
+        largest = gaps.max(axis=2)
+        return int(np.where(fa2.same, 0, largest).sum())
+
+    def move_cells(self, move):
+        # Returns the cells changed by a move as a dictionary
+        # {(team, slot): (new opponent, new home)}, or an empty
+        # dictionary if the move does not change the schedule.
+        name = move[0]
+        opponent = self.opponent
+        home = self.home
+        cells = dict()
+
+        if name == "SwapHomes":
+            t1, t2 = move[1], move[2]
+            if t1 == t2:
+                return cells
+            for slot in np.nonzero(opponent[t1] == t2)[0]:
+                cells[t1, slot] = (t2, not home[t1, slot])
+                cells[t2, slot] = (t1, not home[t2, slot])
+
+        elif name == "SwapRounds":
+            s1, s2 = move[1], move[2]
+            if s1 == s2:
+                return cells
+            for team in range(self.n_teams):
+                cells[team, s1] = (opponent[team, s2], home[team, s2])
+                cells[team, s2] = (opponent[team, s1], home[team, s1])
+
+        elif name == "SwapTeams":
+            t1, t2 = move[1], move[2]
+            if t1 == t2:
+                return cells
+            for slot in range(self.n_slots):
+                if opponent[t1, slot] == t2:
+                    continue
+                o1, o2 = opponent[t1, slot], opponent[t2, slot]
+                cells[t1, slot] = (o2, home[t2, slot])
+                cells[t2, slot] = (o1, home[t1, slot])
+                cells[o1, slot] = (t2, home[o1, slot])
+                cells[o2, slot] = (t1, home[o2, slot])
+
+        elif name == "PartialSwapRounds":
+            team, s1, s2 = move[1], move[2], move[3]
+            if s1 == s2:
+                return cells
+            # Closure of the teams whose games must be swapped
+            teams = {team}
+            queue = [team]
+            while queue:
+                t = queue.pop()
+                for other in (opponent[t, s1], opponent[t, s2]):
+                    if other not in teams:
+                        teams.add(other)
+                        queue.append(other)
+            for t in teams:
+                cells[t, s1] = (opponent[t, s2], home[t, s2])
+                cells[t, s2] = (opponent[t, s1], home[t, s1])
+
+        elif name == "PartialSwapTeams":
+            t1, t2, slot = move[1], move[2], move[3]
+            if t1 == t2:
+                return cells
+            # Closure of the slots in which the games of t1 and t2 must be
+            # swapped, so that both teams keep meeting each opponent once
+            # at home and once away. The move is not possible if the closure
+            # contains a game between t1 and t2.
+            slots = set()
+            queue = [slot]
+            while queue:
+                s = queue.pop()
+                if s in slots:
+                    continue
+                if opponent[t1, s] == t2:
+                    return dict()
+                slots.add(s)
+                # t1 takes the game of t2 in s, so the slot in which t1
+                # already played that game must be swapped too.
+                queue.extend(np.nonzero((opponent[t1] == opponent[t2, s]) &
+                                        (home[t1] == home[t2, s]))[0])
+            for s in slots:
+                o1, o2 = opponent[t1, s], opponent[t2, s]
+                cells[t1, s] = (o2, home[t2, s])
+                cells[t2, s] = (o1, home[t1, s])
+                cells[o1, s] = (t2, home[o1, s])
+                cells[o2, s] = (t1, home[o2, s])
+        else:
+            raise Exception("Unknown move " + str(name) + "!")
+
+        return {(int(t), int(s)): (int(o), bool(h)) for (t, s), (o, h) in cells.items()
+                    if opponent[t, s] != o or home[t, s] != h}
+
+    def _input_deltas(self, cells):
+        # Changes of the inputs of the three layers caused by the cells
+        n_teams = self.n_teams
+        n_slots = self.n_slots
+        opponent = self.opponent
+        home = self.home
+
+        game_deltas = dict()
+        flag_deltas = dict()
+        new_home = dict()
+        for (t, s), (o, h) in cells.items():
+            if home[t, s]:
+                g = (t * n_teams + opponent[t, s]) * n_slots + s
+                game_deltas[g] = game_deltas.get(g, 0) - 1
+            if h:
+                g = (t * n_teams + o) * n_slots + s
+                game_deltas[g] = game_deltas.get(g, 0) + 1
+            if h != home[t, s]:
+                new_home[t, s] = h
+                sign = 1 if h else -1
+                flag_deltas[(t * n_slots + s) * 2] = sign
+                flag_deltas[(t * n_slots + s) * 2 + 1] = -sign
+
+        break_deltas = dict()
+        visited = set()
+        for (t, s) in new_home:
+            for slot in (s, (s + 1) % n_slots):
+                if (t, slot) in visited:
+                    continue
+                visited.add((t, slot))
+                before = slot - 1 if slot > 0 else n_slots - 1
+                old_cur, old_prev = home[t, slot], home[t, before]
+                new_cur = new_home.get((t, slot), old_cur)
+                new_prev = new_home.get((t, before), old_prev)
+                index = (t * n_slots + slot) * 2
+                home_delta = int(new_cur and new_prev) - int(old_cur and old_prev)
+                away_delta = int(not new_cur and not new_prev) - int(not old_cur and not old_prev)
+                if home_delta != 0:
+                    break_deltas[index] = home_delta
+                if away_delta != 0:
+                    break_deltas[index + 1] = away_delta
+
+        return [game_deltas, flag_deltas, break_deltas], new_home
+
+    def _evaluate(self, cells):
+        # Computes the changes of the counters and of the penalties
+        deltas, new_home = self._input_deltas(cells)
+        counter_parts = []
+        value_parts = []
+        for layer, layer_deltas in zip(self.layers, deltas):
+            for index, delta in layer_deltas.items():
+                if delta == 0:
+                    continue
+                begin, end = layer.indptr[index], layer.indptr[index + 1]
+                if begin == end:
+                    continue
+                counter_parts.append(layer.counters[begin:end])
+                value_parts.append(layer.coefs[begin:end] * delta)
+
+        if len(counter_parts) > 0:
+            counters, inverse = np.unique(np.concatenate(counter_parts), return_inverse=True)
+            values = np.zeros(len(counters), dtype=np.int64)
+            np.add.at(values, inverse, np.concatenate(value_parts))
+        else:
+            counters = np.zeros(0, dtype=np.int64)
+            values = np.zeros(0, dtype=np.int64)
+
+        old_counts = self.counts[counters]
+        new_counts = old_counts + values
+        hi = self.counter_hi[counters]
+        lo = self.counter_lo[counters]
+        absolute = self.counter_abs[counters]
+        old_values = np.where(absolute, np.abs(old_counts), old_counts)
+        new_values = np.where(absolute, np.abs(new_counts), new_counts)
+        change = (np.maximum(new_values - hi, 0) + np.maximum(lo - new_values, 0)) - \
+                 (np.maximum(old_values - hi, 0) + np.maximum(lo - old_values, 0))
+        change = change * self.counter_penalty[counters]
+        hard = self.counter_hard[counters]
+        delta_hard = int(change[hard].sum())
+        delta_soft = int(change[~hard].sum())
+
+        fa2_changes = []
+        if len(new_home) > 0 and len(self.fa2) > 0:
+            changed_teams = {t for t, _ in new_home}
+            home = None
+            for i, fa2 in enumerate(self.fa2):
+                if changed_teams.isdisjoint(fa2.team_set):
+                    continue
+                if home is None:
+                    home = self.home.copy()
+                    for (t, s), h in new_home.items():
+                        home[t, s] = h
+                diff = self._fa2_diff(fa2, home)
+                fa2_changes.append((i, diff))
+                change = fa2.penalty * (diff - int(self.fa2_diff[i]))
+                if fa2.hard:
+                    delta_hard += change
+                else:
+                    delta_soft += change
+
+        return delta_hard, delta_soft, (counters, new_counts, fa2_changes)
+
+    def delta(self, move):
+        # Returns the exact change (delta hard penalty, delta soft penalty)
+        # caused by a move, without changing the state.
+        cells = self.move_cells(move)
+        if len(cells) == 0:
+            return 0, 0
+        delta_hard, delta_soft, _ = self._evaluate(cells)
+        return delta_hard, delta_soft
+
+    def apply(self, move):
+        # Applies a move, updating the schedule and the counters in place.
+        # Returns the change (delta hard penalty, delta soft penalty).
+        cells = self.move_cells(move)
+        if len(cells) == 0:
+            return 0, 0
+        delta_hard, delta_soft, (counters, new_counts, fa2_changes) = self._evaluate(cells)
+        self.counts[counters] = new_counts
+        for i, diff in fa2_changes:
+            self.fa2_diff[i] = diff
+        for (t, s), (o, h) in cells.items():
+            self.opponent[t, s] = o
+            self.home[t, s] = h
+        self.hard_penalty += delta_hard
+        self.soft_penalty += delta_soft
+        return delta_hard, delta_soft
+
+    def is_phased(self):
+        # Checks that every pair of teams meets once in each half
+        # of the season, as required by the phased game mode.
+        half = self.n_slots // 2
+        first = np.sort(self.opponent[:, :half], axis=1)
+        expected = np.array([[o for o in range(self.n_teams) if o != t] for t in range(self.n_teams)])
+        return bool((first == expected).all())
+
+    def solution(self):
+        # Returns the current schedule in the format of the validator
+        solution = []
+        for slot in range(self.n_slots):
+            teams = np.nonzero(self.home[:, slot])[0]
+            solution.append([(int(t), int(self.opponent[t, slot])) for t in teams])
+        return solution
+
+    def check(self):
+        # Recomputes the penalties from scratch with the validator.
+        # Useful for debugging: returns True if the running counts agree.
+        tensors = ScheduleTensors(self.prob, self.solution())
+        hard = 0
+        soft = 0
+        for constraint in self.prob.constraints:
+            _, _, penalty = validate_constraint_tensor(self.prob, tensors, constraint)
+            if constraint.hard:
+                hard += penalty
+            else:
+                soft += penalty
+        return hard == self.hard_penalty and soft == self.soft_penalty
+
+
+class _Layer():
+    # Sparse map from the inputs of a layer to the counters,
+    # stored in compressed row format after finalize().
+    def __init__(self, n_inputs):
+        self.n_inputs = n_inputs
+        self.terms = ([], [], [])
+
+    def add(self, index, counter, coef=1):
+        self.terms[0].append(index)
+        self.terms[1].append(counter)
+        self.terms[2].append(coef)
+
+    def finalize(self):
+        inputs, counters, coefs = [np.array(v, dtype=np.int64) for v in self.terms]
+        self.terms = None
+        order = np.argsort(inputs, kind="stable")
+        self.coo = (inputs[order], counters[order], coefs[order])
+        self.counters = counters[order]
+        self.coefs = coefs[order]
+        self.indptr = np.zeros(self.n_inputs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(inputs, minlength=self.n_inputs), out=self.indptr[1:])
+
+
+class _Fairness():
+    # Pre-parsed FA2 constraint
+    def __init__(self, ind, constraint):
+        self.ind = ind
+        self.teams = np.array(constraint.teams, dtype=np.int64)
+        self.slots = np.sort(np.array(constraint.slots, dtype=np.int64))
+        self.intp = constraint.intp
+        self.team_set = set(self.teams.tolist())
+        self.same = self.teams[:, None] == self.teams[None, :]
+        self.penalty = 0
+        self.hard = False
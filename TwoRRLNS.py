@@ -0,0 +1,217 @@
+# This file contains a large neighbourhood search (LNS) to improve
+# a feasible schedule: a part of the schedule is freed and solved
+# again with Gurobi, everything else being fixed, and the new
+# schedule is kept only if its soft objective is better. The model
+# is the full model of build_naive_matrix, built once and kept warm:
+# each iteration only changes the bounds of the game variables.
+#
+# Usage: python TwoRRLNS.py <instance> <solution> [--budget 60] [--workers 1]
+
+# pylint: disable=no-name-in-module, no-member
+
+import os, time
+import queue
+import random
+import argparse
+import multiprocessing
+import numpy as np
+from gurobipy import GRB
+from TwoRRProblem import TwoRRProblem, read_instance, read_solution, array_from_solution, solution_from_array, write_solution_tuples
+from TwoRRValidator import validate_solution
+from TwoRROptimization import build_naive_matrix
+from TwoRRPortfolio import IncumbentExchange
+from TwoRRRun import RunDirectory
+
+# Neighbourhoods: the games of a group of teams, the games of a
+# window of slots, the games of the teams of a violated soft constraint
+NEIGHBOURHOODS = ["teams", "slots", "constraint"]
+
+# Time limit of each iteration, in seconds
+ITERATION_TIME = 10
+
+def objective(prob, solution):
+    # (hard, soft) objective of a schedule, as in the reports of the master
+    obj_hard = 0
+    obj_soft = 0
+    for constraint, (violated, _, penalty) in zip(prob.constraints, validate_solution(prob, solution)):
+        if violated:
+            if constraint.hard:
+                obj_hard += penalty
+            else:
+                obj_soft += penalty
+    return obj_hard, obj_soft
+
+class LNS():
+    # LNS from a feasible schedule, with the given neighbourhoods used
+    # in turn. The size of each neighbourhood grows when its subproblems
+    # are solved to optimality without improvement, and shrinks when
+    # they hit the time limit.
+    def __init__(self, prob: TwoRRProblem, solution, neighbourhoods=NEIGHBOURHOODS, seed=0, debug=False):
+        self.prob = prob
+        self.n_teams = len(prob.teams)
+        self.n_slots = len(prob.slots)
+        self.neighbourhoods = neighbourhoods
+        self.rng = random.Random(seed)
+        self.debug = debug
+
+        self.model, self.x_array = build_naive_matrix(prob, False, 0, False, False)
+        self.model.setParam("OutputFlag", 0)
+        self.model.setParam("Threads", 1)
+        self.size = {"teams": max(2, self.n_teams // 5), "slots": max(2, self.n_slots // 6), "constraint": max(2, self.n_teams // 4)}
+        self.max_size = {"teams": self.n_teams, "slots": self.n_slots, "constraint": self.n_teams}
+
+        obj_hard, obj_soft = objective(prob, solution)
+        if obj_hard != 0:
+            raise Exception("LNS needs a feasible schedule")
+        self.best = solution
+        self.best_obj = obj_soft
+        self.iterations = 0
+
+    def set_incumbent(self, obj, solution):
+        # Adopts a schedule found elsewhere, if it is better
+        if obj < self.best_obj:
+            self.best = solution
+            self.best_obj = obj
+
+    def neighbourhood(self, kind):
+        # Mask of the freed game variables x[home, away, slot], or None
+        # if there is nothing to free (no violated soft constraint)
+        free = np.zeros((self.n_teams, self.n_teams, self.n_slots), dtype=bool)
+        size = self.size[kind]
+        if kind == "slots":
+            start = self.rng.randrange(self.n_slots - size + 1)
+            free[:, :, start:start + size] = True
+            return free
+        if kind == "teams":
+            teams = self.rng.sample(range(self.n_teams), size)
+        else:
+            violated = [constraint for constraint, (is_violated, _, _) in
+                        zip(self.prob.constraints, validate_solution(self.prob, self.best))
+                        if is_violated and not constraint.hard]
+            if len(violated) == 0:
+                return None
+            constraint = self.rng.choices(violated, weights=[c.penalty for c in violated])[0]
+            teams = sorted(set(constraint.teams) | set(constraint.teams1) | set(constraint.teams2) |
+                           set(team for meeting in constraint.meetings for team in meeting))
+            if len(teams) > size:
+                teams = self.rng.sample(teams, size)
+        free[teams, :, :] = True
+        free[:, teams, :] = True
+        return free
+
+    def step(self, kind, time_limit=ITERATION_TIME):
+        # Solves the subproblem of a neighbourhood. Returns True if
+        # the schedule improved.
+        free = self.neighbourhood(kind)
+        if free is None:
+            return False
+        index = self.x_array.index
+        values = array_from_solution(self.best, self.n_teams, self.n_slots)[index]
+        free = free[index]
+        x = self.x_array.vars
+        self.model.setAttr("LB", x, np.where(free, 0, values).tolist())
+        self.model.setAttr("UB", x, np.where(free, 1, values).tolist())
+        self.model.setAttr("Start", x, values.tolist())
+        self.model.setParam("Cutoff", self.best_obj - 0.5)
+        self.model.setParam("TimeLimit", time_limit)
+        self.model.optimize()
+        self.iterations += 1
+
+        improved = False
+        if self.model.SolCount > 0:
+            solution = solution_from_array(self.x_array.values(self.model))
+            obj_hard, obj_soft = objective(self.prob, solution)
+            if obj_hard == 0 and obj_soft < self.best_obj:
+                if self.debug:
+                    print(f"LNS: {kind} neighbourhood of size {self.size[kind]}: {self.best_obj} -> {obj_soft}")
+                self.best = solution
+                self.best_obj = obj_soft
+                improved = True
+        if not improved:
+            if self.model.Status == GRB.TIME_LIMIT:
+                self.size[kind] = max(2, self.size[kind] - 1)
+            else:
+                self.size[kind] = min(self.max_size[kind], self.size[kind] + 1)
+        return improved
+
+    def run(self, budget, iteration_time=ITERATION_TIME, incumbents=None):
+        # Iterates over the neighbourhoods until the budget (in seconds)
+        # runs out or the soft objective is 0. With incumbents (see
+        # TwoRRPortfolio) the improvements are shared with other searches.
+        end = time.time() + budget
+        while self.best_obj > 0 and time.time() < end:
+            if incumbents is not None:
+                for obj, solution in incumbents.poll():
+                    self.set_incumbent(obj, solution)
+            kind = self.neighbourhoods[self.iterations % len(self.neighbourhoods)]
+            if self.step(kind, min(iteration_time, max(1, end - time.time()))) and incumbents is not None:
+                incumbents.publish(self.best_obj, self.best)
+        return self.best_obj, self.best
+
+def run_worker(filename, solution, budget, iteration_time, neighbourhoods, seed, outbox, inbox):
+    # One of the searches of solve_lns, in its own process
+    lns = LNS(read_instance(filename), solution, neighbourhoods, seed)
+    incumbents = IncumbentExchange(seed, outbox, inbox)
+    lns.run(budget, iteration_time, incumbents)
+    outbox.put(("done", seed, lns.best_obj, None))
+
+def solve_lns(filename, solution, budget, workers=1, iteration_time=ITERATION_TIME, seed=0, debug=False):
+    # Improves a feasible schedule of the instance with LNS for the
+    # budget (in seconds). With workers > 1 each worker process uses
+    # a different neighbourhood (and seed), and the improvements are
+    # shared between them. Returns the soft objective and the schedule.
+    if workers <= 1:
+        lns = LNS(read_instance(filename), solution, seed=seed, debug=debug)
+        return lns.run(budget, iteration_time)
+
+    outbox = multiprocessing.Queue()
+    inboxes = [multiprocessing.Queue() for _ in range(workers)]
+    processes = [multiprocessing.Process(target=run_worker,
+                                         args=(filename, solution, budget, iteration_time,
+                                               [NEIGHBOURHOODS[worker % len(NEIGHBOURHOODS)]],
+                                               seed + worker, outbox, inboxes[worker]))
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+
+    best_obj, best = objective(read_instance(filename), solution)[1], solution
+    running = workers
+    while running > 0:
+        try:
+            kind, worker, obj, new_solution = outbox.get(timeout=1.0)
+        except queue.Empty:
+            running = sum(process.is_alive() for process in processes)
+            continue
+        if kind == "done":
+            running -= 1
+        elif obj < best_obj:
+            best_obj, best = obj, new_solution
+            if debug:
+                print(f"LNS: new best solution {obj} from worker {worker - seed}")
+            for other in range(workers):
+                if other != worker - seed:
+                    inboxes[other].put((obj, new_solution))
+    for process in processes:
+        process.join()
+    return best_obj, best
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Improves a feasible schedule with large neighbourhood search.")
+    parser.add_argument("instance")
+    parser.add_argument("solution", help="solution file (xml)")
+    parser.add_argument("--budget", type=float, default=60, help="time budget, in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--iteration-time", type=float, default=ITERATION_TIME)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    prob = read_instance(args.instance)
+    solution = read_solution(args.solution)
+    start_obj = objective(prob, solution)[1]
+    obj, solution = solve_lns(args.instance, solution, args.budget, args.workers, args.iteration_time, args.seed, debug=True)
+    print(f"LNS: {start_obj} -> {obj}")
+    if obj < start_obj:
+        with RunDirectory(args.instance) as run_dir:
+            output_filename = run_dir.output(f"{os.path.basename(args.instance)}_solution_{obj}.xml")
+            write_solution_tuples(output_filename, prob, solution, obj)
+        print(f"Solution written to {output_filename}")
@@ -0,0 +1,249 @@
+# This file contains a license-free local search to improve a
+# schedule: simulated annealing or tabu search over the classic
+# double round robin neighbourhoods (see TwoRREvaluator), without
+# Gurobi. Every move is evaluated incrementally by DeltaEvaluator,
+# which agrees with TwoRRValidator.
+#
+# The search minimizes HARD_WEIGHT * hard penalty + soft penalty, so
+# it can also start from an infeasible schedule, and it keeps the best
+# schedule by (hard, soft). With --iterations the chains stop after a
+# fixed number of moves (with no time budget unless --budget is given),
+# and the same seed gives the same schedule.
+#
+# Usage: python TwoRRLocalSearch.py <instance> <solution> [--method sa] [--budget 60] [--chains 1] [--seed 0]
+
+import os, time
+import math
+import random
+import argparse
+import concurrent.futures
+from TwoRRProblem import TwoRRProblem, read_instance, read_solution, write_solution_tuples
+from TwoRREvaluator import MOVES, DeltaEvaluator
+from TwoRRRun import RunDirectory
+
+METHODS = ["sa", "tabu"]
+
+# Weight of the hard penalty in the cost of a schedule
+HARD_WEIGHT = 1000
+
+# Random moves sampled to set the initial temperature of the annealing,
+# and final temperature (a worsening of 1 is accepted with probability
+# exp(-2) at the end)
+TEMPERATURE_SAMPLES = 200
+FINAL_TEMPERATURE = 0.5
+
+# Moves sampled in each iteration of the tabu search, and tabu tenure
+TABU_CANDIDATES = 50
+TABU_TENURE = 10
+
+def random_move(evaluator: DeltaEvaluator, rng, phased=False):
+    # A random move. In a phased schedule the two slots of SwapRounds
+    # and PartialSwapRounds are in the same half, so that every pair
+    # of teams still meets once in each half (SwapHomes and SwapTeams
+    # always keep the phases, PartialSwapTeams is checked by
+    # keeps_phases).
+    name = rng.choice(MOVES)
+    n_teams = evaluator.n_teams
+    n_slots = evaluator.n_slots
+    if name in ("SwapRounds", "PartialSwapRounds"):
+        if phased:
+            half = n_slots // 2
+            offset = rng.choice([0, half])
+            s1, s2 = rng.sample(range(half), 2)
+            s1, s2 = s1 + offset, s2 + offset
+        else:
+            s1, s2 = rng.sample(range(n_slots), 2)
+        if name == "SwapRounds":
+            return (name, s1, s2)
+        return (name, rng.randrange(n_teams), s1, s2)
+    t1, t2 = rng.sample(range(n_teams), 2)
+    if name == "PartialSwapTeams":
+        return (name, t1, t2, rng.randrange(n_slots))
+    return (name, t1, t2)
+
+def keeps_phases(evaluator: DeltaEvaluator, move):
+    # Checks that a PartialSwapTeams keeps every pair of teams meeting
+    # once in each half: the repair chain may cross the halves
+    if move[0] != "PartialSwapTeams":
+        return True
+    half = evaluator.n_slots // 2
+    cells = evaluator.move_cells(move)
+    first = dict()
+    for (t, s), (o, _) in cells.items():
+        if s < half:
+            if t not in first:
+                first[t] = set(evaluator.opponent[t, :half].tolist())
+            first[t].discard(int(evaluator.opponent[t, s]))
+    for (t, s), (o, _) in cells.items():
+        if s < half:
+            first[t].add(o)
+    return all(len(opponents) == half for opponents in first.values())
+
+class LocalSearch():
+    # Local search from a schedule. step() tries one move of the
+    # method, run() iterates until the budget (in seconds) or the
+    # iterations run out, or the schedule has no penalty.
+    def __init__(self, prob: TwoRRProblem, solution, method="sa", seed=0, debug=False):
+        self.prob = prob
+        self.method = method
+        self.rng = random.Random(seed)
+        self.debug = debug
+        self.evaluator = DeltaEvaluator(prob, solution)
+        self.phased = prob.game_mode == "P"
+        if self.phased and not self.evaluator.is_phased():
+            raise Exception("The schedule is not phased")
+
+        self.best = solution
+        self.best_obj = (self.evaluator.hard_penalty, self.evaluator.soft_penalty)
+        self.iterations = 0
+        self.tabu = dict()
+        self.temperature = None
+
+    def cost(self):
+        return HARD_WEIGHT * self.evaluator.hard_penalty + self.evaluator.soft_penalty
+
+    def sample_move(self):
+        while True:
+            move = random_move(self.evaluator, self.rng, self.phased)
+            if not self.phased or keeps_phases(self.evaluator, move):
+                return move
+
+    def initial_temperature(self):
+        # Median increase of the soft penalty of random moves: about a
+        # third of the moves that worsen the soft penalty only are
+        # accepted at the start. The hard part is left out: most random
+        # moves break a hard constraint, and HARD_WEIGHT would dominate
+        # the median (few moves keep the hard penalty, too few to sample).
+        increases = []
+        for _ in range(TEMPERATURE_SAMPLES):
+            delta_hard, delta_soft = self.evaluator.delta(self.sample_move())
+            if delta_soft > 0:
+                increases.append(delta_soft)
+        if len(increases) == 0:
+            return FINAL_TEMPERATURE
+        return max(FINAL_TEMPERATURE, sorted(increases)[len(increases) // 2])
+
+    def update_best(self):
+        obj = (self.evaluator.hard_penalty, self.evaluator.soft_penalty)
+        if obj < self.best_obj:
+            if self.debug:
+                print(f"Local search: iteration {self.iterations}: {self.best_obj} -> {obj}")
+            self.best = self.evaluator.solution()
+            self.best_obj = obj
+
+    def step_annealing(self, progress):
+        # One move of simulated annealing, with a geometric cooling
+        # over the progress (from 0 to 1) of the run
+        if self.temperature is None:
+            self.temperature = self.initial_temperature()
+        temperature = self.temperature * (FINAL_TEMPERATURE / self.temperature) ** progress
+        move = self.sample_move()
+        delta_hard, delta_soft = self.evaluator.delta(move)
+        delta = HARD_WEIGHT * delta_hard + delta_soft
+        if delta <= 0 or self.rng.random() < math.exp(-delta / temperature):
+            self.evaluator.apply(move)
+            if delta < 0:
+                self.update_best()
+
+    def step_tabu(self, progress):
+        # One move of tabu search: the best of TABU_CANDIDATES random
+        # moves that is not tabu (or that gives a new best schedule),
+        # even if it is worse. Moves are their own inverse (up to the
+        # repair chains), so a move is tabu for a few iterations after
+        # it has been applied. Moves that increase the hard penalty are
+        # left out: they are most of the random moves, and the tabu
+        # list would then keep the search from repairing them.
+        best_cost = HARD_WEIGHT * self.best_obj[0] + self.best_obj[1]
+        cost = self.cost()
+        chosen = None
+        for _ in range(TABU_CANDIDATES):
+            move = self.sample_move()
+            delta_hard, delta_soft = self.evaluator.delta(move)
+            if delta_hard > 0:
+                continue
+            delta = HARD_WEIGHT * delta_hard + delta_soft
+            if delta == 0 and len(self.evaluator.move_cells(move)) == 0:
+                continue
+            if self.tabu.get(move, -1) >= self.iterations and cost + delta >= best_cost:
+                continue
+            if chosen is None or delta < chosen[1]:
+                chosen = (move, delta)
+        if chosen is None:
+            return
+        move, delta = chosen
+        self.evaluator.apply(move)
+        self.tabu[move] = self.iterations + TABU_TENURE + self.rng.randrange(TABU_TENURE)
+        if delta < 0:
+            self.update_best()
+
+    def run(self, budget=None, iterations=None):
+        # The progress of the run is the fraction of the iterations if
+        # they are given (reproducible), otherwise of the budget. The
+        # budget can be None (unlimited) only with iterations.
+        if budget is None and iterations is None:
+            raise Exception("The local search needs a budget or a number of iterations")
+        start = time.time()
+        step = self.step_annealing if self.method == "sa" else self.step_tabu
+        while self.best_obj != (0, 0):
+            elapsed = time.time() - start
+            if budget is not None and elapsed >= budget:
+                break
+            if iterations is not None:
+                if self.iterations >= iterations:
+                    break
+                progress = self.iterations / iterations
+            else:
+                progress = elapsed / budget
+            step(progress)
+            self.iterations += 1
+        return self.best_obj, self.best
+
+def run_chain(filename, solution, method, budget, iterations, seed):
+    # One chain of solve_local_search, in its own process
+    search = LocalSearch(read_instance(filename), solution, method, seed)
+    return search.run(budget, iterations)
+
+def solve_local_search(filename, solution, method="sa", budget=60, iterations=None, chains=1, seed=0, debug=False):
+    # Improves a schedule of the instance with independent chains of
+    # the local search (seeds seed, seed + 1, ...), in a process pool
+    # if chains > 1. Returns the best (hard, soft) objective and its
+    # schedule; ties go to the chain with the smallest seed.
+    if chains <= 1:
+        search = LocalSearch(read_instance(filename), solution, method, seed, debug)
+        return search.run(budget, iterations)
+
+    with concurrent.futures.ProcessPoolExecutor(chains) as executor:
+        futures = [executor.submit(run_chain, filename, solution, method, budget, iterations, seed + chain)
+                   for chain in range(chains)]
+        results = [future.result() for future in futures]
+    if debug:
+        for chain, (obj, _) in enumerate(results):
+            print(f"Local search: chain {chain} (seed {seed + chain}): {obj}")
+    return min(results, key=lambda result: result[0])
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Improves a schedule with simulated annealing or tabu search.")
+    parser.add_argument("instance")
+    parser.add_argument("solution", help="solution file (xml)")
+    parser.add_argument("--method", choices=METHODS, default="sa")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="time budget of each chain, in seconds (default: 60, unlimited with --iterations)")
+    parser.add_argument("--iterations", type=int, default=None, help="moves of each chain (reproducible runs)")
+    parser.add_argument("--chains", type=int, default=1, help="independent chains, run in a process pool")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.budget is None and args.iterations is None:
+        args.budget = 60
+
+    prob = read_instance(args.instance)
+    solution = read_solution(args.solution)
+    start_obj = DeltaEvaluator(prob, solution)
+    start_obj = (start_obj.hard_penalty, start_obj.soft_penalty)
+    obj, solution = solve_local_search(args.instance, solution, args.method, args.budget, args.iterations,
+                                       args.chains, args.seed, debug=True)
+    print(f"Local search: {start_obj} -> {obj}")
+    if obj < start_obj and obj[0] == 0:
+        with RunDirectory(args.instance) as run_dir:
+            output_filename = run_dir.output(f"{os.path.basename(args.instance)}_solution_{obj[1]}.xml")
+            write_solution_tuples(output_filename, prob, solution, obj[1])
+        print(f"Solution written to {output_filename}")
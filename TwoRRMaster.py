@@ -4,30 +4,183 @@
 
 # pylint: disable=no-name-in-module, no-member
 
-import os, sys
+import os, sys, time
 import subprocess
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 
 
 #os.environ["GRB_LICENSE_FILE"] = "C:\\gurobi\\gurobi-ac.lic"
 import gurobipy as gp
 from gurobipy import GRB
-from TwoRRProblem import TwoRRProblem, write_solution, read_multiple_solutions, write_solution_tuples
-from TwoRRValidator import validate_constraint
+import numpy as np
+from TwoRRProblem import TwoRRProblem, Mode, VarArray, write_solution, write_solution_tuples, array_from_solution
+from TwoRRValidator import validate_solution
+from TwoRRProtocol import pack_pattern, parse_slave_line
+from TwoRRSlaveCache import SlaveCache, games_solution, INFEASIBLE, TIMEOUT, FEASIBLE, OPTIMAL
 from TwoRRSlave import solve_slave, create_slave
-
-def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=True):
+from TwoRRPatternCheck import PatternChecker
+from TwoRRRun import RunDirectory
+from TwoRRLNS import solve_lns
+from TwoRRProfiles import apply_profile
+from TwoRRCheckpoint import MasterCheckpoint, REJECTED
+from TwoRRTelemetry import Telemetry, pattern_id
+from TwoRRProfiler import profiler, model_counter, PROFILE_MEMORY
+
+# Time limits of the external slave solver, for each ha pattern
+SLAVE_FEASIBILITY_TIMEOUT = 60*5 # 5 minutes until first feasible solution
+SLAVE_TIMEOUTS = ['--feasibility-timeout', str(int(SLAVE_FEASIBILITY_TIMEOUT)),
+                  '--optimization-solution-timeout', str(int(20*60)), # 20 minutes max between produced solutions
+                  '--total-optimization-timeout', str(int(2*60*60))] # 3 hour total optimization time
+# Ha patterns queued in the slave pool beyond the running jobs
+SLAVE_QUEUE = 2
+
+class SlaveServer():
+    # An external slave solver running in server mode: the instance
+    # is encoded once, then each ha pattern is sent on stdin and solved
+    # under assumptions, so that the process can be kept alive for
+    # the whole run of the master. Patterns and schedules are exchanged
+    # in the compact format of TwoRRProtocol.
+    def __init__(self, problem_filename):
+        self.process = subprocess.Popen(['./sportschedulingcompetition', '--server', '--compact', '--quiet'] + 
+                                        SLAVE_TIMEOUTS + [problem_filename],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
+                                        universal_newlines=True, bufsize=1)
+        self.status = None
+
+    def solve(self, solution):
+        # Generator of the solutions for the ha pattern, as soon as they
+        # are produced. At the end, status is "infeasible" or
+        # "done <lower bound> optimal|stopped", and core is the list
+        # of (team, slot) of an infeasible part of the pattern, if any.
+        self.status = None
+        self.core = None
+        self.process.stdin.write(pack_pattern(solution))
+        self.process.stdin.flush()
+        for line in self.process.stdout:
+            kind, data = parse_slave_line(line)
+            if kind == "schedule" or kind == "solution":
+                yield data
+            elif kind == "core":
+                self.core = data
+            elif kind == "error":
+                raise Exception("Invalid ha pattern for the slave server: " + data)
+            else:
+                self.status = line.strip()
+                return
+        raise Exception("The slave server terminated unexpectedly")
+
+    def close(self):
+        # An empty line stops the server
+        with suppress(OSError):
+            self.process.stdin.write("\n")
+            self.process.stdin.close()
+        self.process.wait()
+
+class MasterOptions():
+    # The options of a run of solve_master, built by run_single.py,
+    # the portfolio and the benchmark.
+    # With slave_workers > 0 the patterns are queued to
+    # a pool of that many slave processes, and the master
+    # keeps branching while they run. With slave_servers=True
+    # the slave processes are started once in server mode
+    # (see SlaveServer) and reused for all the patterns.
+    # Patterns and schedules go through pipes; with
+    # debug_files=True they are also exchanged as files
+    # in Temp/ of the run directory, as in the past, and the
+    # run directory is kept. The outcome of the slave for
+    # each pattern is stored in a persistent cache (see
+    # TwoRRSlaveCache), unless slave_cache=False.
+    # With pattern_check=True each pattern is first checked
+    # against necessary conditions (see TwoRRPatternCheck),
+    # and only the patterns that pass go to the slave.
+    # When the infeasible part of a pattern is known (the failed
+    # check, or the core reported by a slave server) the no-good
+    # cut is only over the variables of that part.
+    # threads is the number of threads used by Gurobi.
+    # With lns_budget > 0 the best schedule is then improved
+    # with LNS (see TwoRRLNS) for lns_budget seconds, on
+    # lns_workers processes.
+    # With checkpoint=True the cuts, the outcomes of the patterns
+    # and the best schedule are saved periodically and on SIGTERM
+    # (see TwoRRCheckpoint). With resume=True the cuts of the last
+    # checkpoint of the instance are added again, its best schedule
+    # is restored, and its patterns still without an outcome are
+    # sent to the slave again.
+    # With telemetry=True the events of the run (patterns, checks,
+    # slave runs, validations, new best schedules and the progress
+    # of the master) are logged to Logs/ (see TwoRRTelemetry).
+    # With profile=True (or TWORR_PROFILE=1) the time and memory
+    # of each phase are reported at the end (see TwoRRProfiler);
+    # profile="memory" traces the Python allocations, at a cost.
+    def __init__(self, slave_workers=0, slave_servers=False, debug_files=False, slave_cache=True,
+                 pattern_check=True, threads=1, lns_budget=0, lns_workers=1, checkpoint=True,
+                 resume=False, telemetry=True, profile=False):
+        self.slave_workers = slave_workers
+        self.slave_servers = slave_servers
+        self.debug_files = debug_files
+        self.slave_cache = slave_cache
+        self.pattern_check = pattern_check
+        self.threads = threads
+        self.lns_budget = lns_budget
+        self.lns_workers = lns_workers
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.telemetry = telemetry
+        self.profile = profile
+
+def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=True, options=None,
+                 run_dir=None, incumbents=None):
     # Set up and solve with Gurobi a "naive" model 
     # for the TwoRRProblem. The model is naive in
     # the sense that il follows the standard integer
     # programming techniques, building a large complex
     # model and hope that Gurobi will be able to handle
     # it. This works only for simple problems.
+    # options are the MasterOptions of the run (by default
+    # a single slave at a time, with all the checks).
+    # The files of the run (patterns, slave solutions, problem.lp)
+    # are written in run_dir (see TwoRRRun), by default a new
+    # directory removed at the end (kept with debug_files=True);
+    # the schedules go directly to Output/.
+    # incumbents exchanges schedules with the other strategies
+    # of a portfolio (see TwoRRPortfolio): the best schedules
+    # found by the slaves are published, and the ha patterns of
+    # the schedules received are used as heuristic solutions,
+    # so that the slave explores them.
+
+    options = options or MasterOptions()
+    slave_workers = options.slave_workers
+    slave_servers = options.slave_servers
+    debug_files = options.debug_files
+    slave_cache = options.slave_cache
+    pattern_check = options.pattern_check
+    threads = options.threads
+    lns_budget = options.lns_budget
+    lns_workers = options.lns_workers
+    checkpoint = options.checkpoint
+    resume = options.resume
+    telemetry = options.telemetry
+    profile = options.profile
+
+    if profile:
+        profiler.enable(profile == PROFILE_MEMORY)
 
     if debug:
         print(prob)
         
     problem_filename = filename
+    own_run_dir = run_dir is None
+    if own_run_dir:
+        run_dir = RunDirectory(filename, keep=debug_files)
+    if debug:
+        print(f"Run directory: {run_dir.path}")
+    profiler.begin(os.path.basename(run_dir.path))
+    events = Telemetry(os.path.basename(run_dir.path), prob.name, enabled=telemetry)
+    events.event("run_start", file=os.path.basename(filename), slave_workers=slave_workers,
+                 slave_servers=slave_servers, threads=threads, resume=resume)
 
     n_teams = len(prob.teams)
     n_slots = len(prob.slots)
@@ -35,8 +188,9 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
     # Create Gurobi model
     env = gp.Env()
     model = gp.Model(prob.name, env)
-    slave_model = create_slave(prob, env, skipSoft=True)
-    model.setParam("Threads", 1)
+    with profiler.phase("slave model"):
+        slave_model = create_slave(prob, env, skipSoft=True)
+    model.setParam("Threads", threads)
     model.setParam("LazyConstraints", 1)
 
     # Solution pool
@@ -50,6 +204,8 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
     model.setParam("Symmetry", 2)
     model.setParam("GomoryPasses", 1)
     model.setParam("PrePasses", 2)
+    # Profile of the instance (see TwoRRProfiles)
+    apply_profile(model, prob, "master", debug)
 
     if debug:
         print("Creating binary variables...")
@@ -57,19 +213,22 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
     # Create variables and store them in a dictionary:
     # m_vars[t, s] = 1 if team t plays home in slot s, 0 otherwise
     m_vars = dict()
-    for team in range(n_teams):
-        for slot in range(n_slots):
-            m_vars[team, slot] = model.addVar(vtype=GRB.BINARY, name="x_" + str(team) + "_" + str(slot))
+    with profiler.phase("variables", model_counter(model)):
+        for team in range(n_teams):
+            for slot in range(n_slots):
+                m_vars[team, slot] = model.addVar(vtype=GRB.BINARY, name="x_" + str(team) + "_" + str(slot))
+    x_array = VarArray(m_vars, (n_teams, n_slots))
 
     # 2RR constraints
 
     # In each slot, n_teams/2 home and n_teams/2 away
-    for slot in range(n_slots):
-        model.addConstr(gp.quicksum([m_vars[team, slot] for team in range(n_teams)]) == n_teams / 2)
-    
-    # For each team, n_slots/2 home and n_slots/2 away
-    for team in range(n_teams):
-        model.addConstr(gp.quicksum([m_vars[team, slot] for slot in range(n_slots)]) == n_slots / 2)
+    with profiler.phase("basic constraints", model_counter(model)):
+        for slot in range(n_slots):
+            model.addConstr(gp.quicksum([m_vars[team, slot] for team in range(n_teams)]) == n_teams / 2)
+
+        # For each team, n_slots/2 home and n_slots/2 away
+        for team in range(n_teams):
+            model.addConstr(gp.quicksum([m_vars[team, slot] for slot in range(n_slots)]) == n_slots / 2)
     
     # Additional vars that determine whether a team has an away break or a home break
     # in a certain slot.
@@ -92,26 +251,27 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
     if debug:
         print("Adding problem specific constraints...")
 
-    # Add problem specific constraints
-    for (ind, (c_name, constraint)) in enumerate(prob.constraints):
+    # Add problem specific constraints, with a phase for each family
+    for (ind, constraint) in profiler.each(enumerate(prob.constraints), lambda item: item[1].name, model_counter(model)):
+        c_name = constraint.name
         # Capacity constraints:
         if c_name == "CA1":
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            penalty = int(constraint["penalty"])
+            slots = constraint.slots
+            teams = constraint.teams
+            c_min = constraint.min
+            c_max = constraint.max
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA1 not implemented!")
             for team in teams:
-                if constraint["type"] == "HARD":
-                    if constraint["mode"] == "A":
+                if constraint.hard:
+                    if constraint.mode == Mode.A:
                         constr = model.addConstr(len(slots) - gp.quicksum([m_vars[team, slot]
                                             for slot in slots]) <= c_max,
                                         name="CA1_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                    elif constraint["mode"] == "H":
+                    elif constraint.mode == Mode.H:
                         constr = model.addConstr(gp.quicksum([m_vars[team, slot]
                                             for slot in slots]) <= c_max,
                                         name="CA1_" + str(team) + "_" + str(ind))
@@ -121,13 +281,13 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                         raise Exception("Mode HA for CA1 not implemented!")
                 elif not skipSoft:
                     slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
-                    if constraint["mode"] == "A":
+                    if constraint.mode == Mode.A:
                         constr = model.addConstr(len(slots) - gp.quicksum([m_vars[team, slot]
                                             for slot in slots]) - slack <= c_max,
                                         name="CA1_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                    elif constraint["mode"] == "H":
+                    elif constraint.mode == Mode.H:
                         constr = model.addConstr(gp.quicksum([m_vars[team, slot]
                                             for slot in slots]) - slack <= c_max,
                                         name="CA1_" + str(team) + "_" + str(ind))
@@ -136,28 +296,27 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                     else:
                         raise Exception("Mode HA for CA1 not implemented!")
         if c_name == "CA3":
-            if constraint["type"] != "HARD":
+            if not constraint.hard:
                 continue
-            teams1 = [int(t) for t in constraint["teams1"].split(';')]
-            teams2 = sorted([int(t) for t in constraint["teams2"].split(';')])
+            teams1 = constraint.teams1
             # We deal with this constraint in the master only if ii involves all the teams
-            if len(teams2) != n_teams or teams2[0] != 0 or teams2[-1] != (n_teams - 1):
+            if constraint.teams2_mask != (1 << n_teams) - 1:
                 continue
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            intp = int(constraint["intp"])
-            penalty = int(constraint["penalty"])
+            c_min = constraint.min
+            c_max = constraint.max
+            intp = constraint.intp
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA3 not implemented!")
             for team in teams1:
-                if constraint["mode1"] == "A":
+                if constraint.mode1 == Mode.A:
                     for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                         constr = model.addConstr(len(slots) - gp.quicksum([m_vars[team, slot] 
                                             for slot in slots]) <= c_max,
                                         name="CA3_" + str(team) + "_" + str(slots[0]) + "_" + str(slots[-1]) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                elif constraint["mode1"] == "H":
+                elif constraint.mode1 == Mode.H:
                     for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                         constr = model.addConstr(gp.quicksum([m_vars[team, slot] 
                                             for slot in slots]) <= c_max,
@@ -175,20 +334,19 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                             constr.Lazy = lazy
 
         if c_name == "CA4":
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            teams1 = [int(t) for t in constraint["teams1"].split(';')]
-            teams2 = sorted([int(t) for t in constraint["teams2"].split(';')])
+            slots = constraint.slots
+            teams1 = constraint.teams1
             # We deal with this constraint in the master only if ii involves all the teams
-            if len(teams2) != n_teams or teams2[0] != 0 or teams2[-1] != (n_teams - 1):
+            if constraint.teams2_mask != (1 << n_teams) - 1:
                 continue
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            penalty = int(constraint["penalty"])
+            c_min = constraint.min
+            c_max = constraint.max
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA4 not implemented!")
-            if constraint["type"] == "HARD":
-                if constraint["mode1"] == "A":
-                    if constraint["mode2"] == "GLOBAL":
+            if constraint.hard:
+                if constraint.mode1 == Mode.A:
+                    if constraint.mode2 == Mode.GLOBAL:
                         constr = model.addConstr(len(teams1) * len(slots) -
                                             gp.quicksum([m_vars[team, slot] 
                                                 for team in teams1
@@ -204,8 +362,8 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                                             name="CA4_" + str(slot) + "_" + str(ind))
                             if lazy:
                                 constr.Lazy = lazy
-                elif constraint["mode1"] == "H":
-                    if constraint["mode2"] == "GLOBAL":
+                elif constraint.mode1 == Mode.H:
+                    if constraint.mode2 == Mode.GLOBAL:
                         constr = model.addConstr(gp.quicksum([m_vars[team, slot] 
                                             for team in teams1
                                             for slot in slots]) <= c_max,
@@ -220,7 +378,7 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                             if lazy:
                                 constr.Lazy = lazy
                 else:
-                    if constraint["mode2"] == "GLOBAL":
+                    if constraint.mode2 == Mode.GLOBAL:
                         constr = model.addConstr(len(teams1) * len(slots) - 
                                             gp.quicksum([m_vars[team, slot] 
                                                 for team in teams1
@@ -244,20 +402,20 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
 
         # Break constraints
         if c_name == "BR1":
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            mode = constraint["mode2"]
-            intp = int(constraint["intp"])
-            penalty = int(constraint["penalty"])
-            if constraint["type"] == "HARD":
-                if mode == "A":
+            teams = constraint.teams
+            slots = constraint.slots
+            mode = constraint.mode2
+            intp = constraint.intp
+            penalty = constraint.penalty
+            if constraint.hard:
+                if mode == Mode.A:
                     for team in teams:
                         constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=True) 
                                             for slot in slots if slot != 0]) <= intp,
                                         name="BR1_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                elif mode == "H":
+                elif mode == Mode.H:
                     for team in teams:
                         constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=False) 
                                             for slot in slots if slot != 0]) <= intp,
@@ -272,7 +430,7 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                         if lazy:
                             constr.Lazy = lazy
             elif not skipSoft:
-                if mode == "A":
+                if mode == Mode.A:
                     for team in teams:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=True) 
@@ -280,7 +438,7 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                                         name="BR1_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                elif mode == "H":
+                elif mode == Mode.H:
                     for team in teams:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=False) 
@@ -297,11 +455,11 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                         if lazy:
                             constr.Lazy = lazy
         if c_name == "BR2":
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            intp = int(constraint["intp"])
-            penalty = int(constraint["penalty"])
-            if constraint["type"] == "HARD":
+            teams = constraint.teams
+            slots = constraint.slots
+            intp = constraint.intp
+            penalty = constraint.penalty
+            if constraint.hard:
                 constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=False) + get_break_var(team, slot, away=True)
                                     for team in teams
                                     for slot in slots if slot != 0]) <= intp,
@@ -318,11 +476,11 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                     constr.Lazy = lazy
         # Fairness constraints
         if c_name == "FA2":
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            slots = sorted([int(s) for s in constraint["slots"].split(';')])
-            intp = int(constraint["intp"])
-            penalty = int(constraint["penalty"])
-            if constraint["type"] == "HARD":
+            teams = constraint.teams
+            slots = sorted(constraint.slots)
+            intp = constraint.intp
+            penalty = constraint.penalty
+            if constraint.hard:
                 for team1 in teams:
                     for team2 in teams:
                         if team1 == team2:
@@ -374,13 +532,15 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                                 constr.Lazy = lazy
     
     if debug:
-        model.update()
+        with profiler.phase("update"):
+            model.update()
         print("Num vars: " + str(model.NumVars))
         print("Num constraints: " + str(model.NumConstrs))
 
     if debug:
         print("Writing problem to file...")
-        model.write("problem.lp")
+        with profiler.phase("write problem.lp"):
+            model.write(run_dir.file("problem.lp"))
 
     #model.setParam("OutputFlag", 0)
 
@@ -388,65 +548,272 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
     def callbackGetIncumbent(model, where):
         if where == GRB.Callback.MIPSOL:
             solcnt = model.cbGet(GRB.Callback.MIPSOL_SOLCNT)
-            x = model.cbGetSolution(m_vars)
+            x = x_array.values(model, in_callback=True)
             solution = make_solution(x, n_teams, n_slots)
             # print_solution(solution)
-            write_ha_pattern(f"Temp/{os.path.basename(problem_filename)}_ha_pattern_{solcnt}", solution)
+            if debug_files:
+                write_ha_pattern(run_dir.temp(f"{os.path.basename(problem_filename)}_ha_pattern_{solcnt}"), solution)
+            events.event("pattern", pattern=pattern_id(solution), solcnt=solcnt)
 
             #feasible = solve_slave(prob, slave_model, solution, debug)
-            feasible = external_slave_solver(filename, prob, solution, debug)
-
-            n_zeros = sum(pattern.count(1) for pattern in solution)
-            h_distance = 1 # Minimum desired Hamming dinstance
-            model.cbLazy(gp.quicksum([m_vars[team, slot] 
-                                        for team in range(n_teams)
-                                        for slot in range(n_slots) 
-                                        if solution[team][slot] < 0.5]) - 
-                         gp.quicksum([m_vars[team, slot] 
-                                        for team in range(n_teams)
-                                        for slot in range(n_slots) 
-                                        if solution[team][slot] > 0.5]) +
-                         n_zeros >= h_distance)
-
-    def external_slave_solver(problem_filename, prob, solution, debug):
-        pattern_filename = f"Temp/{os.path.basename(problem_filename)}_ha_pattern_temp"
-        solutions_filename = f"Temp/{os.path.basename(problem_filename)}_slavesolutions.xml"
-        write_ha_pattern(pattern_filename, solution)
+            # Cuts from the cores of the patterns solved by the pool since the last call
+            while not slave_cores.empty():
+                add_pattern_cut(model, *slave_cores.get())
+
+            core = None
+            start = time.time()
+            with profiler.phase("precheck"):
+                rejected = checker.check(solution) if checker is not None else None
+            if checker is not None:
+                events.event("precheck", pattern=pattern_id(solution), wall=round(time.time() - start, 6),
+                             result="passed" if rejected is None else rejected[0],
+                             cells=None if rejected is None or rejected[2] is None else len(rejected[2]))
+            if rejected is not None:
+                print(f"Pattern rejected by {rejected[0]}: {rejected[1]}")
+                core = rejected[2]
+                if state is not None:
+                    state.add_outcome(solution, REJECTED, core)
+            elif slave_pool is None:
+                feasible, core = run_slave(filename, prob, solution, debug)
+            else:
+                submit_slave(solution)
+
+            add_pattern_cut(model, solution, core)
+            if state is not None:
+                state.save()
+        elif where == GRB.Callback.MIP:
+            obj_best = model.cbGet(GRB.Callback.MIP_OBJBST)
+            obj_bound = model.cbGet(GRB.Callback.MIP_OBJBND)
+            gap = abs(obj_best - obj_bound) / max(1e-10, abs(obj_best)) if obj_best < GRB.INFINITY else None
+            events.progress(obj_best=obj_best if obj_best < GRB.INFINITY else None, obj_bound=obj_bound, gap=gap,
+                            nodes=model.cbGet(GRB.Callback.MIP_NODCNT), solutions=model.cbGet(GRB.Callback.MIP_SOLCNT))
+        elif where == GRB.Callback.MIPNODE and incumbents is not None:
+            for _, schedule in incumbents.poll():
+                x_array.set_solution(model, array_from_solution(schedule, n_teams, n_slots).sum(axis=1))
+                model.cbUseSolution()
+
+    def add_pattern_cut(model, solution, cells=None):
+        # No-good cut on the values of the pattern in the cells, the list
+        # of (team, slot) of an infeasible part of the pattern (the whole
+        # pattern if None): at least one of them must change.
+        if cells is not None and debug:
+            print(f"Cut over {len(cells)} of {n_teams * n_slots} pattern variables")
+        h_distance = 1 # Minimum desired Hamming dinstance
+        model.cbLazy(pattern_distance(solution, cells) >= h_distance)
+        if state is not None:
+            state.add_cut(solution, cells)
+
+    def pattern_distance(solution, cells=None):
+        # Hamming distance from the pattern over the cells
+        if cells is None:
+            cells = [(team, slot) for team in range(n_teams) for slot in range(n_slots)]
+        n_zeros = sum(1 for team, slot in cells if solution[team][slot] > 0.5)
+        return (gp.quicksum([m_vars[team, slot] 
+                                for team, slot in cells
+                                if solution[team][slot] < 0.5]) - 
+                gp.quicksum([m_vars[team, slot] 
+                                for team, slot in cells
+                                if solution[team][slot] > 0.5]) +
+                n_zeros)
+
+    checker = PatternChecker(prob) if pattern_check else None
+
+    # State of the run for the checkpoints, None without checkpoints
+    state = MasterCheckpoint(filename, n_slots, os.path.basename(run_dir.path), resume) if checkpoint or resume else None
+
+    # Pool of slave processes, used when slave_workers > 0.
+    # The results are reported from the worker threads. At most
+    # slave_workers + SLAVE_QUEUE jobs are in flight: the callback
+    # waits for a free slot, so that a worker never waits for the
+    # master, but no more than SLAVE_QUEUE patterns are left queued
+    # when the master stops.
+    slave_pool = None
+    slave_slots = None
+    if slave_workers > 0:
+        slave_pool = ThreadPoolExecutor(max_workers=slave_workers)
+        slave_slots = threading.BoundedSemaphore(slave_workers + SLAVE_QUEUE)
+    slave_jobs = []
+    report_lock = threading.Lock()
+    # (pattern, core) of the infeasible patterns with a core found by
+    # the pool, cut at the next call of the callback
+    slave_cores = queue.SimpleQueue()
+
+    def submit_slave(solution):
+        slave_slots.acquire()
+        job = len(slave_jobs)
+        future = slave_pool.submit(run_slave, filename, prob, solution, debug, job)
+        future.add_done_callback(lambda future: slave_done(job, solution, future))
+        slave_jobs.append(future)
         if debug:
-            print(f"wrote ha pattern file {pattern_filename}")
-        slave_output =""
-        with suppress(subprocess.CalledProcessError):
+            print(f"Queued ha pattern as slave job {job}")
+
+    def slave_done(job, solution, future):
+        slave_slots.release()
+        if future.cancelled():
+            print(f"Slave job {job} cancelled")
+        elif future.exception() is not None:
+            print(f"Slave job {job} failed: {future.exception()}")
+        elif future.result()[0]:
+            print(f"Slave job {job} finished: feasible pattern")
+        else:
+            print(f"Slave job {job} finished: no solution for the pattern")
+            if future.result()[1] is not None:
+                slave_cores.put((solution, future.result()[1]))
+
+    def external_slave_solver(problem_filename, prob, solution, debug, job=None):
+        # Runs the slave on the pattern, sent on stdin (see TwoRRProtocol).
+        # The schedules are read from stdout and reported as soon as the
+        # slave produces them. With debug_files the pattern and the
+        # schedules also go through files in the Temp/ of the run, one per job.
+        # Returns the outcome (see TwoRRSlaveCache), the list of
+        # (objective, solution) of the feasible schedules and the
+        # core of an infeasible pattern (None here, the slave does not
+        # report cores outside of server mode). Raises an exception if
+        # the slave fails (crash, killed, missing binary...).
+        pattern_args = ['--pattern-home-away', '-']
+        if debug_files:
+            suffix = "" if job is None else f"_{job}"
+            pattern_filename = run_dir.temp(f"{os.path.basename(problem_filename)}_ha_pattern_temp{suffix}")
+            solutions_filename = run_dir.temp(f"{os.path.basename(problem_filename)}_slavesolutions{suffix}.xml")
+            write_ha_pattern(pattern_filename, solution)
             if debug:
-                print(f"Running external slave solver...")
-            slave_output = subprocess.check_output(['./sportschedulingcompetition', 
-                    '--pattern-home-away', pattern_filename, 
-                    '--xml-solutions', solutions_filename,
-                    '--feasibility-timeout', str(int(60*5)), # 5 minutes until first feasible solution
-                    '--optimization-solution-timeout', str(int(20*60)), # 20 minutes max between produced solutions
-                    '--total-optimization-timeout', str(int(2*60*60)), # 3 hour total optimization time
-                    problem_filename
-                    ])
-
-        solutions = read_multiple_solutions(solutions_filename)
+                print(f"wrote ha pattern file {pattern_filename}")
+            pattern_args = ['--pattern-home-away', pattern_filename, '--xml-solutions', solutions_filename]
         if debug:
-            print(f"slave solver produced:\n\t{len(solutions)} solutions")
-        for solution in solutions:
-            report_solution(problem_filename, prob, solution)
+            print(f"Running external slave solver...")
+        start = time.time()
+        n_solutions = 0
+        schedules = []
+        # The last line of the slave: "infeasible" or "done <lb> optimal|stopped"
+        outcome = ""
+        with subprocess.Popen(['./sportschedulingcompetition'] + pattern_args + ['--compact', '--quiet'] + 
+                              SLAVE_TIMEOUTS + [problem_filename],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True) as slave:
+            if not debug_files:
+                slave.stdin.write(pack_pattern(solution))
+            slave.stdin.close()
+            for line in slave.stdout:
+                kind, data = parse_slave_line(line)
+                if kind == "schedule":
+                    obj_hard, obj_soft = report_solution(problem_filename, prob, data)
+                    if obj_hard == 0:
+                        schedules.append((obj_soft, data))
+                    n_solutions += 1
+                elif kind in ("infeasible", "done"):
+                    outcome = line.strip()
 
         if debug:
-            print(f"Slave solver output: {slave_output}")
+            print(f"slave solver produced:\n\t{n_solutions} solutions ({outcome})")
+        if slave.returncode != 0:
+            raise Exception(f"The slave solver failed with exit code {slave.returncode}")
+        return slave_status(outcome, n_solutions), schedules, None
+
+    # Slave processes in server mode, one for each worker
+    servers = None
+    if slave_servers:
+        servers = queue.Queue()
+        for _ in range(max(1, slave_workers)):
+            servers.put(SlaveServer(filename))
+
+    def server_slave_solver(problem_filename, prob, solution, debug, job=None):
+        # Same as external_slave_solver, on one of the servers
+        server = servers.get()
+        n_solutions = 0
+        schedules = []
+        try:
+            for solution in server.solve(solution):
+                obj_hard, obj_soft = report_solution(problem_filename, prob, solution)
+                if obj_hard == 0:
+                    schedules.append((obj_soft, solution))
+                n_solutions += 1
+        except Exception:
+            # The server is replaced, it may be dead
+            server.close()
+            server = SlaveServer(problem_filename)
+            raise
+        finally:
+            servers.put(server)
+        if debug:
+            print(f"slave server produced:\n\t{n_solutions} solutions ({server.status})")
+        return slave_status(server.status, n_solutions), schedules, server.core
+
+    slave_solver = external_slave_solver if servers is None else server_slave_solver
+
+    cache = SlaveCache(filename) if slave_cache else None
+
+    def run_slave(problem_filename, prob, solution, debug, job=None):
+        # Runs the slave on the pattern, unless its outcome is already
+        # in the cache. Returns True if the pattern is feasible, and the
+        # core of the pattern if it is infeasible and the slave found one.
+        if cache is not None:
+            entry = cache.get(solution)
+            if entry is not None:
+                if debug:
+                    print(f"slave cache hit: {entry['status']}, {len(entry['solutions'])} solutions")
+                for cached in entry["solutions"]:
+                    report_solution(problem_filename, prob, games_solution(cached["games"]))
+                core = entry.get("core")
+                core = None if core is None else [tuple(cell) for cell in core]
+                if state is not None:
+                    state.add_outcome(solution, entry["status"], core)
+                events.event("slave_end", pattern=pattern_id(solution), job=job, status=entry["status"],
+                             solutions=len(entry["solutions"]), wall=0, cached=True)
+                return len(entry["solutions"]) > 0, core
+
+        events.event("slave_start", pattern=pattern_id(solution), job=job)
+        start = time.time()
+        try:
+            with profiler.phase("slave"):
+                status, schedules, core = slave_solver(problem_filename, prob, solution, debug, job)
+        except Exception as e:
+            # Nothing is known about the pattern: its outcome is not
+            # recorded, and it stays pending in the checkpoint
+            print(f"Slave failed: {e}")
+            events.event("slave_end", pattern=pattern_id(solution), job=job, status="failed", solutions=0,
+                         wall=round(time.time() - start, 3), cached=False, error=str(e))
+            return False, None
+        if status != INFEASIBLE:
+            core = None
+        events.event("slave_end", pattern=pattern_id(solution), job=job, status=status, solutions=len(schedules),
+                     wall=round(time.time() - start, 3), cached=False,
+                     best=min((obj for obj, _ in schedules), default=None), core=None if core is None else len(core))
+        # A timeout depends on the time limits of the slave, not only on the pattern
+        if cache is not None and status != TIMEOUT:
+            cache.put(solution, status, schedules, core)
+        if state is not None:
+            state.add_outcome(solution, status, core)
+        return len(schedules) > 0, core
+
+    # Best (feasible) solution received from the slaves so far
+    best = {"obj": None, "file": None, "solution": None}
 
-        return len(solutions) > 0
-    
     def report_solution(problem_filename, prob, solution):
+        with report_lock:
+            obj_hard, obj_soft, output_filename = write_report(problem_filename, prob, solution)
+            if obj_hard == 0 and (best["obj"] is None or obj_soft < best["obj"]):
+                best["obj"] = obj_soft
+                best["file"] = output_filename
+                best["solution"] = solution
+                print(f"New best solution: {obj_soft} ({output_filename})")
+                events.event("best", objective=obj_soft)
+                if state is not None:
+                    state.set_best(obj_soft, solution)
+                if incumbents is not None:
+                    incumbents.publish(obj_soft, solution)
+        return obj_hard, obj_soft
+
+    def write_report(problem_filename, prob, solution):
         infeasibilities = []
         obj_hard = 0
         obj_soft = 0
-        for constraint in prob.constraints:
-            violated,_,penalty = validate_constraint(prob, solution, constraint)
+        start = time.time()
+        with profiler.phase("validation"):
+            results = validate_solution(prob, solution)
+        wall = time.time() - start
+        for constraint, (violated,_,penalty) in zip(prob.constraints, results):
             if violated:
-                if constraint[1]["type"] == "HARD":
-                    infeasibilities.append(constraint[0])
+                if constraint.hard:
+                    infeasibilities.append(constraint.name)
                     obj_hard += penalty
                 else:
                     obj_soft += penalty
@@ -455,8 +822,34 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
         if obj_hard != 0 or len(infeasibilities) > 0:
             print(f"Warning: received infeasible solution from slave solver. This should not happen.")
         print(infeasibilities)
-        output_filename = f"Output/{os.path.basename(problem_filename)}_solution_{obj_soft}.xml"
+        events.event("validation", wall=round(wall, 6), obj_hard=obj_hard, obj_soft=obj_soft,
+                     infeasibilities=len(infeasibilities))
+        output_filename = run_dir.output(f"{os.path.basename(problem_filename)}_solution_{obj_soft}.xml")
         write_solution_tuples(output_filename, prob, solution, obj_soft)
+        return obj_hard, obj_soft, output_filename
+
+    def restore_checkpoint():
+        # Adds the cuts of the checkpoint to the model (as constraints,
+        # they hold for the whole search), reports its best schedule
+        # and sends its pending patterns to the slave again
+        cuts = state.restored_cuts()
+        pending = state.pending_patterns()
+        print(f"Resuming from {state.file_name}: {len(cuts)} cuts, {len(state.outcomes)} patterns explored, "
+              f"{len(pending)} pending" + (" (finished run)" if state.finished else ""))
+        for solution, cells in cuts:
+            model.addConstr(pattern_distance(solution, cells) >= 1)
+        restored = state.restored_best()
+        if restored is not None:
+            report_solution(problem_filename, prob, restored[1])
+        for solution in pending:
+            if slave_pool is not None:
+                submit_slave(solution)
+            else:
+                _, core = run_slave(filename, prob, solution, debug)
+                if core is not None:
+                    model.addConstr(pattern_distance(solution, core) >= 1)
+                    state.add_cut(solution, core)
+        state.save(True)
 
     def write_ha_pattern(file_name, solution):
         with open(file_name, "w") as myfile:
@@ -471,22 +864,63 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
                     myfile.write(str(int(ha)))
                 myfile.write("\n")
 
+    if state is not None and state.resumed:
+        restore_checkpoint()
+
     if debug:
         print("Solving...")
 
     # Optimize
-    model.optimize(callbackGetIncumbent)
+    with profiler.phase("optimize"):
+        model.optimize(profiler.wrap("callback", callbackGetIncumbent))
 
     write_status(model)
 
+    # The master has no more patterns to explore
+    exhausted = model.status in (GRB.OPTIMAL, GRB.INFEASIBLE, GRB.INF_OR_UNBD)
+
+    if slave_pool is not None:
+        if debug:
+            print(f"Waiting for {sum(not job.done() for job in slave_jobs)} slave jobs...")
+        with profiler.phase("wait slaves"):
+            # When stopped early (time limit, SIGTERM...) the queued jobs
+            # are dropped (they stay pending in the checkpoint); the jobs
+            # already running are waited for
+            slave_pool.shutdown(wait=True, cancel_futures=not exhausted)
+
+    if servers is not None:
+        while not servers.empty():
+            servers.get().close()
+
+    if best["obj"] is not None and best["obj"] > 0 and lns_budget > 0:
+        if debug:
+            print(f"Improving the best solution with LNS for {lns_budget}s...")
+        with profiler.phase("lns"):
+            obj, solution = solve_lns(filename, best["solution"], lns_budget, lns_workers, debug=debug)
+        if obj < best["obj"]:
+            report_solution(problem_filename, prob, solution)
+
+    if state is not None:
+        state.close(exhausted)
+
+    if best["obj"] is not None:
+        print(f"Best solution: {best['obj']} ({best['file']})")
+    events.event("run_end", status=model.status, runtime=model.Runtime, best=best["obj"])
+    events.close()
+
     if (model.status == GRB.OPTIMAL):
-        solution = make_solution(m_vars, n_teams, n_slots)
+        solution = make_solution(x_array.values(model), n_teams, n_slots)
         if debug:
             print_solution(solution)
     
     if debug:
         print("Writing problem to file...")
-        model.write("problem.lp")
+        model.write(run_dir.file("problem.lp"))
+
+    profiler.report()
+
+    if own_run_dir:
+        run_dir.finish()
         
     # if (model.status == GRB.OPTIMAL):
     #     write_solution("solution.xml", prob, m_vars, model.objVal)
@@ -500,6 +934,18 @@ def solve_master(filename, prob: TwoRRProblem, skipSoft=False, lazy=0, debug=Tru
     # print("Obj validator: " + str(obj))
 
 
+def slave_status(outcome, n_solutions):
+    # The outcome of a pattern (see TwoRRSlaveCache) from the last line
+    # of the slave ("infeasible" or "done <lb> optimal|stopped") and the
+    # number of schedules it produced. The pattern is infeasible only if
+    # the slave says so.
+    if n_solutions > 0:
+        return OPTIMAL if outcome.endswith("optimal") else FEASIBLE
+    if outcome == "infeasible":
+        return INFEASIBLE
+    return TIMEOUT
+
+
 def write_status(model: gp.Model):
     # Displays the status of Gurobi in a more human readable format
     if model.status == GRB.OPTIMAL:
@@ -515,7 +961,10 @@ def write_status(model: gp.Model):
 
 
 def make_solution(m_vars, n_teams, n_slots):
-    # Computes the solution from the binary variables of the model
+    # Computes the solution from the binary variables of the model,
+    # or from an array of their values (see VarArray)
+    if isinstance(m_vars, np.ndarray):
+        return (m_vars > 0.5).astype(int).tolist()
     solution = []
     for team in range(n_teams):
         ha_pattern = []
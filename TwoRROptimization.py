@@ -7,16 +7,38 @@ import os
 #os.environ["GRB_LICENSE_FILE"] = "C:\\gurobi\\gurobi-ac.lic"
 import gurobipy as gp
 from gurobipy import GRB
-from TwoRRProblem import TwoRRProblem, write_solution
-from TwoRRValidator import validate_constraint
+import numpy as np
+from TwoRRProblem import TwoRRProblem, Mode, VarArray, MVarArray, write_solution, solution_from_array, array_from_solution
+from TwoRRValidator import validate_solution
+from TwoRRRun import RunDirectory
+from TwoRRProfiles import apply_profile
+from TwoRRProfiler import profiler, model_counter, PROFILE_MEMORY
 
-def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
+def solve_naive(filename, prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True, matrix=False, names=True, run_dir=None,
+                incumbents=None, profile=False):
     # Set up and solve with Gurobi a "naive" model 
     # for the TwoRRProblem. The model is naive in
     # the sense that il follows the standard integer
     # programming techniques, building a large complex
     # model and hope that Gurobi will be able to handle
     # it. This works only for simple problems.
+    # With matrix=True the model is built with the
+    # matrix API (see build_naive_matrix), optionally
+    # without variable names. problem.lp is written in run_dir
+    # (see TwoRRRun), by default a new directory removed at the
+    # end; the solutions go directly to Output/, named after the
+    # instance file, as those of the other strategies.
+    # incumbents exchanges schedules with the other strategies
+    # of a portfolio (see TwoRRPortfolio): the feasible schedules
+    # found are published, and the schedules received are used
+    # as heuristic solutions.
+    # With profile=True (or TWORR_PROFILE=1) the time and memory
+    # of each phase are reported at the end (see TwoRRProfiler);
+    # profile="memory" traces the Python allocations, at a cost.
+    # Returns True if the problem was solved to optimality.
+
+    if profile:
+        profiler.enable(profile == PROFILE_MEMORY)
 
     if debug:
         print("Solving problem: " + prob.name)
@@ -27,6 +49,157 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
     if debug:
         print("Num. teams: " + str(n_teams))
 
+    own_run_dir = run_dir is None
+    if own_run_dir:
+        run_dir = RunDirectory(filename)
+    profiler.begin(os.path.basename(run_dir.path))
+
+    with profiler.phase("build"):
+        if matrix:
+            model, x_array = build_naive_matrix(prob, skipSoft, lazy, names, debug)
+        else:
+            model, x_array = build_naive(prob, skipSoft, lazy, debug)
+    
+    if debug:
+        with profiler.phase("update"):
+            model.update()
+        print("Num vars: " + str(model.NumVars))
+        print("Num constraints: " + str(model.NumConstrs))
+
+    if debug:
+        print("Writing problem to file...")
+        with profiler.phase("write problem.lp"):
+            model.write(run_dir.file("problem.lp"))
+
+    #model.setParam("OutputFlag", 0)
+
+    # Setting up callback function to retrieve feasible solutions
+    def callbackGetIncumbent(model, where):
+        if where == GRB.Callback.MIPSOL:
+            solcnt = model.cbGet(GRB.Callback.MIPSOL_SOLCNT)
+            obj = model.cbGet(GRB.Callback.MIPSOL_OBJ)
+            x = x_array.values(model, in_callback=True)
+            solution = make_solution(x, n_teams, n_slots)
+            infeasibilities = []
+            obj_v = 0
+            with profiler.phase("validation"):
+                results = validate_solution(prob, solution)
+            for constraint, (violated,_,penalty) in zip(prob.constraints, results):
+                if violated and constraint.hard:
+                    infeasibilities.append(constraint.name)
+                obj_v += penalty
+            print("Infeasibilities: {}, Obj Validator: {}, Obj Gurobi: {}".format(len(infeasibilities), obj_v, obj))
+            print(infeasibilities)
+            write_solution(run_dir.output("{}_solution_{}.xml".format(os.path.basename(filename), obj_v)), prob, x, obj)
+            if incumbents is not None and len(infeasibilities) == 0:
+                incumbents.publish(obj_v, solution)
+        elif where == GRB.Callback.MIPNODE and incumbents is not None:
+            for _, solution in incumbents.poll():
+                x_array.set_solution(model, array_from_solution(solution, n_teams, n_slots))
+                model.cbUseSolution()
+
+    # Solution pool
+    if skipSoft:
+        model.setParam("PoolSolutions", 100)
+        model.setParam("PoolSearchMode", 2)
+        model.setParam("MIPFocus", 1)
+        model.setParam("Heuristics", 0.5)
+
+    # Tuning parameters
+    model.setParam("Presolve", 2)
+    model.setParam("Symmetry", 2)
+    model.setParam("GomoryPasses", 1)
+    model.setParam("PrePasses", 2)
+    # Profile of the instance (see TwoRRProfiles)
+    apply_profile(model, prob, "naive", debug)
+
+    if debug:
+        print("Solving...")
+
+    # Optimize
+    with profiler.phase("optimize"):
+        if skipSoft or incumbents is not None:
+            model.optimize(profiler.wrap("callback", callbackGetIncumbent))
+        else:
+            model.optimize()
+
+    write_status(model)
+
+    if (model.status == GRB.OPTIMAL):
+        x = x_array.values(model)
+        solution = make_solution(x, n_teams, n_slots)
+        if debug:
+            print_solution(solution)
+
+        obj = 0
+        with profiler.phase("validation"):
+            results = validate_solution(prob, solution)
+        for constraint, (violated,diff,penalty) in zip(prob.constraints, results):
+            obj += penalty
+            print(constraint.name, (violated,diff,penalty))
+        
+        print("Obj validator: " + str(obj))
+
+        write_solution(run_dir.output("{}_solution_{}.xml".format(os.path.basename(filename), obj)), prob, x, model.objVal)
+
+    profiler.report()
+
+    if own_run_dir:
+        run_dir.finish()
+
+    return model.status == GRB.OPTIMAL
+
+
+def write_status(model: gp.Model):
+    # Displays the status of Gurobi in a more human readable format
+    if model.status == GRB.OPTIMAL:
+        print('Optimal objective: %g' % model.objVal)
+    elif model.status == GRB.INF_OR_UNBD:
+        print('Model is infeasible or unbounded')
+    elif model.status == GRB.INFEASIBLE:
+        print('Model is infeasible')
+    elif model.status == GRB.UNBOUNDED:
+        print('Model is unbounded')
+    else:
+        print('Optimization ended with status %d' % model.status)
+
+
+def make_solution(m_vars, n_teams, n_slots):
+    # Computes the solution from the binary variables of the model,
+    # or from an array of their values (see VarArray)
+    if isinstance(m_vars, np.ndarray):
+        return solution_from_array(m_vars)
+    solution = []
+    for slot in range(n_slots):
+        games = []
+        for team1 in range(n_teams):
+            for team2 in range(n_teams):
+                if team1 == team2:
+                    continue
+                var_value = m_vars[team1, team2, slot]
+                if isinstance(var_value, gp.Var):
+                    var_value = var_value.x
+                if var_value > 0.5:
+                    games.append((team1, team2))
+        solution.append(games)
+    return solution
+
+def print_solution(solution):
+    # Displays the solution in a more human readble format
+    for slot,games in enumerate(solution):
+        print("Slot " + str(slot) + ":")
+        for h,a in games:
+            print("({},{})".format(str(h), str(a)), end=' ')
+        print("")
+
+def build_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
+    # Build the "naive" model of solve_naive, one
+    # variable and one constraint at a time. Returns
+    # the model and the VarArray of the x variables.
+
+    n_teams = len(prob.teams)
+    n_slots = len(prob.slots)
+
     # Create Gurobi model
     model = gp.Model(prob.name)
     model.setParam("Threads", 1)
@@ -37,31 +210,34 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
     # Create variables and store them in a dictionary:
     # m_vars[home_team, away_team, slot]
     m_vars = dict()
-    for team1 in range(n_teams):
-        for team2 in range(n_teams):
-            if team1 == team2:
-                continue
-            for slot in range(n_slots):
-                m_vars[team1, team2, slot] = \
-                    model.addVar(vtype=GRB.BINARY, name="x_" + str(team1) + "_" + str(team2) + "_" + str(slot))
+    with profiler.phase("variables", model_counter(model)):
+        for team1 in range(n_teams):
+            for team2 in range(n_teams):
+                if team1 == team2:
+                    continue
+                for slot in range(n_slots):
+                    m_vars[team1, team2, slot] = \
+                        model.addVar(vtype=GRB.BINARY, name="x_" + str(team1) + "_" + str(team2) + "_" + str(slot))
+    x_array = VarArray(m_vars, (n_teams, n_teams, n_slots))
 
     if debug:
         print("Adding basic 2RR constraints...")
 
     # Add constraints that force each team to play against
     # another team at most once per slot.
-    for team1 in range(n_teams):
-            for slot in range(n_slots):
-                model.addConstr(gp.quicksum([m_vars[team1, team2, slot] + m_vars[team2, team1, slot]
-                                            for team2 in range(n_teams) if team1 != team2]) == 1)
+    with profiler.phase("basic constraints", model_counter(model)):
+        for team1 in range(n_teams):
+                for slot in range(n_slots):
+                    model.addConstr(gp.quicksum([m_vars[team1, team2, slot] + m_vars[team2, team1, slot]
+                                                for team2 in range(n_teams) if team1 != team2]) == 1)
 
-    # Add constraints that force each team to meet another
-    # team exactly once in a home game
-    for team1 in range(n_teams):
-        for team2 in range(n_teams):
-            if team1 == team2:
-                continue
-            model.addConstr(gp.quicksum([m_vars[team1, team2, slot] for slot in range(n_slots)]) == 1)
+        # Add constraints that force each team to meet another
+        # team exactly once in a home game
+        for team1 in range(n_teams):
+            for team2 in range(n_teams):
+                if team1 == team2:
+                    continue
+                model.addConstr(gp.quicksum([m_vars[team1, team2, slot] for slot in range(n_slots)]) == 1)
 
     ########## These two constraints are not necessary, and they do not help the model. ##########
     # # Add constraints that force each team to play against
@@ -81,13 +257,14 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
     
     # If phased, the teams must play in separate intervals, i.e., once in each
     # n_slots/2 interval.
-    if (prob.game_mode == "P"):
-        for team1 in range(n_teams):
-            for team2 in range(team1 + 1, n_teams):
-                model.addConstr(gp.quicksum([m_vars[team1,team2,slot] + m_vars[team2,team1,slot] 
-                                            for slot in range(int(n_slots/2))]) <= 1)
-                model.addConstr(gp.quicksum([m_vars[team1,team2,slot] + m_vars[team2,team1,slot] 
-                                            for slot in range(int(n_slots/2), n_slots)]) <= 1)
+    with profiler.phase("phased constraints", model_counter(model)):
+        if (prob.game_mode == "P"):
+            for team1 in range(n_teams):
+                for team2 in range(team1 + 1, n_teams):
+                    model.addConstr(gp.quicksum([m_vars[team1,team2,slot] + m_vars[team2,team1,slot] 
+                                                for slot in range(int(n_slots/2))]) <= 1)
+                    model.addConstr(gp.quicksum([m_vars[team1,team2,slot] + m_vars[team2,team1,slot] 
+                                                for slot in range(int(n_slots/2), n_slots)]) <= 1)
     
     # Additional vars that determines weather a team plays home or away in a certain slot.
     use_team_vars = False # Apparently, the algorithm is faster without these auxiliary vars.
@@ -136,20 +313,21 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
     if debug:
         print("Adding problem specific constraints...")
 
-    # Add problem specific constraints
-    for (ind, (c_name, constraint)) in enumerate(prob.constraints):
+    # Add problem specific constraints, with a phase for each family
+    for (ind, constraint) in profiler.each(enumerate(prob.constraints), lambda item: item[1].name, model_counter(model)):
+        c_name = constraint.name
         # Capacity constraints:
         if c_name == "CA1":
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            penalty = int(constraint["penalty"])
+            slots = constraint.slots
+            teams = constraint.teams
+            c_min = constraint.min
+            c_max = constraint.max
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA1 not implemented!")
             for team in teams:
-                if constraint["type"] == "HARD":
-                    if constraint["mode"] == "A":
+                if constraint.hard:
+                    if constraint.mode == Mode.A:
                         if use_team_vars:
                             constr = model.addConstr(gp.quicksum([get_team_var(team, slot, away=True) 
                                                 for slot in slots]) <= c_max,
@@ -161,7 +339,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                                             name="CA1_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                    elif constraint["mode"] == "H":
+                    elif constraint.mode == Mode.H:
                         if use_team_vars:
                             constr = model.addConstr(gp.quicksum([get_team_var(team, slot, away=False) 
                                                 for slot in slots]) <= c_max,
@@ -177,7 +355,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                         raise Exception("Mode HA for CA1 not implemented!")
                 elif not skipSoft:
                     slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
-                    if constraint["mode"] == "A":
+                    if constraint.mode == Mode.A:
                         if use_team_vars:
                             constr = model.addConstr(gp.quicksum([get_team_var(team, slot, away=True)  
                                                 for slot in slots]) - slack <= c_max,
@@ -189,7 +367,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                                             name="CA1_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                    elif constraint["mode"] == "H":
+                    elif constraint.mode == Mode.H:
                         if use_team_vars: 
                             constr = model.addConstr(gp.quicksum([get_team_var(team, slot, away=False) 
                                                 for slot in slots]) - slack <= c_max,
@@ -204,24 +382,24 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                     else:
                         raise Exception("Mode HA for CA1 not implemented!")
         if c_name == "CA2":
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            teams1 = [int(t) for t in constraint["teams1"].split(';')]
-            teams2 = [int(t) for t in constraint["teams2"].split(';')]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            penalty = int(constraint["penalty"])
+            slots = constraint.slots
+            teams1 = constraint.teams1
+            teams2 = constraint.teams2
+            c_min = constraint.min
+            c_max = constraint.max
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA2 not implemented!")
             for team in teams1:
-                if constraint["type"] == "HARD":
-                    if constraint["mode1"] == "A":
+                if constraint.hard:
+                    if constraint.mode1 == Mode.A:
                         constr = model.addConstr(gp.quicksum([m_vars[i, team, j] 
                                             for i in teams2 if i != team
                                             for j in slots]) <= c_max,
                                         name="CA2_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                    elif constraint["mode1"] == "H":
+                    elif constraint.mode1 == Mode.H:
                         constr = model.addConstr(gp.quicksum([m_vars[team, i, j] 
                                             for i in teams2 if i != team
                                             for j in slots]) <= c_max,
@@ -240,14 +418,14 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                             constr.Lazy = lazy
                 elif not skipSoft:
                     slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
-                    if constraint["mode1"] == "A":
+                    if constraint.mode1 == Mode.A:
                         constr = model.addConstr(gp.quicksum([m_vars[i, team, j] 
                                             for i in teams2 if i != team
                                             for j in slots]) - slack <= c_max,
                                         name="CA2_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                    elif constraint["mode1"] == "H":
+                    elif constraint.mode1 == Mode.H:
                         constr = model.addConstr(gp.quicksum([m_vars[team, i, j] 
                                             for i in teams2 if i != team
                                             for j in slots]) - slack <= c_max,
@@ -265,17 +443,17 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                         if lazy:
                             constr.Lazy = lazy
         if c_name == "CA3":
-            teams1 = [int(t) for t in constraint["teams1"].split(';')]
-            teams2 = [int(t) for t in constraint["teams2"].split(';')]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            intp = int(constraint["intp"])
-            penalty = int(constraint["penalty"])
+            teams1 = constraint.teams1
+            teams2 = constraint.teams2
+            c_min = constraint.min
+            c_max = constraint.max
+            intp = constraint.intp
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA3 not implemented!")
             for team in teams1:
-                if constraint["type"] == "HARD":
-                    if constraint["mode1"] == "A":
+                if constraint.hard:
+                    if constraint.mode1 == Mode.A:
                         for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                             constr = model.addConstr(gp.quicksum([m_vars[i, team, j] 
                                                 for i in teams2 if i != team
@@ -283,7 +461,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                                             name="CA3_" + str(team) + "_" + str(slots[0]) + "_" + str(slots[-1]) + "_" + str(ind))
                             if lazy:
                                 constr.Lazy = lazy
-                    elif constraint["mode1"] == "H":
+                    elif constraint.mode1 == Mode.H:
                         for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                             constr = model.addConstr(gp.quicksum([m_vars[team, i, j] 
                                                 for i in teams2 if i != team
@@ -303,7 +481,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
                 elif not skipSoft:
-                    if constraint["mode1"] == "A":
+                    if constraint.mode1 == Mode.A:
                         for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                             slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                             constr = model.addConstr(gp.quicksum([m_vars[i, team, j] 
@@ -312,7 +490,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                                             name="CA3_" + str(team) + "_" + str(slots[0]) + "_" + str(slots[-1]) + "_" + str(ind))
                             if lazy:
                                 constr.Lazy = lazy
-                    elif constraint["mode1"] == "H":
+                    elif constraint.mode1 == Mode.H:
                         for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                             slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                             constr = model.addConstr(gp.quicksum([m_vars[team, i, j] 
@@ -334,17 +512,17 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
         if c_name == "CA4":
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            teams1 = [int(t) for t in constraint["teams1"].split(';')]
-            teams2 = [int(t) for t in constraint["teams2"].split(';')]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            penalty = int(constraint["penalty"])
+            slots = constraint.slots
+            teams1 = constraint.teams1
+            teams2 = constraint.teams2
+            c_min = constraint.min
+            c_max = constraint.max
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA4 not implemented!")
-            if constraint["type"] == "HARD":
-                if constraint["mode1"] == "A":
-                    if constraint["mode2"] == "GLOBAL":
+            if constraint.hard:
+                if constraint.mode1 == Mode.A:
+                    if constraint.mode2 == Mode.GLOBAL:
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams2
                                             for j in teams1 if i != j
@@ -360,8 +538,8 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                                             name="CA4_" + str(slot) + "_" + str(ind))
                             if lazy:
                                 constr.Lazy = lazy
-                elif constraint["mode1"] == "H":
-                    if constraint["mode2"] == "GLOBAL":
+                elif constraint.mode1 == Mode.H:
+                    if constraint.mode2 == Mode.GLOBAL:
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams1
                                             for j in teams2 if i != j
@@ -378,7 +556,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
                 else:
-                    if constraint["mode2"] == "GLOBAL":
+                    if constraint.mode2 == Mode.GLOBAL:
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams1
                                             for j in teams2 if i != j
@@ -402,8 +580,8 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
             elif not skipSoft:
-                if constraint["mode1"] == "A":
-                    if constraint["mode2"] == "GLOBAL":
+                if constraint.mode1 == Mode.A:
+                    if constraint.mode2 == Mode.GLOBAL:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams2
@@ -421,8 +599,8 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                                             name="CA4_" + str(slot) + "_" + str(ind))
                             if lazy:
                                 constr.Lazy = lazy
-                elif constraint["mode1"] == "H":
-                    if constraint["mode2"] == "GLOBAL":
+                elif constraint.mode1 == Mode.H:
+                    if constraint.mode2 == Mode.GLOBAL:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams1
@@ -441,7 +619,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
                 else:  
-                    if constraint["mode2"] == "GLOBAL":
+                    if constraint.mode2 == Mode.GLOBAL:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams1
@@ -468,12 +646,12 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                                 constr.Lazy = lazy
         # Game constraints
         if c_name == "GA1":
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            games = [(int(t.split(',')[0]),int(t.split(',')[1])) for t in constraint["meetings"].split(';') if len(t) > 0]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            penalty = int(constraint["penalty"])
-            if constraint["type"] == "HARD":
+            slots = constraint.slots
+            games = constraint.meetings
+            c_min = constraint.min
+            c_max = constraint.max
+            penalty = constraint.penalty
+            if constraint.hard:
                 constr = model.addConstr(gp.quicksum([m_vars[i, j, slot] 
                                     for i,j in games
                                     for slot in slots]) <= c_max,
@@ -503,20 +681,20 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                     constr.Lazy = lazy
         # Break constraints
         if c_name == "BR1":
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            mode = constraint["mode2"]
-            intp = int(constraint["intp"])
-            penalty = int(constraint["penalty"])
-            if constraint["type"] == "HARD":
-                if mode == "A":
+            teams = constraint.teams
+            slots = constraint.slots
+            mode = constraint.mode2
+            intp = constraint.intp
+            penalty = constraint.penalty
+            if constraint.hard:
+                if mode == Mode.A:
                     for team in teams:
                         constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=True) 
                                             for slot in slots if slot != 0]) <= intp,
                                         name="BR1_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                elif mode == "H":
+                elif mode == Mode.H:
                     for team in teams:
                         constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=False) 
                                             for slot in slots if slot != 0]) <= intp,
@@ -531,7 +709,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                         if lazy:
                             constr.Lazy = lazy
             elif not skipSoft:
-                if mode == "A":
+                if mode == Mode.A:
                     for team in teams:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=True) 
@@ -539,7 +717,7 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                                         name="BR1_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                elif mode == "H":
+                elif mode == Mode.H:
                     for team in teams:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=False) 
@@ -556,11 +734,11 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                         if lazy:
                             constr.Lazy = lazy
         if c_name == "BR2":
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            intp = int(constraint["intp"])
-            penalty = int(constraint["penalty"])
-            if constraint["type"] == "HARD":
+            teams = constraint.teams
+            slots = constraint.slots
+            intp = constraint.intp
+            penalty = constraint.penalty
+            if constraint.hard:
                 constr = model.addConstr(gp.quicksum([get_break_var(team, slot, away=False) + get_break_var(team, slot, away=True)
                                     for team in teams
                                     for slot in slots if slot != 0]) <= intp,
@@ -577,11 +755,11 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                     constr.Lazy = lazy
         # Fairness constraints
         if c_name == "FA2":
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            slots = sorted([int(s) for s in constraint["slots"].split(';')])
-            intp = int(constraint["intp"])
-            penalty = int(constraint["penalty"])
-            if constraint["type"] == "HARD":
+            teams = constraint.teams
+            slots = sorted(constraint.slots)
+            intp = constraint.intp
+            penalty = constraint.penalty
+            if constraint.hard:
                 for team1 in teams:
                     for team2 in teams:
                         if team1 == team2:
@@ -642,10 +820,10 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                             
         # Separation constraints
         if c_name == "SE1":
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            penalty = int(constraint["penalty"])
-            c_min = int(constraint["min"])
-            if constraint["type"] == "HARD": 
+            teams = constraint.teams
+            penalty = constraint.penalty
+            c_min = constraint.min
+            if constraint.hard: 
                 raise Exception("The HARD version of constraint SE1 is not implemented!")
             elif not skipSoft:
                 for i in range(len(teams)):
@@ -676,110 +854,293 @@ def solve_naive(prob: TwoRRProblem, skipSoft=False, lazy=1, debug=True):
                         if lazy:
                             constr.Lazy = lazy
     
-    if debug:
-        model.update()
-        print("Num vars: " + str(model.NumVars))
-        print("Num constraints: " + str(model.NumConstrs))
+    return model, x_array
 
-    if debug:
-        print("Writing problem to file...")
-        model.write("problem.lp")
+class _MatrixColumns():
+    # Columns of a model built with the matrix API: the
+    # first n_x are the binary x variables, the others
+    # are the auxiliary variables added with add().
+    def __init__(self, n_x, x_names=None):
+        self.vtypes = [GRB.BINARY] * n_x
+        self.objs = [0.0] * n_x
+        self.names = x_names
 
-    #model.setParam("OutputFlag", 0)
+    def add(self, vtype, obj=0.0, name=None):
+        col = len(self.vtypes)
+        self.vtypes.append(vtype)
+        self.objs.append(obj)
+        if self.names is not None:
+            # Same name Gurobi gives to an unnamed variable
+            self.names.append(name if name is not None else "C" + str(col))
+        return col
 
-    # Setting up callback function to retrieve feasible solutions
-    def callbackGetIncumbent(model, where):
-        if where == GRB.Callback.MIPSOL:
-            solcnt = model.cbGet(GRB.Callback.MIPSOL_SOLCNT)
-            obj = model.cbGet(GRB.Callback.MIPSOL_OBJ)
-            x = model.cbGetSolution(m_vars)
-            solution = make_solution(x, n_teams, n_slots)
-            infeasibilities = []
-            obj_v = 0
-            for constraint in prob.constraints:
-                violated,_,penalty = validate_constraint(prob, solution, constraint)
-                if violated and constraint[1]["type"] == "HARD":
-                    infeasibilities.append(constraint[0])
-                obj_v += penalty
-            print("Infeasibilities: {}, Obj Validator: {}, Obj Gurobi: {}".format(len(infeasibilities), obj_v, obj))
-            print(infeasibilities)
-            write_solution("solution_{}.xml".format(solcnt), prob, x, obj)
+    def add_to(self, model: gp.Model):
+        return model.addMVar(len(self.vtypes), obj=np.array(self.objs),
+                             vtype=np.array(self.vtypes), name=self.names)
 
-    # Solution pool
-    if skipSoft:
-        model.setParam("PoolSolutions", 100)
-        model.setParam("PoolSearchMode", 2)
-        model.setParam("MIPFocus", 1)
-        model.setParam("Heuristics", 0.5)
+class _MatrixRows():
+    # Rows of a constraint matrix, collected in coordinate
+    # format. Each row is given as a list of terms (cols, coef),
+    # where coef is either a scalar or an array like cols.
+    def __init__(self):
+        self.rows = []
+        self.cols = []
+        self.coefs = []
+        self.senses = []
+        self.rhs = []
 
-    # Tuning parameters
-    model.setParam("Presolve", 2)
-    model.setParam("Symmetry", 2)
-    model.setParam("GomoryPasses", 1)
-    model.setParam("PrePasses", 2)
+    def add(self, sense, rhs, *terms):
+        row = len(self.rhs)
+        for (cols, coef) in terms:
+            cols = np.atleast_1d(cols)
+            self.rows.append(np.full(len(cols), row, dtype=np.int64))
+            self.cols.append(cols)
+            self.coefs.append(np.broadcast_to(np.asarray(coef, dtype=float), cols.shape))
+        self.senses.append(sense)
+        self.rhs.append(rhs)
 
-    if debug:
-        print("Solving...")
+    def add_to(self, model: gp.Model, x, lazy=0):
+        # Add all the rows to the model with a single call.
+        # Repeated (row, col) entries are summed, as in a LinExpr.
+        import scipy.sparse as sp
+        if not self.rhs:
+            return None
+        A = sp.csr_matrix((np.concatenate(self.coefs),
+                          (np.concatenate(self.rows), np.concatenate(self.cols))),
+                          shape=(len(self.rhs), x.shape[0]))
+        A.eliminate_zeros()
+        constrs = model.addMConstr(A, x, np.array(self.senses), np.array(self.rhs, dtype=float))
+        if lazy:
+            constrs.Lazy = lazy
+        return constrs
 
-    # Optimize
-    if skipSoft:
-        model.optimize(callbackGetIncumbent)
-    else:
-        model.optimize()
+def build_naive_matrix(prob: TwoRRProblem, skipSoft=False, lazy=1, names=False, debug=True):
+    # Build the same model of build_naive with the matrix
+    # API of Gurobi. The coefficients of the constraints
+    # are collected as sparse coordinates, then all the
+    # variables are added with one addMVar call, the basic
+    # 2RR constraints (with the definitions of the break
+    # variables) with one addMConstr call and the problem
+    # specific constraints with another. This avoids creating
+    # a Var and a LinExpr for each term, which is what takes
+    # most of the time on the larger instances. Variable names
+    # are only set with names=True.
 
-    write_status(model)
+    n_teams = len(prob.teams)
+    n_slots = len(prob.slots)
 
-    if (model.status == GRB.OPTIMAL):
-        solution = make_solution(m_vars, n_teams, n_slots)
-        if debug:
-            print_solution(solution)
+    # Create Gurobi model
+    model = gp.Model(prob.name)
+    model.setParam("Threads", 1)
 
-        write_solution("solution.xml", prob, m_vars, model.objVal)
+    if debug:
+        print("Creating binary variables...")
 
-        obj = 0
-        for constraint in prob.constraints:
-            violated,diff,penalty = validate_constraint(prob, solution, constraint)
-            obj += penalty
-            print(constraint[0], (violated,diff,penalty))
-        
-        print("Obj validator: " + str(obj))
+    # Column of x[home_team, away_team, slot] (-1 if home_team == away_team),
+    # in the same order of m_vars in build_naive.
+    x_index = np.full((n_teams, n_teams, n_slots), -1, dtype=np.int64)
+    x_keys = np.nonzero(np.broadcast_to(~np.eye(n_teams, dtype=bool)[:, :, None], x_index.shape))
+    n_x = len(x_keys[0])
+    x_index[x_keys] = np.arange(n_x)
+    x_names = None
+    if names:
+        x_names = ["x_" + str(team1) + "_" + str(team2) + "_" + str(slot) 
+                   for team1, team2, slot in zip(*(k.tolist() for k in x_keys))]
+    columns = _MatrixColumns(n_x, x_names)
+    basic_rows = _MatrixRows()
+    specific_rows = _MatrixRows()
 
+    all_teams = np.arange(n_teams)
+    def games(home_teams, away_teams, slots):
+        # Columns of x[i, j, slot] for i in home_teams, j in away_teams
+        # (i != j) and slot in slots, repeated as in the lists.
+        cols = x_index[np.ix_(np.asarray(home_teams, dtype=np.int64), 
+                              np.asarray(away_teams, dtype=np.int64), 
+                              np.asarray(slots, dtype=np.int64))].ravel()
+        return cols[cols >= 0]
 
-def write_status(model: gp.Model):
-    # Displays the status of Gurobi in a more human readable format
-    if model.status == GRB.OPTIMAL:
-        print('Optimal objective: %g' % model.objVal)
-    elif model.status == GRB.INF_OR_UNBD:
-        print('Model is infeasible or unbounded')
-    elif model.status == GRB.INFEASIBLE:
-        print('Model is infeasible')
-    elif model.status == GRB.UNBOUNDED:
-        print('Model is unbounded')
-    else:
-        print('Optimization ended with status %d' % model.status)
+    def meetings(pairs, slots):
+        # Columns of x[i, j, slot] for (i, j) in pairs and slot in slots
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        return x_index[pairs[:, 0, None], pairs[:, 1, None], np.asarray(slots, dtype=np.int64)].ravel()
 
+    if debug:
+        print("Adding basic 2RR constraints...")
 
-def make_solution(m_vars, n_teams, n_slots):
-    # Computes the solution from the binary variables of the model
-    solution = []
-    for slot in range(n_slots):
-        games = []
+    # Each team plays exactly once per slot
+    for team1 in range(n_teams):
+        for slot in range(n_slots):
+            basic_rows.add(GRB.EQUAL, 1, (games([team1], all_teams, [slot]), 1), 
+                           (games(all_teams, [team1], [slot]), 1))
+
+    # Each team meets another team exactly once in a home game
+    for team1 in range(n_teams):
+        for team2 in range(n_teams):
+            if team1 == team2:
+                continue
+            basic_rows.add(GRB.EQUAL, 1, (x_index[team1, team2], 1))
+
+    # If phased, the teams must play in separate intervals
+    if (prob.game_mode == "P"):
+        half = int(n_slots/2)
         for team1 in range(n_teams):
-            for team2 in range(n_teams):
-                if team1 == team2:
+            for team2 in range(team1 + 1, n_teams):
+                for slots in [range(half), range(half, n_slots)]:
+                    basic_rows.add(GRB.LESS_EQUAL, 1, (x_index[team1, team2, slots], 1), 
+                                   (x_index[team2, team1, slots], 1))
+
+    # Variables that determine whether a team has an away break 
+    # or a home break in a certain slot.
+    break_vars = dict()
+    def get_break_var(team, slot, away=False):
+        if (team, slot, away) not in break_vars:
+            if away:
+                col = columns.add(GRB.BINARY, name="ba_" + str(team) + "_" + str(slot))
+                cols = games(all_teams, [team], [slot - 1, slot])
+            else:
+                col = columns.add(GRB.BINARY, name="bh_" + str(team) + "_" + str(slot))
+                cols = games([team], all_teams, [slot - 1, slot])
+            basic_rows.add(GRB.LESS_EQUAL, 1, (cols, 1), (col, -1))
+            break_vars[team, slot, away] = col
+        return break_vars[team, slot, away]
+
+    def break_vars_of(teams, slots, home=True, away=True):
+        # Break variables of teams in slots (excluding the first one)
+        cols = []
+        for team in teams:
+            for slot in slots:
+                if slot == 0:
                     continue
-                var_value = m_vars[team1, team2, slot]
-                if isinstance(var_value, gp.Var):
-                    var_value = var_value.x
-                if var_value > 0.5:
-                    games.append((team1, team2))
-        solution.append(games)
-    return solution
+                if home:
+                    cols.append(get_break_var(team, slot, away=False))
+                if away:
+                    cols.append(get_break_var(team, slot, away=True))
+        return np.array(cols, dtype=np.int64)
 
-def print_solution(solution):
-    # Displays the solution in a more human readble format
-    for slot,games in enumerate(solution):
-        print("Slot " + str(slot) + ":")
-        for h,a in games:
-            print("({},{})".format(str(h), str(a)), end=' ')
-        print("")
\ No newline at end of file
+    def add_specific(sense, rhs, *terms, penalty=None):
+        # Add a problem specific constraint; if penalty is given
+        # the constraint is soft, and its violation is paid by
+        # a new slack variable.
+        if penalty is not None:
+            slack = columns.add(GRB.INTEGER, obj=penalty)
+            terms += ((slack, 1 if sense == GRB.GREATER_EQUAL else -1),)
+        specific_rows.add(sense, rhs, *terms)
+
+    if debug:
+        print("Adding problem specific constraints...")
+
+    # Add problem specific constraints, with a phase for each family
+    def matrix_counter():
+        return len(basic_rows.rhs) + len(specific_rows.rhs), len(columns.vtypes)
+    for (ind, constraint) in profiler.each(enumerate(prob.constraints), lambda item: item[1].name, matrix_counter):
+        c_name = constraint.name
+        if not constraint.hard and skipSoft:
+            continue
+        penalty = None if constraint.hard else constraint.penalty
+        # Capacity constraints:
+        if c_name == "CA1":
+            if (constraint.min > 0):
+                raise Exception("Min value in CA1 not implemented!")
+            if constraint.mode not in [Mode.A, Mode.H]:
+                raise Exception("Mode HA for CA1 not implemented!")
+            for team in constraint.teams:
+                if constraint.mode == Mode.A:
+                    cols = games(all_teams, [team], constraint.slots)
+                else:
+                    cols = games([team], all_teams, constraint.slots)
+                add_specific(GRB.LESS_EQUAL, constraint.max, (cols, 1), penalty=penalty)
+        if c_name == "CA2" or c_name == "CA3":
+            if (constraint.min > 0):
+                raise Exception("Min value in " + c_name + " not implemented!")
+            if c_name == "CA2":
+                windows = [constraint.slots]
+            else:
+                intp = constraint.intp
+                windows = [range(z, z + intp) for z in range(n_slots - intp + 1)]
+            for team in constraint.teams1:
+                for slots in windows:
+                    cols = []
+                    if constraint.mode1 != Mode.A:
+                        cols.append(games([team], constraint.teams2, slots))
+                    if constraint.mode1 != Mode.H:
+                        cols.append(games(constraint.teams2, [team], slots))
+                    add_specific(GRB.LESS_EQUAL, constraint.max, (np.concatenate(cols), 1), penalty=penalty)
+        if c_name == "CA4":
+            if (constraint.min > 0):
+                raise Exception("Min value in CA4 not implemented!")
+            if constraint.mode2 == Mode.GLOBAL:
+                windows = [constraint.slots]
+            else:
+                windows = [[slot] for slot in constraint.slots]
+            for slots in windows:
+                cols = []
+                if constraint.mode1 != Mode.A:
+                    cols.append(games(constraint.teams1, constraint.teams2, slots))
+                if constraint.mode1 != Mode.H:
+                    cols.append(games(constraint.teams2, constraint.teams1, slots))
+                add_specific(GRB.LESS_EQUAL, constraint.max, (np.concatenate(cols), 1), penalty=penalty)
+        # Game constraints
+        if c_name == "GA1":
+            cols = meetings(constraint.meetings, constraint.slots)
+            add_specific(GRB.LESS_EQUAL, constraint.max, (cols, 1), penalty=penalty)
+            add_specific(GRB.GREATER_EQUAL, constraint.min, (cols, 1), penalty=penalty)
+        # Break constraints
+        if c_name == "BR1":
+            mode = constraint.mode2
+            for team in constraint.teams:
+                cols = break_vars_of([team], constraint.slots, home=mode != Mode.A, away=mode != Mode.H)
+                add_specific(GRB.LESS_EQUAL, constraint.intp, (cols, 1), penalty=penalty)
+        if c_name == "BR2":
+            cols = break_vars_of(constraint.teams, constraint.slots)
+            add_specific(GRB.LESS_EQUAL, constraint.intp, (cols, 1), penalty=penalty)
+        # Fairness constraints
+        if c_name == "FA2":
+            slots = sorted(constraint.slots)
+            intp = constraint.intp
+            for team1 in constraint.teams:
+                for team2 in constraint.teams:
+                    if team1 == team2:
+                        continue
+                    if constraint.hard:
+                        for slot in slots:
+                            home1 = games([team1], all_teams, range(slot + 1))
+                            home2 = games([team2], all_teams, range(slot + 1))
+                            add_specific(GRB.LESS_EQUAL, intp, (home1, 1), (home2, -1))
+                            add_specific(GRB.LESS_EQUAL, intp, (home2, 1), (home1, -1))
+                        continue
+                    largest_diff = columns.add(GRB.INTEGER, name="ldiff_" + str(team1) + "_" + str(team2))
+                    add_specific(GRB.LESS_EQUAL, intp, (largest_diff, 1), penalty=penalty)
+                    for slot in slots:
+                        diff = columns.add(GRB.INTEGER, name="diff_" + str(team1) + "_" + str(team2) + "_" + str(slot))
+                        home1 = games([team1], all_teams, range(slot + 1))
+                        home2 = games([team2], all_teams, range(slot + 1))
+                        add_specific(GRB.LESS_EQUAL, 0, (home1, 1), (home2, -1), (diff, -1))
+                        add_specific(GRB.LESS_EQUAL, 0, (home2, 1), (home1, -1), (diff, -1))
+                        add_specific(GRB.LESS_EQUAL, 0, (diff, 1), (largest_diff, -1))
+        # Separation constraints
+        if c_name == "SE1":
+            if constraint.hard: 
+                raise Exception("The HARD version of constraint SE1 is not implemented!")
+            teams = constraint.teams
+            slot_coefs = np.arange(n_slots)
+            for i in range(len(teams)):
+                for j in range(i + 1, len(teams)):
+                    pair = str(teams[i]) + "_" + str(teams[j])
+                    sepc = columns.add(GRB.INTEGER, name="sep_" + pair)
+                    min1 = columns.add(GRB.BINARY, name="min1_" + pair)
+                    min2 = columns.add(GRB.BINARY, name="min2_" + pair)
+                    add_specific(GRB.LESS_EQUAL, - constraint.min - 1 + n_slots, (sepc, 1), penalty=penalty)
+                    first = x_index[teams[i], teams[j]]
+                    second = x_index[teams[j], teams[i]]
+                    add_specific(GRB.LESS_EQUAL, -n_slots, (first, slot_coefs), (second, -slot_coefs), 
+                                 (sepc, -1), (min1, -2 * n_slots))
+                    add_specific(GRB.LESS_EQUAL, -n_slots, (second, slot_coefs), (first, -slot_coefs), 
+                                 (sepc, -1), (min2, -2 * n_slots))
+                    add_specific(GRB.EQUAL, 1, (min1, 1), (min2, 1))
+
+    with profiler.phase("add to model", model_counter(model)):
+        x = columns.add_to(model)
+        basic_rows.add_to(model, x)
+        specific_rows.add_to(model, x, lazy)
+
+    return model, MVarArray(x[:n_x], x_index)
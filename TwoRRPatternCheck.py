@@ -0,0 +1,241 @@
+# This file contains necessary conditions for a home away
+# pattern to be completed into a feasible schedule. They are
+# checked with numpy in a few milliseconds, before sending the
+# pattern to the slave solver, which can take minutes to prove
+# that a pattern is infeasible.
+
+import numpy as np
+from TwoRRProblem import TwoRRProblem, Mode
+
+class PatternChecker():
+    # Checks the ha patterns of a problem: pattern[team, slot] = 1
+    # if the team plays home in the slot. check() returns None if
+    # the pattern passes all the checks, or (check, detail, cells) for
+    # the first failed check, where cells is the list of (team, slot)
+    # of the part of the pattern that fails the check on its own
+    # (None for the whole pattern). Only the hard constraints are
+    # considered.
+    def __init__(self, prob: TwoRRProblem):
+        self.prob = prob
+        self.n_teams = len(prob.teams)
+        self.n_slots = len(prob.slots)
+        self.hard = [(ind, constraint) for ind, constraint in enumerate(prob.constraints) if constraint.hard]
+
+    def check(self, solution):
+        pattern = np.asarray(solution) > 0.5
+        for check in [self.check_balance, self.check_pairs, self.check_phased, self.check_forced_games]:
+            failed = check(pattern)
+            if failed is not None:
+                return cells_list(*failed)
+        for ind, constraint in self.hard:
+            check = getattr(self, "check_" + constraint.name, None)
+            if check is None:
+                continue
+            failed = check(pattern, constraint)
+            if failed is not None:
+                return cells_list(f"{constraint.name} (constraint {ind})", *failed)
+        return None
+
+    def check_balance(self, pattern):
+        # Each slot has n_teams/2 home teams, each team plays n_teams - 1 home games
+        home_teams = pattern.sum(axis=0)
+        wrong = np.flatnonzero(home_teams != self.n_teams // 2)
+        if len(wrong) > 0:
+            return ("slot balance", f"slot {wrong[0]} has {home_teams[wrong[0]]} home teams",
+                    self.cells([], [wrong[0]]))
+        home_games = pattern.sum(axis=1)
+        wrong = np.flatnonzero(home_games != self.n_teams - 1)
+        if len(wrong) > 0:
+            return ("team balance", f"team {wrong[0]} plays {home_games[wrong[0]]} home games",
+                    self.cells([wrong[0]]))
+        return None
+
+    def check_pairs(self, pattern):
+        # Each team must host each other team in a slot
+        # where the first plays home and the second away
+        hosts = meeting_slots(pattern, pattern)
+        np.fill_diagonal(hosts, 1)
+        missing = np.argwhere(hosts == 0)
+        if len(missing) > 0:
+            home, away = missing[0]
+            return ("pair coverage", f"no slot with team {home} home and team {away} away",
+                    self.cells([home, away]))
+        return None
+
+    def check_phased(self, pattern):
+        # In a phased schedule, two teams meet once in each half
+        if self.prob.game_mode != "P":
+            return None
+        half = self.n_slots // 2
+        first = meeting_slots(pattern[:, :half], pattern[:, :half]) > 0
+        second = meeting_slots(pattern[:, half:], pattern[:, half:]) > 0
+        possible = (first & second.T) | (first.T & second)
+        np.fill_diagonal(possible, True)
+        missing = np.argwhere(~possible)
+        if len(missing) > 0:
+            team1, team2 = missing[0]
+            return ("phased", f"teams {team1} and {team2} cannot meet once in each half",
+                    self.cells([team1, team2]))
+        return None
+
+    def check_forced_games(self, pattern):
+        # A game with a single possible slot is forced in that
+        # slot, and a team cannot play two forced games in a slot
+        possible = pattern[:, None, :] & ~pattern[None, :, :]
+        forced = possible & (possible.sum(axis=2) == 1)[:, :, None]
+        games = forced.sum(axis=1) + forced.sum(axis=0)
+        wrong = np.argwhere(games > 1)
+        if len(wrong) > 0:
+            team, slot = wrong[0]
+            # The games are forced by the rows of the team and its opponents
+            teams = np.flatnonzero(forced[team, :, slot] | forced[:, team, slot]).tolist() + [team]
+            return ("forced games", f"team {team} has {games[team, slot]} forced games in slot {slot}",
+                    self.cells(teams))
+        return None
+
+    def check_CA1(self, pattern, constraint):
+        # The number of home (away) games is fixed by the pattern
+        teams = constraint.array("teams")
+        slots = constraint.array("slots")
+        if constraint.mode not in (Mode.H, Mode.A):
+            return None
+        games = pattern[np.ix_(teams, slots)].sum(axis=1)
+        if constraint.mode == Mode.A:
+            games = len(slots) - games
+        failed = exceeded(teams, games, constraint.max, "games")
+        if failed is not None:
+            return failed[1], self.cells([failed[0]], slots)
+        return None
+
+    def check_CA2(self, pattern, constraint):
+        slots = np.zeros((1, self.n_slots), dtype=bool)
+        slots[0, constraint.array("slots")] = True
+        return self.check_against(pattern, constraint, slots)
+
+    def check_CA3(self, pattern, constraint):
+        intp = constraint.intp
+        if intp > self.n_slots:
+            # No window of intp slots
+            return None
+        starts = np.arange(self.n_slots - intp + 1)
+        slots = (np.arange(self.n_slots)[None, :] >= starts[:, None]) & (np.arange(self.n_slots)[None, :] < starts[:, None] + intp)
+        return self.check_against(pattern, constraint, slots)
+
+    def check_against(self, pattern, constraint, windows):
+        # Lower bound on the games of each team in teams1 against teams2
+        # in each window of slots: the home (away) games of the window,
+        # minus those that can be played against the other teams.
+        teams1 = constraint.array("teams1")
+        others = np.ones((len(teams1), self.n_teams), dtype=bool)
+        others[:, constraint.array("teams2")] = False
+        others[np.arange(len(teams1)), teams1] = False
+        home = pattern[teams1]
+        windows = windows.astype(np.int64)
+        # can_host[t, o, w]: team t can host team o in window w
+        can_host = np.einsum("tos,ws->tow", (home[:, None, :] & ~pattern[None, :, :]).astype(np.int64), windows) > 0
+        can_visit = np.einsum("tos,ws->tow", (~home[:, None, :] & pattern[None, :, :]).astype(np.int64), windows) > 0
+        home_games = home.astype(np.int64) @ windows.T
+        away_games = windows.sum(axis=1)[None, :] - home_games
+        home_bound = np.maximum(home_games - (can_host & others[:, :, None]).sum(axis=1), 0)
+        away_bound = np.maximum(away_games - (can_visit & others[:, :, None]).sum(axis=1), 0)
+        if constraint.mode1 == Mode.H:
+            games = home_bound
+        elif constraint.mode1 == Mode.A:
+            games = away_bound
+        else:
+            games = home_bound + away_bound
+        failed = exceeded(teams1, games.max(axis=1), constraint.max, "games against teams2")
+        if failed is not None:
+            return failed[1], None
+        return None
+
+    def check_GA1(self, pattern, constraint):
+        meetings = constraint.array("meetings")
+        if len(meetings) == 0:
+            return None
+        in_slots = np.zeros(self.n_slots, dtype=bool)
+        in_slots[constraint.array("slots")] = True
+        possible = pattern[meetings[:, 0]] & ~pattern[meetings[:, 1]]
+        possible_in = possible[:, in_slots].any(axis=1)
+        forced_in = ~possible[:, ~in_slots].any(axis=1)
+        cells = self.cells(meetings.flatten())
+        if forced_in.sum() > constraint.max:
+            return f"{forced_in.sum()} meetings can only be played in the slots, max {constraint.max}", cells
+        if possible_in.sum() < constraint.min:
+            return f"{possible_in.sum()} meetings can be played in the slots, min {constraint.min}", cells
+        return None
+
+    def check_BR1(self, pattern, constraint):
+        # The breaks are fixed by the pattern (same counting as the validator)
+        teams = constraint.array("teams")
+        slots = constraint.array("slots")
+        slots = slots[slots != 0]
+        home_breaks, away_breaks = breaks(pattern)
+        home_breaks = home_breaks[np.ix_(teams, slots)].sum(axis=1)
+        away_breaks = away_breaks[np.ix_(teams, slots)].sum(axis=1)
+        if constraint.mode2 == Mode.A:
+            failed = (exceeded(teams, home_breaks, constraint.intp, "home breaks") or
+                      exceeded(teams, away_breaks, constraint.intp, "away breaks"))
+        else:
+            failed = exceeded(teams, home_breaks + away_breaks, constraint.intp, "breaks")
+        if failed is not None:
+            # A break in a slot depends on the previous slot too
+            return failed[1], self.cells([failed[0]], np.concatenate([slots, slots - 1]))
+        return None
+
+    def check_BR2(self, pattern, constraint):
+        teams = constraint.array("teams")
+        slots = constraint.array("slots")
+        slots = slots[slots != 0]
+        home_breaks, away_breaks = breaks(pattern)
+        total = home_breaks[np.ix_(teams, slots)].sum() + away_breaks[np.ix_(teams, slots)].sum()
+        if total > constraint.intp:
+            return f"{total} breaks, max {constraint.intp}", self.cells(teams, np.concatenate([slots, slots - 1]))
+        return None
+
+    def check_FA2(self, pattern, constraint):
+        # The home games played up to each slot are fixed by the pattern
+        teams = constraint.array("teams")
+        slots = np.sort(constraint.array("slots"))
+        home_games = np.cumsum(pattern[teams], axis=1)[:, slots]
+        gaps = np.abs(home_games[:, None, :] - home_games[None, :, :]).max(axis=2)
+        wrong = np.argwhere(gaps > constraint.intp)
+        if len(wrong) > 0:
+            team1, team2 = teams[wrong[0]]
+            return (f"teams {team1} and {team2} differ by {gaps[tuple(wrong[0])]} home games, max {constraint.intp}",
+                    self.cells([team1, team2], np.arange(slots[-1] + 1)))
+        return None
+
+    def cells(self, teams, slots=None):
+        # Mask of the cells of the pattern in the given teams (all the
+        # teams if empty) and slots (all the slots if None)
+        mask = np.zeros((self.n_teams, self.n_slots), dtype=bool)
+        rows = np.asarray(teams, dtype=np.int64) if len(teams) > 0 else slice(None)
+        columns = np.asarray(slots, dtype=np.int64) if slots is not None else slice(None)
+        mask[np.ix_(np.arange(self.n_teams)[rows], np.arange(self.n_slots)[columns])] = True
+        return mask
+
+def cells_list(check, detail, cells):
+    # The result of a failed check, with the mask of the cells as a list of (team, slot)
+    return (check, detail, None if cells is None else [tuple(cell) for cell in np.argwhere(cells).tolist()])
+
+def meeting_slots(pattern1, pattern2):
+    # slots[i, j]: number of slots where team i plays home in
+    # pattern1 and team j plays away in pattern2
+    return pattern1.astype(np.int64) @ (~pattern2).astype(np.int64).T
+
+def breaks(pattern):
+    # Home and away breaks of each team in each slot (none in slot 0)
+    previous = np.roll(pattern, 1, axis=1)
+    home_breaks = pattern & previous
+    away_breaks = ~pattern & ~previous
+    home_breaks[:, 0] = False
+    away_breaks[:, 0] = False
+    return home_breaks, away_breaks
+
+def exceeded(teams, values, c_max, what):
+    # The first team with a value over c_max and its description, None if there is none
+    wrong = np.flatnonzero(values > c_max)
+    if len(wrong) == 0:
+        return None
+    return teams[wrong[0]], f"team {teams[wrong[0]]} has {values[wrong[0]]} {what}, max {c_max}"
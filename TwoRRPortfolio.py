@@ -0,0 +1,117 @@
+# This file contains a portfolio of solution strategies for a
+# TwoRRProblem: solve_naive and solve_master run in parallel
+# processes on the same instance, and share their schedules. The
+# race ends when a strategy proves optimality, when all of them
+# end, or when the time budget runs out.
+
+import os, time
+import signal
+import queue
+import multiprocessing
+from TwoRRProblem import read_instance
+
+STRATEGIES = ["naive", "master"]
+
+class IncumbentExchange():
+    # The end of the exchange in the process of a strategy. publish()
+    # sends a feasible schedule to the other strategies (through the
+    # coordinator), poll() returns the schedules received since the
+    # last call that improve on the best one seen so far.
+    def __init__(self, name, outbox, inbox):
+        self.name = name
+        self.outbox = outbox
+        self.inbox = inbox
+        self.best = None
+
+    def publish(self, objective, solution):
+        if self.best is None or objective < self.best:
+            self.best = objective
+        self.outbox.put(("incumbent", self.name, objective, solution))
+
+    def poll(self):
+        received = []
+        while True:
+            try:
+                objective, solution = self.inbox.get_nowait()
+            except queue.Empty:
+                return received
+            if self.best is None or objective < self.best:
+                self.best = objective
+                received.append((objective, solution))
+
+def run_strategy(name, filename, outbox, inbox, debug):
+    # Runs a strategy in its own process group (so that it can be
+    # stopped with its slave processes) and reports how it ended.
+    os.setsid()
+    from TwoRROptimization import solve_naive
+    from TwoRRMaster import solve_master, MasterOptions
+    prob = read_instance(filename)
+    incumbents = IncumbentExchange(name, outbox, inbox)
+    optimal = False
+    if name == "naive":
+        optimal = solve_naive(filename, prob, skipSoft=False, debug=debug, incumbents=incumbents)
+    else:
+        # The master only explores the ha patterns, it does not prove optimality
+        solve_master(filename, prob, True, debug=debug, options=MasterOptions(), incumbents=incumbents)
+    outbox.put(("done", name, optimal, None))
+
+def solve_portfolio(filename, time_limit=None, strategies=STRATEGIES, debug=False):
+    # Races the strategies on the instance. Returns the best
+    # objective, its schedule and the strategy that found it
+    # (None if no feasible schedule was found), and whether the
+    # schedule is proven optimal.
+    outbox = multiprocessing.Queue()
+    inboxes = {name: multiprocessing.Queue() for name in strategies}
+    processes = {name: multiprocessing.Process(target=run_strategy, args=(name, filename, outbox, inboxes[name], debug))
+                 for name in strategies}
+    for process in processes.values():
+        process.start()
+
+    start = time.time()
+    best = (None, None, None)
+    optimal = False
+    running = set(strategies)
+    while running and not optimal:
+        timeout = 1.0
+        if time_limit is not None:
+            timeout = min(timeout, start + time_limit - time.time())
+            if timeout <= 0:
+                print(f"Portfolio: time limit reached")
+                break
+        try:
+            kind, name, value, solution = outbox.get(timeout=timeout)
+        except queue.Empty:
+            for name in list(running):
+                if not processes[name].is_alive():
+                    print(f"Portfolio: {name} stopped unexpectedly")
+                    running.discard(name)
+            continue
+        if kind == "incumbent":
+            if best[0] is None or value < best[0]:
+                best = (value, solution, name)
+                print(f"Portfolio: new best solution {value} from {name} after {time.time() - start:.1f}s")
+                for other in running:
+                    if other != name:
+                        inboxes[other].put((value, solution))
+        else:
+            running.discard(name)
+            optimal = value
+            print(f"Portfolio: {name} finished" + (" (optimal)" if value else ""))
+
+    for name in running:
+        stop_process(processes[name])
+    for process in processes.values():
+        process.join()
+    return best[0], best[1], best[2], optimal
+
+def stop_process(process, grace=10):
+    # SIGTERM to the process group of the strategy (see run_strategy),
+    # then SIGKILL if it is still running after grace seconds
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.join(grace)
+        if process.is_alive():
+            os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # Not yet in its own process group
+        process.kill()
@@ -1,12 +1,27 @@
 # The file handles the problem instances.
 
+import os
+import hashlib
+import pickle
+import tempfile
 import xml.etree.ElementTree as et
-from xml.dom import minidom
+from enum import Enum
+from contextlib import contextmanager, suppress
+import numpy as np
 import gurobipy as gp
 from collections import defaultdict
 
 # pylint: disable=no-name-in-module, no-member
 
+# Parsed instances are cached in this directory, keyed by the hash of the XML file.
+# The environment variable TWORR_CACHE overrides it (also for the cache of the
+# slave outcomes, see TwoRRSlaveCache), e.g. for runs with an empty cache.
+CACHE_ENV = "TWORR_CACHE"
+INSTANCE_CACHE_DIR = os.environ.get(CACHE_ENV) or "Cache"
+# Must be increased whenever TwoRRProblem or TwoRRConstraint change,
+# so that the instances cached by older versions are rebuilt.
+INSTANCE_CACHE_VERSION = 1
+
 class TwoRRProblem():
     # Represents a double round robin problem.
     # The structure is based on the RobinX format.
@@ -32,10 +47,138 @@ class TwoRRProblem():
         my_str += "Num constraints: " + str(len(self.constraints)) + "\n"
         return my_str
 
-def read_instance(file_name):
-    # Reads an instance from the RobinX XML format
-    tree = et.parse(file_name)
-    root = tree.getroot()
+class ConstraintType(Enum):
+    # Type of a constraint in the RobinX format
+    HARD = "HARD"
+    SOFT = "SOFT"
+
+class Mode(Enum):
+    # Values of the mode attributes (mode, mode1, mode2) in the RobinX format
+    H = "H"
+    A = "A"
+    HA = "HA"
+    GLOBAL = "GLOBAL"
+    EVERY = "EVERY"
+    SLOTS = "SLOTS"
+    LEQ = "LEQ"
+
+class TwoRRConstraint():
+    # A constraint of a TwoRRProblem, parsed once from the attributes
+    # of the RobinX format. Teams and slots are tuples of integers in
+    # the order of the instance (duplicates included), with bitmasks
+    # for fast membership tests. Meetings are (home, away) tuples.
+    # Missing numeric attributes and modes are None.
+    def __init__(self, name, attrib):
+        self.name = name
+        self.attrib = attrib
+        self.type = ConstraintType(attrib["type"])
+        self.hard = self.type == ConstraintType.HARD
+        self.penalty = _parse_int(attrib.get("penalty"), 0)
+        self.min = _parse_int(attrib.get("min"))
+        self.max = _parse_int(attrib.get("max"))
+        self.intp = _parse_int(attrib.get("intp"))
+        self.mode = _parse_mode(attrib.get("mode"))
+        self.mode1 = _parse_mode(attrib.get("mode1"))
+        self.mode2 = _parse_mode(attrib.get("mode2"))
+        self.teams = _parse_ints(attrib.get("teams"))
+        self.teams1 = _parse_ints(attrib.get("teams1"))
+        self.teams2 = _parse_ints(attrib.get("teams2"))
+        self.slots = _parse_ints(attrib.get("slots"))
+        self.meetings = tuple((int(t.split(',')[0]), int(t.split(',')[1]))
+                                for t in attrib.get("meetings", "").split(';') if len(t) > 0)
+        self.teams_mask = _mask(self.teams)
+        self.teams1_mask = _mask(self.teams1)
+        self.teams2_mask = _mask(self.teams2)
+        self.slots_mask = _mask(self.slots)
+        self._arrays = dict()
+
+    def array(self, field):
+        # Returns a field (e.g. "teams1" or "meetings") as a NumPy array.
+        # The arrays are created on first use and then cached.
+        if field not in self._arrays:
+            values = np.array(getattr(self, field), dtype=np.int64)
+            if field == "meetings":
+                values = values.reshape(-1, 2)
+            self._arrays[field] = values
+        return self._arrays[field]
+
+    def __repr__(self):
+        return self.name + " " + str(self.attrib)
+
+def _parse_int(value, default=None):
+    return default if value is None else int(value)
+
+def _parse_ints(value):
+    if value is None:
+        return ()
+    return tuple(int(v) for v in value.split(';') if len(v) > 0)
+
+def _parse_mode(value):
+    return None if value is None else Mode(value)
+
+def _mask(values):
+    mask = 0
+    for v in values:
+        mask |= 1 << v
+    return mask
+
+def read_instance(file_name, use_cache=True):
+    # Reads an instance from the RobinX XML format.
+    # The parsed problem (compiled constraints included) is cached
+    # in INSTANCE_CACHE_DIR, keyed by the hash of the XML content,
+    # so the XML is parsed again only when the file changes.
+    with open(file_name, "rb") as myxml:
+        data = myxml.read()
+    if not use_cache:
+        return parse_instance(data)
+
+    cache_file = instance_cache_file(data)
+    prob = load_cached_instance(cache_file)
+    if prob is None:
+        prob = parse_instance(data)
+        with suppress(OSError):
+            os.makedirs(INSTANCE_CACHE_DIR, exist_ok=True)
+            with atomic_open(cache_file, "wb") as mycache:
+                pickle.dump(prob, mycache, protocol=pickle.HIGHEST_PROTOCOL)
+    return prob
+
+def instance_cache_file(data):
+    # Cache file of an instance, given the content of its XML file
+    digest = hashlib.sha256(data).hexdigest()
+    return os.path.join(INSTANCE_CACHE_DIR, f"{digest}_v{INSTANCE_CACHE_VERSION}.pickle")
+
+def load_cached_instance(cache_file):
+    # Loads a cached instance, returns None if the cache
+    # file is missing or cannot be read.
+    try:
+        with open(cache_file, "rb") as mycache:
+            prob = pickle.load(mycache)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if not isinstance(prob, TwoRRProblem):
+        return None
+    return prob
+
+@contextmanager
+def atomic_open(file_name, mode="w"):
+    # Opens a temporary file in the directory of file_name, and
+    # renames it to file_name when the block completes. Concurrent
+    # readers see either the old or the new file, never a partial one.
+    directory = os.path.dirname(file_name) or "."
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(file_name) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as myfile:
+            yield myfile
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(temp_name)
+        raise
+
+def parse_instance(data):
+    # Parses the content of an XML file in the RobinX format
+    root = et.fromstring(data)
     meta = root.find("MetaData")
     prob = TwoRRProblem(meta.find("InstanceName").text, meta.find("Contributor").text, meta.find("Date").attrib["year"])
     prob.game_mode = root.find("Structure").find("Format").find("gameMode").text
@@ -46,62 +189,116 @@ def read_instance(file_name):
         prob.slots.append(child.attrib["name"])
     for child in root.find("Constraints"):
         for constraint in child:
-            prob.constraints.append((constraint.tag, constraint.attrib))
+            prob.constraints.append(TwoRRConstraint(constraint.tag, constraint.attrib))
 
     return prob
 
 
+class VarArray():
+    # The variables of a model stored in a dictionary (e.g. m_vars[h, a, s]),
+    # laid out as a dense array so that all their values can be retrieved
+    # with a single call. Indices without a variable (e.g. h == a) are 0.
+    def __init__(self, m_vars, shape):
+        self.vars = list(m_vars.values())
+        self.index = tuple(np.array(list(m_vars.keys()), dtype=np.int64).reshape(-1, len(shape)).T)
+        self.shape = shape
+
+    def values(self, model, in_callback=False):
+        # Values of the variables in the current solution of the model,
+        # or in the new incumbent when called from a MIPSOL callback.
+        if in_callback:
+            values = model.cbGetSolution(self.vars)
+        else:
+            values = model.getAttr("X", self.vars)
+        array = np.zeros(self.shape)
+        array[self.index] = values
+        return array
+
+    def set_solution(self, model, array):
+        # Proposes the values of a dense array as a heuristic solution,
+        # from a MIPNODE callback. Gurobi completes the other variables.
+        model.cbSetSolution(self.vars, np.asarray(array)[self.index].tolist())
+
+class MVarArray(VarArray):
+    # Same as VarArray, for a model built with the matrix API: x is an
+    # MVar and index[h, a, s] the position of the variable in x
+    # (-1 if there is no variable).
+    def __init__(self, x, index):
+        self.index = np.nonzero(index >= 0)
+        self.vars = x[index[self.index]].tolist()
+        self.shape = index.shape
+
+def solution_from_array(x):
+    # Computes the solution, i.e., the list of (home, away) games
+    # of each slot, from an array of values indexed by [home, away, slot].
+    solution = [[] for _ in range(x.shape[2])]
+    for slot, h_team, a_team in zip(*np.nonzero(x.transpose(2, 0, 1) > 0.5)):
+        solution[slot].append((int(h_team), int(a_team)))
+    return solution
+
+def array_from_solution(solution, n_teams, n_slots):
+    # Inverse of solution_from_array
+    x = np.zeros((n_teams, n_teams, n_slots))
+    for slot, games in enumerate(solution):
+        for h_team, a_team in games:
+            x[h_team, a_team, slot] = 1
+    return x
+
 def write_solution_tuples(file_name, prob, tuples, objective):
     # Write a solution file in XML format
-    solution = et.Element("Solution")
-    meta_data = et.SubElement(solution, "MetaData")
-    instance_name = et.SubElement(meta_data, "InstanceName")
-    instance_name.text = prob.name
-    solution_name = et.SubElement(meta_data, "SolutionName")
-    solution_name.text = file_name
-    objective_value = et.SubElement(meta_data, "ObjectiveValue")
-    objective_value.attrib["infeasibility"] = "0"
-    objective_value.attrib["objective"] = str(int(objective))
-    games = et.SubElement(solution, "Games")
-    for slot,teams in enumerate(tuples):
-        for t1,t2 in teams:
-            game = et.SubElement(games, "ScheduledMatch")
-            game.attrib["home"] = str(t1)
-            game.attrib["away"] = str(t2)
-            game.attrib["slot"] = str(slot)
-
-    with open(file_name, "w") as myxml:
-        myxml.write(minidom.parseString(et.tostring(solution)).toprettyxml())
+    games = ((t1, t2, slot) for slot,teams in enumerate(tuples) for t1,t2 in teams)
+    write_solution_games(file_name, prob, games, objective)
 
 def write_solution(file_name, prob, m_vars, objective):
-    # Write a solution file in XML format
-    solution = et.Element("Solution")
-    meta_data = et.SubElement(solution, "MetaData")
-    instance_name = et.SubElement(meta_data, "InstanceName")
-    instance_name.text = prob.name
-    solution_name = et.SubElement(meta_data, "SolutionName")
-    solution_name.text = file_name
-    objective_value = et.SubElement(meta_data, "ObjectiveValue")
-    objective_value.attrib["infeasibility"] = "0"
-    objective_value.attrib["objective"] = str(int(objective))
-    games = et.SubElement(solution, "Games")
-    for slot in range(len(prob.slots)):
-        for h_team in range(len(prob.teams)):
-            for a_team in range(len(prob.teams)):
-                if h_team == a_team:
-                    continue
-                var_value = m_vars[h_team, a_team, slot]
-                if isinstance(var_value, gp.Var):
-                    var_value = var_value.x
-                if var_value > 0.5:
-                    game = et.SubElement(games, "ScheduledMatch")
-                    game.attrib["home"] = str(h_team)
-                    game.attrib["away"] = str(a_team)
-                    game.attrib["slot"] = str(slot)
-
-    with open(file_name, "w") as myxml:
-        myxml.write(minidom.parseString(et.tostring(solution)).toprettyxml())
-        
+    # Write a solution file in XML format. m_vars can also be
+    # an array of values, as returned by VarArray.values.
+    if isinstance(m_vars, np.ndarray):
+        write_solution_tuples(file_name, prob, solution_from_array(m_vars), objective)
+        return
+
+    def games():
+        for slot in range(len(prob.slots)):
+            for h_team in range(len(prob.teams)):
+                for a_team in range(len(prob.teams)):
+                    if h_team == a_team:
+                        continue
+                    var_value = m_vars[h_team, a_team, slot]
+                    if isinstance(var_value, gp.Var):
+                        var_value = var_value.x
+                    if var_value > 0.5:
+                        yield (h_team, a_team, slot)
+
+    write_solution_games(file_name, prob, games(), objective)
+
+def write_solution_games(file_name, prob, games, objective):
+    # Streams a solution file in XML format, given the games as
+    # (home, away, slot) tuples. The output is the same produced
+    # by minidom's toprettyxml. The file is written to a temporary
+    # name and renamed into place once complete.
+    games = iter(games)
+    first_game = next(games, None)
+    with atomic_open(file_name, "w") as myxml:
+        myxml.write('<?xml version="1.0" ?>\n')
+        myxml.write('<Solution>\n')
+        myxml.write('\t<MetaData>\n')
+        myxml.write('\t\t<InstanceName>' + _escape_text(prob.name) + '</InstanceName>\n')
+        myxml.write('\t\t<SolutionName>' + _escape_text(file_name) + '</SolutionName>\n')
+        myxml.write('\t\t<ObjectiveValue infeasibility="0" objective="' + str(int(objective)) + '"/>\n')
+        myxml.write('\t</MetaData>\n')
+        if first_game is None:
+            myxml.write('\t<Games/>\n')
+        else:
+            myxml.write('\t<Games>\n')
+            myxml.write('\t\t<ScheduledMatch home="%d" away="%d" slot="%d"/>\n' % first_game)
+            for game in games:
+                myxml.write('\t\t<ScheduledMatch home="%d" away="%d" slot="%d"/>\n' % game)
+            myxml.write('\t</Games>\n')
+        myxml.write('</Solution>\n')
+
+def _escape_text(text):
+    # Escapes text content in the same way of minidom
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
 def read_multiple_solutions(file_name):
     tree = et.parse(file_name)
     root = tree.getroot()
@@ -0,0 +1,241 @@
+# This file contains the phase-level profiler of the solvers: the
+# time, the number of calls, the peak memory and the rows and
+# columns added by each phase of a run (building the variables, each
+# constraint family, model.update(), writing problem.lp, the
+# optimization, the callback...), reported in a single table at the
+# end of the run and in Logs/profile_<run>.json. A run stopped by
+# SIGTERM (e.g. at the time limit of run_batch.py) is reported on exit.
+#
+# The profiler is off by default: it is enabled by the environment
+# variable TWORR_PROFILE=1 or by profile=True of solve_naive and of
+# the MasterOptions of solve_master. When off, the hooks cost one
+# attribute check.
+# By default the memory is the peak RSS of the process at the end of
+# each phase (ru_maxrss, a high-water mark that a phase only shows
+# if it raised it), which costs one system call per phase.
+# TWORR_PROFILE=memory (or profile="memory") traces the Python
+# allocations instead, with the peak of each phase itself, but
+# tracemalloc slows down the Python parts of the run by an order of
+# magnitude: its timings are not comparable with those of other runs.
+#
+# Phases are nested: "build/constraints/CA1" is the time spent on
+# the CA1 constraints while building the model. The phases of the
+# worker threads (e.g. the slave pool of the master) are recorded
+# without traced memory, which tracemalloc can only follow for one
+# thread.
+
+import os, sys, time
+import json
+import atexit
+import threading
+import tracemalloc
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: no memory without TWORR_PROFILE=memory
+    resource = None
+
+PROFILE_ENV = "TWORR_PROFILE"
+PROFILE_DIR = "Logs"
+# The value of TWORR_PROFILE that traces the Python allocations
+PROFILE_MEMORY = "memory"
+
+class Profiler():
+    def __init__(self, enabled=False, memory=False):
+        self.enabled = False
+        self.memory = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.run_id = None
+        self.reset()
+        if enabled:
+            self.enable(memory)
+
+    def enable(self, memory=False):
+        # memory=True traces the Python allocations (see above)
+        if not self.enabled:
+            self.enabled = True
+            self.start = time.time()
+            atexit.register(self.report)
+        if memory and not self.memory:
+            self.memory = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            atexit.unregister(self.report)
+        if self.memory:
+            self.memory = False
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def reset(self):
+        # Clears the phases recorded so far
+        with self.lock:
+            self.phases = dict()
+            self.start = time.time()
+
+    def begin(self, run_id):
+        # Starts the profile of a run, reported as Logs/profile_<run_id>.json
+        self.reset()
+        self.run_id = run_id
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def path(self, name):
+        # The path of the phase name, nested in the current phase of the thread
+        stack = self.stack()
+        return stack[-1]["path"] + "/" + name if stack else name
+
+    @contextmanager
+    def phase(self, name, counter=None):
+        # Records the block as the phase name, nested in the current
+        # phase of the thread. counter() returns the (rows, columns) of
+        # the model, the difference at the end of the block is recorded;
+        # it is called outside of the timings of the phase.
+        if not self.enabled:
+            yield
+            return
+        stack = self.stack()
+        traced = self.memory and threading.current_thread() is threading.main_thread()
+        counts = counter() if counter is not None else None
+        memory = None
+        if traced:
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        frame = {"path": self.path(name), "peak": 0, "start": time.perf_counter()}
+        stack.append(frame)
+        with self.lock:
+            # The phases are reported in the order in which they start
+            self.phases.setdefault(frame["path"], new_phase())
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - frame["start"]
+            stack.pop()
+            peak = None
+            if traced:
+                # The peak of the phase is the largest of its own and of
+                # its nested phases (reset_peak is called by each of them)
+                peak = max(tracemalloc.get_traced_memory()[1], frame["peak"])
+                if stack:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+                peak -= memory
+            elif resource is not None:
+                peak = max_rss()
+            rows = cols = None
+            if counts is not None:
+                new_counts = counter()
+                rows, cols = new_counts[0] - counts[0], new_counts[1] - counts[1]
+            self.record(frame["path"], elapsed, peak, rows, cols)
+
+    def record(self, path, elapsed, peak=None, rows=None, cols=None, calls=1):
+        with self.lock:
+            phase = self.phases.setdefault(path, new_phase())
+            phase["calls"] += calls
+            phase["time"] += elapsed
+            if peak is not None:
+                phase["peak"] = max(phase["peak"] or 0, peak)
+            if rows is not None:
+                phase["rows"] = (phase["rows"] or 0) + rows
+                phase["cols"] = (phase["cols"] or 0) + cols
+
+    def each(self, items, name, counter=None):
+        # Yields the items, each one in the phase name(item), e.g. a
+        # loop over the constraints with a phase for each family. The
+        # loop body can use continue. counter (see phase) is only
+        # called when the name changes, so once per family for the
+        # constraints of an instance, which are grouped by family.
+        if not self.enabled:
+            yield from items
+            return
+        run = None # (path, counts) of the consecutive items with the same name
+        for item in items:
+            item_name = name(item)
+            if counter is not None and (run is None or run[0] != self.path(item_name)):
+                counts = counter()
+                if run is not None:
+                    self.record_counts(run[0], run[1], counts)
+                run = (self.path(item_name), counts)
+            with self.phase(item_name):
+                yield item
+        if run is not None:
+            self.record_counts(run[0], run[1], counter())
+
+    def record_counts(self, path, counts, new_counts):
+        self.record(path, 0.0, rows=new_counts[0] - counts[0], cols=new_counts[1] - counts[1], calls=0)
+
+    def wrap(self, name, function):
+        # The function, with each call recorded as the phase name
+        # (e.g. the callback of optimize)
+        if not self.enabled:
+            return function
+        def wrapped(*args, **kwargs):
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return wrapped
+
+    def report(self, run_id=None, directory=PROFILE_DIR):
+        # Prints the phases and writes them to Logs/profile_<run_id>.json
+        # (by default the run of begin()), then clears them. Returns the
+        # phases, None if there are none.
+        with self.lock:
+            if not self.enabled or len(self.phases) == 0:
+                return None
+            phases = self.phases
+            total = time.time() - self.start
+            # The phases still open (on exit), up to now
+            for frame in self.stack():
+                phase = phases[frame["path"]]
+                phase["calls"] += 1
+                phase["time"] += time.perf_counter() - frame["start"]
+                phase["running"] = True
+        run_id = run_id or self.run_id
+        self.run_id = None
+        print(f"Profile ({total:.3f}s):")
+        memory = "peak (MB)" if self.memory else "RSS (MB)"
+        print(f"{'phase':<40} {'calls':>8} {'time (s)':>10} {'%':>6} {memory:>10} {'rows':>9} {'cols':>9}")
+        for path, phase in phases.items():
+            indent = "  " * path.count("/")
+            peak = "" if phase["peak"] is None else f"{phase['peak'] / 2**20:.1f}"
+            rows = "" if phase["rows"] is None else str(phase["rows"])
+            cols = "" if phase["cols"] is None else str(phase["cols"])
+            name = path.rsplit('/', 1)[-1] + (" (running)" if phase.get("running") else "")
+            print(f"{indent + name:<40} {phase['calls']:>8} {phase['time']:>10.3f} "
+                  f"{100 * phase['time'] / max(total, 1e-9):>6.1f} {peak:>10} {rows:>9} {cols:>9}")
+        if run_id is not None:
+            os.makedirs(directory, exist_ok=True)
+            file_name = os.path.join(directory, f"profile_{run_id}.json")
+            with open(file_name, "w") as myfile:
+                json.dump({"run": run_id, "total": total, "memory": "traced" if self.memory else "rss",
+                           "phases": phases}, myfile, indent=2)
+            print(f"Profile written to {file_name}")
+        self.reset()
+        return phases
+
+def new_phase():
+    return {"calls": 0, "time": 0.0, "peak": None, "rows": None, "cols": None}
+
+def max_rss():
+    # The peak resident set size of the process, in bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def model_counter(model):
+    # (rows, columns) of a Gurobi model, for Profiler.phase. The model
+    # is updated first, in the phase "update" (outside the caller).
+    def counter():
+        with profiler.phase("update"):
+            model.update()
+        return model.NumConstrs, model.NumVars
+    return counter
+
+# The profiler of the process
+profiler = Profiler(os.environ.get(PROFILE_ENV, "") not in ("", "0"),
+                    os.environ.get(PROFILE_ENV, "") == PROFILE_MEMORY)
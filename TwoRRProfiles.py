@@ -0,0 +1,60 @@
+# This file contains the Gurobi parameter profiles of the solvers.
+# The parameters hardcoded in solve_master, create_slave and
+# solve_naive are the defaults; a profile overrides them for an
+# instance class (e.g. "Early") or a single instance (e.g. "Early 1").
+# The profiles are produced by TwoRRTuning and stored in
+# PARAMETER_PROFILES:
+#
+#   {"master": {"default": {...}, "classes": {"Early": {...}}, "instances": {"Early 1": {...}}},
+#    "slave": {...}, "naive": {...}}
+#
+# The environment variable TWORR_PARAMS, a JSON object with the same
+# solver keys (e.g. {"master": {"MIPFocus": 2}}), overrides all the
+# profiles, e.g. to evaluate a candidate profile.
+
+import os
+import re
+import json
+from TwoRRProblem import atomic_open
+
+PARAMETER_PROFILES = "profiles.json"
+PARAMETERS_ENV = "TWORR_PARAMS"
+
+def instance_class(prob):
+    # The class of an instance, from its name: "Early 1" -> "Early",
+    # "Middle1" -> "Middle", "Test Instance 4" -> "Test"
+    match = re.match(r"[A-Za-z]+", prob.name)
+    return match.group(0) if match else prob.name
+
+def read_profiles(file_name=PARAMETER_PROFILES):
+    try:
+        with open(file_name) as myfile:
+            return json.load(myfile)
+    except FileNotFoundError:
+        return dict()
+
+def write_profiles(profiles, file_name=PARAMETER_PROFILES):
+    with atomic_open(file_name) as myfile:
+        json.dump(profiles, myfile, indent=2, sort_keys=True)
+        myfile.write("\n")
+
+def load_profile(prob, solver, file_name=PARAMETER_PROFILES):
+    # The parameters of the solver ("master", "slave" or "naive") for
+    # the instance: default, then class, then instance profile, then
+    # TWORR_PARAMS, the later ones overriding the earlier ones
+    profiles = read_profiles(file_name).get(solver, dict())
+    params = dict(profiles.get("default", dict()))
+    params.update(profiles.get("classes", dict()).get(instance_class(prob), dict()))
+    params.update(profiles.get("instances", dict()).get(prob.name, dict()))
+    if os.environ.get(PARAMETERS_ENV):
+        params.update(json.loads(os.environ[PARAMETERS_ENV]).get(solver, dict()))
+    return params
+
+def apply_profile(model, prob, solver, debug=False):
+    # Sets the parameters of the profile of the instance on the model
+    params = load_profile(prob, solver)
+    for name, value in params.items():
+        model.setParam(name, value)
+    if debug and len(params) > 0:
+        print(f"Parameter profile for {solver}: {params}")
+    return params
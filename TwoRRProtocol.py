@@ -0,0 +1,55 @@
+# This file contains the compact text format used to exchange
+# home away patterns and schedules with the external slave solver
+# through pipes, instead of files in Temp/.
+#
+# A pattern is one line with a packed bit row for each team:
+# "x" followed by the hexadecimal value of the row, where bit i
+# is 1 if the team plays home in slot i.
+# A schedule is one line with the match triples:
+# "schedule <home> <away> <slot> <home> <away> <slot> ..."
+# The core of an infeasible pattern is one line with the (team, slot)
+# pairs of a part of the pattern that is already infeasible:
+# "core <team> <slot> <team> <slot> ..."
+
+import xml.etree.ElementTree as et
+import numpy as np
+from TwoRRProblem import read_solution_element
+
+def pack_pattern(solution):
+    # Encodes the ha pattern, solution[team][slot] = 1 if
+    # the team plays home in the slot, as a single line.
+    pattern = np.asarray(solution, dtype=np.int64) > 0.5
+    weights = 1 << np.arange(pattern.shape[1], dtype=object)
+    return " ".join("x" + format(int(np.dot(row, weights)), "x") for row in pattern.astype(object)) + "\n"
+
+def unpack_pattern(line, n_slots):
+    # Inverse of pack_pattern
+    return [[(int(row[1:], 16) >> slot) & 1 for slot in range(n_slots)]
+            for row in line.split()]
+
+def format_schedule(solution):
+    # Encodes a solution (the list of (home, away) games of each slot) as a single line
+    return " ".join(["schedule"] + [f"{h} {a} {slot}" for slot, games in enumerate(solution) for h, a in games]) + "\n"
+
+def parse_schedule(data):
+    # Decodes the match triples of a schedule line (without the keyword)
+    triples = np.array(data.split(), dtype=np.int64).reshape(-1, 3)
+    n_slots = triples[:, 2].max() + 1 if len(triples) else 0
+    solution = [[] for _ in range(n_slots)]
+    for h, a, slot in triples.tolist():
+        solution[slot].append((h, a))
+    return solution
+
+def parse_slave_line(line):
+    # Parses a line written by the slave solver. Returns (kind, data),
+    # where data is the solution for the "schedule" and "solution" (xml)
+    # lines, the list of (team, slot) for the "core" lines, and the rest
+    # of the line otherwise.
+    kind, _, data = line.strip().partition(" ")
+    if kind == "core":
+        return kind, [tuple(cell) for cell in np.array(data.split(), dtype=np.int64).reshape(-1, 2).tolist()]
+    if kind == "schedule":
+        return kind, parse_schedule(data)
+    if kind == "solution":
+        return kind, read_solution_element(et.fromstring(data))
+    return kind, data
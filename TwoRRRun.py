@@ -0,0 +1,68 @@
+# This file contains the working directory of a run, so that
+# concurrent runs on the same instance (e.g. a parameter sweep)
+# do not overwrite each other's patterns, slave solutions and
+# model files. The solutions are written directly to Output/,
+# each file atomically (see atomic_open), so that the solutions
+# of a killed run are kept; the run directory only holds the
+# temporary files, and is removed when the run finishes.
+
+import os, sys, time
+import atexit
+import shutil
+import signal
+import tempfile
+import threading
+
+RUNS_DIR = "Runs"
+OUTPUT_DIR = "Output"
+
+class RunDirectory():
+    # A unique directory Runs/<instance>_<date>_<pid>_<random>/ with
+    # the Temp/ subdirectory of the run. finish() removes the directory
+    # (unless keep=True). It is called on exit and on SIGTERM if the
+    # run did not finish.
+    def __init__(self, problem_filename, root=RUNS_DIR, keep=False):
+        os.makedirs(root, exist_ok=True)
+        prefix = f"{os.path.basename(problem_filename)}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_"
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+        self.temp_dir = os.path.join(self.path, "Temp")
+        os.makedirs(self.temp_dir)
+        self.keep = keep
+        self.finished = False
+        atexit.register(self.finish)
+        exit_on_sigterm()
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def temp(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def output(self, name):
+        # A solution file, in the global Output/ (shared by the runs:
+        # the files must be written with atomic_open)
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        return os.path.join(OUTPUT_DIR, name)
+
+    def finish(self):
+        # Cleans up the directory of the run
+        if self.finished:
+            return
+        self.finished = True
+        atexit.unregister(self.finish)
+        if not self.keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.finish()
+
+def exit_on_sigterm():
+    # SIGTERM (e.g. the time limit of run_batch.py) exits through
+    # sys.exit, so that the runs are finished by atexit
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
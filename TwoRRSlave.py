@@ -10,8 +10,10 @@ import os
 #os.environ["GRB_LICENSE_FILE"] = "C:\\gurobi\\gurobi-ac.lic"
 import gurobipy as gp
 from gurobipy import GRB
-from TwoRRProblem import TwoRRProblem, write_solution
-from TwoRRValidator import validate_constraint
+import numpy as np
+from TwoRRProblem import TwoRRProblem, Mode, VarArray, write_solution, solution_from_array
+from TwoRRValidator import validate_solution
+from TwoRRProfiles import apply_profile
 
 def solve_slave(prob, model, ha_patterns, debug = True):
 
@@ -37,16 +39,16 @@ def solve_slave(prob, model, ha_patterns, debug = True):
     write_status(model)
 
     if (model.solCount > 0):
-        solution = make_solution(model._vars, n_teams, n_slots)
+        x = model._x_array.values(model)
+        solution = make_solution(x, n_teams, n_slots)
         obj = 0
-        for constraint in prob.constraints:
-            violated,diff,penalty = validate_constraint(prob, solution, constraint)
+        for violated,diff,penalty in validate_solution(prob, solution):
             obj += penalty
             #print(constraint[0], (violated,diff,penalty))
         if model._best_obj == -1 or obj < model._best_obj:
             model._best_obj = obj
             print(">>>> Slave: Found new best incumbent with value: " + str(obj))
-            write_solution("ms_solution.xml", prob, model._vars, model.objVal)
+            write_solution("ms_solution.xml", prob, x, model.objVal)
         else:
             print(">>>> Slave: Found assignment with value: " + str(obj))
     
@@ -76,6 +78,8 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
 
     model.setParam("MIPFocus", 1)
     model.setParam("Heuristics", 0.5)
+    # Profile of the instance (see TwoRRProfiles)
+    apply_profile(model, prob, "slave", debug)
 
     model.setParam("TimeLimit", 600)
 
@@ -92,6 +96,7 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
             for slot in range(n_slots):
                 m_vars[team1, team2, slot] = \
                     model.addVar(vtype=GRB.BINARY, name="x_" + str(team1) + "_" + str(team2) + "_" + str(slot))
+    model._x_array = VarArray(m_vars, (n_teams, n_teams, n_slots))
 
     # Add constraints that force each team to play against
     # another team at most once per slot.
@@ -119,26 +124,27 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                                             for slot in range(int(n_slots/2), n_slots)]) <= 1)
 
     # Add problem specific constraints
-    for (ind, (c_name, constraint)) in enumerate(prob.constraints):
+    for (ind, constraint) in enumerate(prob.constraints):
+        c_name = constraint.name
         if c_name == "CA2":
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            teams1 = [int(t) for t in constraint["teams1"].split(';')]
-            teams2 = [int(t) for t in constraint["teams2"].split(';')]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            penalty = int(constraint["penalty"])
+            slots = constraint.slots
+            teams1 = constraint.teams1
+            teams2 = constraint.teams2
+            c_min = constraint.min
+            c_max = constraint.max
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA2 not implemented!")
             for team in teams1:
-                if constraint["type"] == "HARD":
-                    if constraint["mode1"] == "A":
+                if constraint.hard:
+                    if constraint.mode1 == Mode.A:
                         constr = model.addConstr(gp.quicksum([m_vars[i, team, j] 
                                             for i in teams2 if i != team
                                             for j in slots]) <= c_max,
                                         name="CA2_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                    elif constraint["mode1"] == "H":
+                    elif constraint.mode1 == Mode.H:
                         constr = model.addConstr(gp.quicksum([m_vars[team, i, j] 
                                             for i in teams2 if i != team
                                             for j in slots]) <= c_max,
@@ -157,14 +163,14 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                             constr.Lazy = lazy
                 elif not skipSoft:
                     slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
-                    if constraint["mode1"] == "A":
+                    if constraint.mode1 == Mode.A:
                         constr = model.addConstr(gp.quicksum([m_vars[i, team, j] 
                                             for i in teams2 if i != team
                                             for j in slots]) - slack <= c_max,
                                         name="CA2_" + str(team) + "_" + str(ind))
                         if lazy:
                             constr.Lazy = lazy
-                    elif constraint["mode1"] == "H":
+                    elif constraint.mode1 == Mode.H:
                         constr = model.addConstr(gp.quicksum([m_vars[team, i, j] 
                                             for i in teams2 if i != team
                                             for j in slots]) - slack <= c_max,
@@ -182,17 +188,17 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                         if lazy:
                             constr.Lazy = lazy
         if c_name == "CA3":
-            teams1 = [int(t) for t in constraint["teams1"].split(';')]
-            teams2 = [int(t) for t in constraint["teams2"].split(';')]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            intp = int(constraint["intp"])
-            penalty = int(constraint["penalty"])
+            teams1 = constraint.teams1
+            teams2 = constraint.teams2
+            c_min = constraint.min
+            c_max = constraint.max
+            intp = constraint.intp
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA3 not implemented!")
             for team in teams1:
-                if constraint["type"] == "HARD":
-                    if constraint["mode1"] == "A":
+                if constraint.hard:
+                    if constraint.mode1 == Mode.A:
                         for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                             constr = model.addConstr(gp.quicksum([m_vars[i, team, j] 
                                                 for i in teams2 if i != team
@@ -200,7 +206,7 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                                             name="CA3_" + str(team) + "_" + str(slots[0]) + "_" + str(slots[-1]) + "_" + str(ind))
                             if lazy:
                                 constr.Lazy = lazy
-                    elif constraint["mode1"] == "H":
+                    elif constraint.mode1 == Mode.H:
                         for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                             constr = model.addConstr(gp.quicksum([m_vars[team, i, j] 
                                                 for i in teams2 if i != team
@@ -220,7 +226,7 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
                 elif not skipSoft:
-                    if constraint["mode1"] == "A":
+                    if constraint.mode1 == Mode.A:
                         for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                             slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                             constr = model.addConstr(gp.quicksum([m_vars[i, team, j] 
@@ -229,7 +235,7 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                                             name="CA3_" + str(team) + "_" + str(slots[0]) + "_" + str(slots[-1]) + "_" + str(ind))
                             if lazy:
                                 constr.Lazy = lazy
-                    elif constraint["mode1"] == "H":
+                    elif constraint.mode1 == Mode.H:
                         for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                             slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                             constr = model.addConstr(gp.quicksum([m_vars[team, i, j] 
@@ -251,17 +257,17 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
         if c_name == "CA4":
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            teams1 = [int(t) for t in constraint["teams1"].split(';')]
-            teams2 = [int(t) for t in constraint["teams2"].split(';')]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            penalty = int(constraint["penalty"])
+            slots = constraint.slots
+            teams1 = constraint.teams1
+            teams2 = constraint.teams2
+            c_min = constraint.min
+            c_max = constraint.max
+            penalty = constraint.penalty
             if (c_min > 0):
                 raise Exception("Min value in CA4 not implemented!")
-            if constraint["type"] == "HARD":
-                if constraint["mode1"] == "A":
-                    if constraint["mode2"] == "GLOBAL":
+            if constraint.hard:
+                if constraint.mode1 == Mode.A:
+                    if constraint.mode2 == Mode.GLOBAL:
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams2
                                             for j in teams1 if i != j
@@ -277,8 +283,8 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                                             name="CA4_" + str(slot) + "_" + str(ind))
                             if lazy:
                                 constr.Lazy = lazy
-                elif constraint["mode1"] == "H":
-                    if constraint["mode2"] == "GLOBAL":
+                elif constraint.mode1 == Mode.H:
+                    if constraint.mode2 == Mode.GLOBAL:
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams1
                                             for j in teams2 if i != j
@@ -295,7 +301,7 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
                 else:
-                    if constraint["mode2"] == "GLOBAL":
+                    if constraint.mode2 == Mode.GLOBAL:
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams1
                                             for j in teams2 if i != j
@@ -319,8 +325,8 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
             elif not skipSoft:
-                if constraint["mode1"] == "A":
-                    if constraint["mode2"] == "GLOBAL":
+                if constraint.mode1 == Mode.A:
+                    if constraint.mode2 == Mode.GLOBAL:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams2
@@ -338,8 +344,8 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                                             name="CA4_" + str(slot) + "_" + str(ind))
                             if lazy:
                                 constr.Lazy = lazy
-                elif constraint["mode1"] == "H":
-                    if constraint["mode2"] == "GLOBAL":
+                elif constraint.mode1 == Mode.H:
+                    if constraint.mode2 == Mode.GLOBAL:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams1
@@ -358,7 +364,7 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                             if lazy:
                                 constr.Lazy = lazy
                 else:  
-                    if constraint["mode2"] == "GLOBAL":
+                    if constraint.mode2 == Mode.GLOBAL:
                         slack = model.addVar(vtype=GRB.INTEGER, obj=penalty)
                         constr = model.addConstr(gp.quicksum([m_vars[i, j, z] 
                                             for i in teams1
@@ -385,12 +391,12 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
                                 constr.Lazy = lazy
         # Game constraints
         if c_name == "GA1":
-            slots = [int(s) for s in constraint["slots"].split(';')]
-            games = [(int(t.split(',')[0]),int(t.split(',')[1])) for t in constraint["meetings"].split(';') if len(t) > 0]
-            c_min = int(constraint["min"])
-            c_max = int(constraint["max"])
-            penalty = int(constraint["penalty"])
-            if constraint["type"] == "HARD":
+            slots = constraint.slots
+            games = constraint.meetings
+            c_min = constraint.min
+            c_max = constraint.max
+            penalty = constraint.penalty
+            if constraint.hard:
                 constr = model.addConstr(gp.quicksum([m_vars[i, j, slot] 
                                     for i,j in games
                                     for slot in slots]) <= c_max,
@@ -421,10 +427,10 @@ def create_slave(prob: TwoRRProblem, env, skipSoft=False, lazy=0, debug=True):
 
         # Separation constraints
         if c_name == "SE1":
-            teams = [int(t) for t in constraint["teams"].split(';')]
-            penalty = int(constraint["penalty"])
-            c_min = int(constraint["min"])
-            if constraint["type"] == "HARD": 
+            teams = constraint.teams
+            penalty = constraint.penalty
+            c_min = constraint.min
+            if constraint.hard: 
                 raise Exception("The HARD version of constraint SE1 is not implemented!")
             elif not skipSoft:
                 for i in range(len(teams)):
@@ -477,7 +483,10 @@ def write_status(model: gp.Model):
 
 
 def make_solution(m_vars, n_teams, n_slots):
-    # Computes the solution from the binary variables of the model
+    # Computes the solution from the binary variables of the model,
+    # or from an array of their values (see VarArray)
+    if isinstance(m_vars, np.ndarray):
+        return solution_from_array(m_vars)
     solution = []
     for slot in range(n_slots):
         games = []
@@ -0,0 +1,74 @@
+# This file contains a persistent cache of the outcomes of
+# the slave solver, so that a home away pattern is never sent
+# to the slave twice, across restarts and parallel runs of
+# the master on the same instance.
+
+import os
+import json
+import hashlib
+import numpy as np
+from TwoRRProblem import INSTANCE_CACHE_DIR, atomic_open
+
+SLAVE_CACHE_DIR = os.path.join(INSTANCE_CACHE_DIR, "slaves")
+# Must be increased whenever the format of the entries changes
+# (2: timeouts are not stored, and infeasible only if the slave says so)
+SLAVE_CACHE_VERSION = 2
+# Number of schedules stored for each pattern (the best ones)
+SLAVE_CACHE_SOLUTIONS = 10
+
+# Outcomes of the slave for a pattern
+INFEASIBLE = "infeasible" # Proven infeasible
+TIMEOUT = "timeout" # No schedule found within the time limits (not stored)
+FEASIBLE = "feasible" # Schedules found, optimality not proven
+OPTIMAL = "optimal" # Schedules found, the best one is optimal
+
+class SlaveCache():
+    # Content addressed cache: each entry is a JSON file in the
+    # directory of the instance (named after the hash of the XML
+    # file), named after the bit-packed pattern matrix.
+    def __init__(self, problem_filename, directory=SLAVE_CACHE_DIR):
+        with open(problem_filename, "rb") as myxml:
+            digest = hashlib.sha256(myxml.read()).hexdigest()
+        self.directory = os.path.join(directory, f"{digest}_v{SLAVE_CACHE_VERSION}")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, solution):
+        # Hex of the pattern, solution[team][slot] = 1 if home,
+        # packed row by row (the shape is fixed by the instance).
+        return np.packbits(np.asarray(solution) > 0.5).tobytes().hex()
+
+    def file_name(self, solution):
+        return os.path.join(self.directory, self.key(solution) + ".json")
+
+    def get(self, solution):
+        # The cached entry of the pattern, None if missing:
+        # {"status": ..., "solutions": [{"objective": ..., "games": [[h, a, slot], ...]}, ...]}
+        # Infeasible patterns may also have a "core": [[team, slot], ...]
+        try:
+            with open(self.file_name(solution)) as myfile:
+                return json.load(myfile)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, solution, status, schedules, core=None):
+        # Stores the outcome of the slave for the pattern. schedules is
+        # a list of (objective, solution), only the best ones are kept.
+        schedules = sorted(schedules, key=lambda schedule: schedule[0])[:SLAVE_CACHE_SOLUTIONS]
+        entry = {"status": status,
+                 "solutions": [{"objective": objective, "games": solution_games(schedule)}
+                               for objective, schedule in schedules]}
+        if core is not None:
+            entry["core"] = [list(cell) for cell in core]
+        with atomic_open(self.file_name(solution)) as myfile:
+            json.dump(entry, myfile)
+
+def solution_games(solution):
+    # The [home, away, slot] games of a solution
+    return [[h, a, slot] for slot, games in enumerate(solution) for h, a in games]
+
+def games_solution(games):
+    # Inverse of solution_games
+    solution = [[] for _ in range(max((slot for _, _, slot in games), default=-1) + 1)]
+    for h, a, slot in games:
+        solution[slot].append((h, a))
+    return solution
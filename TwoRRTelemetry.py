@@ -0,0 +1,158 @@
+# This file contains the telemetry of the master-slave loop:
+# structured events written as JSON lines to Logs/telemetry_<run>.jsonl,
+# one file per run, and a summariser for a set of such files.
+# Every event has the time (seconds since the epoch), the elapsed
+# time since the start of the run, the instance and the run id:
+#
+#   {"time": 1760000000.0, "elapsed": 12.5, "instance": "Early 1",
+#    "run": "ITC2021_Early_1.xml_20261017_120000_42_abcd", "event": "slave_end",
+#    "pattern": "3f2a...", "job": 7, "status": "feasible", "solutions": 3, "wall": 10.2}
+#
+# Events: run_start, pattern, precheck, slave_start, slave_end,
+# validation, best, progress (the MIP gap and bound of the master)
+# and run_end.
+#
+# Usage: python TwoRRTelemetry.py "Logs/telemetry_*.jsonl" [--target 1000]
+
+import os, sys, time
+import json
+import glob
+import hashlib
+import argparse
+import threading
+from TwoRRProtocol import pack_pattern
+
+TELEMETRY_DIR = "Logs"
+# Minimum time between two progress events, in seconds
+PROGRESS_INTERVAL = 10
+
+def pattern_id(solution):
+    # Short id of a ha pattern, to match its events
+    return hashlib.sha1(pack_pattern(solution).encode()).hexdigest()[:12]
+
+class Telemetry():
+    # The event log of a run. event() is thread safe, and every event
+    # is flushed, so that the log of a killed run is complete. With
+    # enabled=False the events are discarded.
+    def __init__(self, run_id, instance, directory=TELEMETRY_DIR, enabled=True):
+        self.run_id = run_id
+        self.instance = instance
+        self.enabled = enabled
+        self.start = time.time()
+        self.last_progress = None
+        self.lock = threading.Lock()
+        self.file_name = None
+        self.file = None
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+            self.file_name = os.path.join(directory, f"telemetry_{run_id}.jsonl")
+            self.file = open(self.file_name, "a")
+
+    def event(self, kind, **fields):
+        if not self.enabled:
+            return
+        now = time.time()
+        record = {"time": round(now, 3), "elapsed": round(now - self.start, 3),
+                  "instance": self.instance, "run": self.run_id, "event": kind}
+        record.update(fields)
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def progress(self, **fields):
+        # A progress event, at most every PROGRESS_INTERVAL seconds
+        now = time.time()
+        if self.last_progress is not None and now - self.last_progress < PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        self.event("progress", **fields)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def read_events(file_names):
+    # The events of the files, grouped by run: {run: [event, ...]}
+    runs = dict()
+    for file_name in file_names:
+        with open(file_name) as myfile:
+            for line in myfile:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Partial last line of a killed run
+                    continue
+                runs.setdefault(event["run"], []).append(event)
+    return runs
+
+def summarise_run(events, target=None):
+    # Throughput of a run: patterns per hour, fraction of the patterns
+    # rejected by the pattern checks, slave utilisation (busy time of
+    # the slaves over their available time), time to the first feasible
+    # schedule, time to the best one and time to the target objective
+    # (None if not reached)
+    start = next((e for e in events if e["event"] == "run_start"), events[0])
+    end = events[-1]["elapsed"]
+    workers = max(1, start.get("slave_workers", 1))
+    patterns = sum(1 for e in events if e["event"] == "pattern")
+    rejected = sum(1 for e in events if e["event"] == "precheck" and e["result"] != "passed")
+    slaves = [e for e in events if e["event"] == "slave_end"]
+    busy = sum(e["wall"] for e in slaves if not e.get("cached"))
+    bests = [e for e in events if e["event"] == "best"]
+    reached = [e for e in bests if target is not None and e["objective"] <= target]
+    return {"instance": start["instance"], "run": start["run"],
+            "duration": round(end, 1),
+            "patterns": patterns,
+            "patterns_per_hour": round(patterns * 3600 / end, 1) if end > 0 else None,
+            "rejected": round(rejected / patterns, 3) if patterns else None,
+            "slave_runs": len(slaves),
+            "cache_hits": sum(1 for e in slaves if e.get("cached")),
+            "slave_utilisation": round(busy / (end * workers), 3) if end > 0 else None,
+            "best": bests[-1]["objective"] if bests else None,
+            "time_first": bests[0]["elapsed"] if bests else None,
+            "time_best": bests[-1]["elapsed"] if bests else None,
+            "target": target,
+            "time_target": reached[0]["elapsed"] if reached else None,
+            "finished": events[-1]["event"] == "run_end"}
+
+def summarise(file_names, target=None):
+    # The summaries of the runs in the files. Without a target, the
+    # target of an instance is the best objective over all its runs.
+    runs = read_events(file_names)
+    best = dict()
+    for events in runs.values():
+        for e in events:
+            if e["event"] == "best" and (e["instance"] not in best or e["objective"] < best[e["instance"]]):
+                best[e["instance"]] = e["objective"]
+    return [summarise_run(events, target if target is not None else best.get(events[0]["instance"]))
+            for events in runs.values()]
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Summarises the telemetry of runs of the master.")
+    parser.add_argument("files", nargs="*", default=[os.path.join(TELEMETRY_DIR, "telemetry_*.jsonl")],
+                        help="telemetry files or glob patterns")
+    parser.add_argument("--target", type=int, default=None, help="target objective (default: best of each instance)")
+    parser.add_argument("--json", action="store_true", help="print the summaries as JSON lines")
+    args = parser.parse_args()
+
+    file_names = sorted(set(f for pattern in args.files for f in glob.glob(pattern)))
+    if len(file_names) == 0:
+        sys.exit("No telemetry files found")
+    rows = summarise(file_names, args.target)
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+    else:
+        columns = ["instance", "duration", "patterns", "patterns_per_hour", "rejected", "slave_utilisation",
+                   "best", "time_first", "time_best", "target", "time_target"]
+        widths = [max([len(column)] + [len(str(row[column])) for row in rows]) for column in columns]
+        print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+        for row in rows:
+            print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
@@ -0,0 +1,229 @@
+# This file contains a harness to tune the Gurobi parameters of
+# the solvers on a set of instances, with a fixed time budget for
+# each run. The best profile of each instance class (or of each
+# instance) is stored in the profiles file (see TwoRRProfiles),
+# which the solvers load at startup.
+#
+# Usage: python TwoRRTuning.py --solver naive --method random --trials 20 --budget 60 "Instances/TestInstances/ITC*.xml"
+
+import os, sys
+import json
+import math
+import random
+import argparse
+import itertools
+import gurobipy as gp
+from gurobipy import GRB
+from TwoRRProblem import read_instance
+from TwoRRProfiles import PARAMETER_PROFILES, PARAMETERS_ENV, instance_class, read_profiles, write_profiles
+from run_batch import instance_files, run_instance
+
+# The parameters hardcoded in the solvers, evaluated as the first candidate
+DEFAULT_PROFILE = {"MIPFocus": 1, "Heuristics": 0.5, "Presolve": 2, "Symmetry": 2, "GomoryPasses": 1, "PrePasses": 2}
+
+# Values tried for each parameter by the random and grid searches
+SEARCH_SPACE = {
+    "MIPFocus": [0, 1, 2, 3],
+    "Heuristics": [0.05, 0.2, 0.5, 0.8],
+    "Presolve": [-1, 0, 1, 2],
+    "Symmetry": [-1, 0, 1, 2],
+    "GomoryPasses": [-1, 0, 1, 5],
+    "PrePasses": [-1, 1, 2, 5],
+    "Cuts": [-1, 0, 1, 2],
+}
+
+# Parameters that are not part of a profile (resources, limits, output)
+EXCLUDED_PARAMETERS = {"Threads", "TimeLimit", "TuneTimeLimit", "OutputFlag", "LogToConsole", "LogFile",
+                       "LazyConstraints", "PoolSolutions", "PoolSearchMode", "SoftMemLimit", "MemLimit"}
+
+SOLVERS = ["master", "slave", "naive"]
+
+def random_candidates(params, trials, seed=0):
+    # The default profile followed by trials - 1 random profiles
+    # (the whole grid if it has no more profiles than that)
+    if trials > math.prod(len(SEARCH_SPACE[name]) for name in params):
+        return grid_candidates(params, trials)
+    rng = random.Random(seed)
+    candidates = [dict(DEFAULT_PROFILE)]
+    while len(candidates) < trials:
+        candidate = dict(DEFAULT_PROFILE)
+        candidate.update({name: rng.choice(SEARCH_SPACE[name]) for name in params})
+        if candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+def grid_candidates(params, trials):
+    # The default profile followed by the grid over params, up to trials profiles
+    candidates = [dict(DEFAULT_PROFILE)]
+    for values in itertools.product(*[SEARCH_SPACE[name] for name in params]):
+        if len(candidates) >= trials:
+            break
+        candidate = dict(DEFAULT_PROFILE)
+        candidate.update(zip(params, values))
+        if candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+def build_model(solver, prob, env):
+    # The model tuned for naive (the full model) and slave (the model
+    # without soft constraints and without a pattern, as a proxy for
+    # the patterns of the master)
+    from TwoRROptimization import build_naive_matrix
+    from TwoRRSlave import create_slave
+    if solver == "naive":
+        model, _ = build_naive_matrix(prob, False, 1, False, False)
+    else:
+        model = create_slave(prob, env, skipSoft=True, debug=False)
+    model.update()
+    return model
+
+def tuned_parameters(model):
+    # The parameters of the model that differ from the Gurobi defaults,
+    # and those of the default profile (which the solvers always set)
+    params = dict()
+    for name in dir(GRB.Param):
+        if name.startswith("_") or name in EXCLUDED_PARAMETERS:
+            continue
+        try:
+            _, _, value, _, _, default = model.getParamInfo(name)
+        except gp.GurobiError:
+            continue
+        if value != default or name in DEFAULT_PROFILE:
+            params[name] = value
+    return params
+
+def gurobi_candidates(solver, files, budget, env):
+    # The default profile and the best profile of the Gurobi tuner for each instance
+    candidates = [dict(DEFAULT_PROFILE)]
+    for filename in files:
+        model = build_model(solver, read_instance(filename), env)
+        for name, value in DEFAULT_PROFILE.items():
+            model.setParam(name, value)
+        model.setParam("TuneTimeLimit", budget * 10)
+        model.setParam("TimeLimit", budget)
+        model.tune()
+        if model.TuneResultCount > 0:
+            model.getTuneResult(0)
+            candidate = tuned_parameters(model)
+            print(f"{os.path.basename(filename)}: tuner profile {candidate}")
+            if candidate not in candidates:
+                candidates.append(candidate)
+        model.dispose()
+    return candidates
+
+def run_model(model, params, budget):
+    # Solves the model with the parameters, set over the default
+    # profile as in the solvers. Returns the score of the run:
+    # (not optimal, objective, runtime), lower is better.
+    model.setParam("OutputFlag", 0)
+    model.reset(1)
+    model.resetParams()
+    model.setParam("OutputFlag", 0)
+    model.setParam("Threads", 1)
+    model.setParam("TimeLimit", budget)
+    for name, value in {**DEFAULT_PROFILE, **params}.items():
+        model.setParam(name, value)
+    model.optimize()
+    objective = model.ObjVal if model.SolCount > 0 else math.inf
+    return (int(model.Status != GRB.OPTIMAL), objective, model.Runtime)
+
+def run_master(filename, params, budget):
+    # Runs the master with the parameters (through TWORR_PARAMS) for
+    # the budget, without checkpoints (the runs must not resume each
+    # other). Returns (1, best objective, time to best).
+    env = dict(os.environ)
+    env[PARAMETERS_ENV] = json.dumps({"master": params})
+    log_filename = os.path.join("Logs", f"tuning_{os.path.basename(filename)}.out")
+    row = run_instance(filename, budget, 0, 1, env=env, log_filename=log_filename, args=["--no-checkpoint"])
+    if row["best"] is None:
+        return (1, math.inf, budget)
+    return (1, row["best"], row["time_best"])
+
+def evaluate(solver, files, candidates, budget, env):
+    # results[c][filename]: score of candidate c on the instance
+    results = [dict() for _ in candidates]
+    for filename in files:
+        model = build_model(solver, read_instance(filename), env) if solver != "master" else None
+        for c, candidate in enumerate(candidates):
+            if model is None:
+                results[c][filename] = run_master(filename, candidate, budget)
+            else:
+                results[c][filename] = run_model(model, candidate, budget)
+            print(f"{os.path.basename(filename)}: candidate {c} {format_score(results[c][filename])}")
+        if model is not None:
+            model.dispose()
+    return results
+
+def format_score(score):
+    not_optimal, objective, runtime = score
+    return f"{'stopped' if not_optimal else 'optimal'}, objective {objective}, {runtime:.1f}s"
+
+def best_candidate(results, files):
+    # Index of the best candidate on the instances: fewest instances
+    # without a solution, then smallest total relative gap to the best
+    # objective of the instance, then fewest not optimal, then time
+    def score(c):
+        failed = sum(math.isinf(results[c][f][1]) for f in files)
+        gap = 0
+        for f in files:
+            best = min(result[f][1] for result in results)
+            if not math.isinf(results[c][f][1]):
+                gap += (results[c][f][1] - best) / max(1, abs(best))
+        not_optimal = sum(results[c][f][0] for f in files)
+        runtime = sum(results[c][f][2] for f in files)
+        return (failed, gap, not_optimal, runtime)
+    return min(range(len(results)), key=score)
+
+def tune(solver, files, method="random", per="class", trials=10, budget=60, params=None, seed=0, file_name=PARAMETER_PROFILES):
+    # Tunes the parameters of the solver on the instances, and stores
+    # the best profile of each class (per="class") or instance
+    # (per="instance") in the profiles file. Returns the new profiles.
+    params = params or list(DEFAULT_PROFILE.keys())
+    env = gp.Env(empty=True)
+    env.setParam("OutputFlag", 0)
+    env.start()
+
+    if method == "gurobi":
+        if solver == "master":
+            raise Exception("The Gurobi tuner needs a single model, use random or grid for the master")
+        candidates = gurobi_candidates(solver, files, budget, env)
+    elif method == "grid":
+        candidates = grid_candidates(params, trials)
+    else:
+        candidates = random_candidates(params, trials, seed)
+    print(f"Evaluating {len(candidates)} profiles on {len(files)} instances, {budget}s each")
+    results = evaluate(solver, files, candidates, budget, env)
+
+    groups = dict()
+    for filename in files:
+        prob = read_instance(filename)
+        key = instance_class(prob) if per == "class" else prob.name
+        groups.setdefault(key, []).append(filename)
+
+    profiles = read_profiles(file_name)
+    section = profiles.setdefault(solver, dict()).setdefault("classes" if per == "class" else "instances", dict())
+    for key, group in groups.items():
+        c = best_candidate(results, group)
+        section[key] = candidates[c]
+        print(f"{key}: candidate {c} {candidates[c]}")
+    write_profiles(profiles, file_name)
+    print(f"Profiles written to {file_name}")
+    return profiles
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Tunes the Gurobi parameters of a solver on a set of instances.")
+    parser.add_argument("instances", nargs="+", help="instance files, directories or glob patterns")
+    parser.add_argument("--solver", choices=SOLVERS, default="naive")
+    parser.add_argument("--method", choices=["random", "grid", "gurobi"], default="random")
+    parser.add_argument("--per", choices=["class", "instance"], default="class", help="one profile per class or per instance")
+    parser.add_argument("--trials", type=int, default=10, help="profiles evaluated by the random and grid searches")
+    parser.add_argument("--budget", type=float, default=60, help="time limit of each run, in seconds")
+    parser.add_argument("--params", nargs="+", choices=list(SEARCH_SPACE.keys()), default=None, help="parameters searched")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profiles", default=PARAMETER_PROFILES, help="profiles file")
+    args = parser.parse_args()
+
+    files = instance_files(args.instances)
+    if len(files) == 0:
+        sys.exit("No instances found")
+    tune(args.solver, files, args.method, args.per, args.trials, args.budget, args.params, args.seed, args.profiles)
@@ -1,15 +1,16 @@
 # Validates the constraints of a TwoRRProblem, that is checks
 # whether a constraint is violated and by how much.
 
-from TwoRRProblem import TwoRRProblem
+import numpy as np
+from TwoRRProblem import TwoRRProblem, TwoRRConstraint, Mode
 
-def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
+def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint: TwoRRConstraint):
     # The solution is, for example, [[(0,1), (2,3)], [(1,0), (3,2)]].
     # Each game is a tuple of team ids. There is a list of games for each slot.
-    # The constraint is in the same format used in the RobinX format.
+    # The constraint is a TwoRRConstraint, parsed from the RobinX format.
 
-    c_name = twoRRConstraint[0]
-    constraint = twoRRConstraint[1]
+    c_name = twoRRConstraint.name
+    constraint = twoRRConstraint
 
     n_slots = len(problem.slots)
     n_teams = len(problem.teams)
@@ -56,18 +57,18 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
     
     # Capacity constraints:
     if c_name == "CA1":
-        slots = [int(s) for s in constraint["slots"].split(';')]
-        teams = [int(t) for t in constraint["teams"].split(';')]
-        c_min = int(constraint["min"])
-        c_max = int(constraint["max"])
-        penalty = int(constraint["penalty"])
+        slots = constraint.slots
+        teams = constraint.teams
+        c_min = constraint.min
+        c_max = constraint.max
+        penalty = constraint.penalty
         if (c_min > 0):
             raise Exception("Min value in CA1 not implemented!")
         for team in teams:
-            if constraint["mode"] == "A":
+            if constraint.mode == Mode.A:
                 diff += max(sum([plays_home(team, slot, away=True)
                                     for slot in slots]) - c_max, 0)
-            elif constraint["mode"] == "H":
+            elif constraint.mode == Mode.H:
                 diff += max(sum([plays_home(team, slot)
                                     for slot in slots]) - c_max, 0)
             else:
@@ -76,20 +77,20 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
         return (diff > 0, diff, penalty * diff)
 
     if c_name == "CA2":
-        slots = [int(s) for s in constraint["slots"].split(';')]
-        teams1 = [int(t) for t in constraint["teams1"].split(';')]
-        teams2 = [int(t) for t in constraint["teams2"].split(';')]
-        c_min = int(constraint["min"])
-        c_max = int(constraint["max"])
-        penalty = int(constraint["penalty"])
+        slots = constraint.slots
+        teams1 = constraint.teams1
+        teams2 = constraint.teams2
+        c_min = constraint.min
+        c_max = constraint.max
+        penalty = constraint.penalty
         if (c_min > 0):
             raise Exception("Min value in CA2 not implemented!")
         for team in teams1:
-            if constraint["mode1"] == "A":
+            if constraint.mode1 == Mode.A:
                 diff += max(sum([plays_home_against(team, other_team, slot, away=True)
                                     for other_team in teams2 if other_team != team
                                     for slot in slots]) - c_max, 0)
-            elif constraint["mode1"] == "H":
+            elif constraint.mode1 == Mode.H:
                 diff += max(sum([plays_home_against(team, other_team, slot)
                                     for other_team in teams2 if other_team != team
                                     for slot in slots]) - c_max, 0)
@@ -104,21 +105,21 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
         return (diff > 0, diff, penalty * diff)
 
     if c_name == "CA3":
-        teams1 = [int(t) for t in constraint["teams1"].split(';')]
-        teams2 = [int(t) for t in constraint["teams2"].split(';')]
-        c_min = int(constraint["min"])
-        c_max = int(constraint["max"])
-        intp = int(constraint["intp"])
-        penalty = int(constraint["penalty"])
+        teams1 = constraint.teams1
+        teams2 = constraint.teams2
+        c_min = constraint.min
+        c_max = constraint.max
+        intp = constraint.intp
+        penalty = constraint.penalty
         if (c_min > 0):
             raise Exception("Min value in CA3 not implemented!")
         for team in teams1:
-            if constraint["mode1"] == "A":
+            if constraint.mode1 == Mode.A:
                 for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                     diff += max(sum([plays_home_against(team, other_team, slot, away=True)
                                     for other_team in teams2 if other_team != team
                                     for slot in slots]) - c_max, 0)
-            elif constraint["mode1"] == "H":
+            elif constraint.mode1 == Mode.H:
                 for slots in [range(z, z + intp) for z in range(n_slots - intp + 1)]:
                     diff += max(sum([plays_home_against(team, other_team, slot)
                                     for other_team in teams2 if other_team != team
@@ -135,16 +136,16 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
         return (diff > 0, diff, penalty * diff)
             
     if c_name == "CA4":
-        slots = [int(s) for s in constraint["slots"].split(';')]
-        teams1 = [int(t) for t in constraint["teams1"].split(';')]
-        teams2 = [int(t) for t in constraint["teams2"].split(';')]
-        c_min = int(constraint["min"])
-        c_max = int(constraint["max"])
-        penalty = int(constraint["penalty"])
+        slots = constraint.slots
+        teams1 = constraint.teams1
+        teams2 = constraint.teams2
+        c_min = constraint.min
+        c_max = constraint.max
+        penalty = constraint.penalty
         if (c_min > 0):
             raise Exception("Min value in CA4 not implemented!")
-        if constraint["mode1"] == "A":
-            if constraint["mode2"] == "GLOBAL":
+        if constraint.mode1 == Mode.A:
+            if constraint.mode2 == Mode.GLOBAL:
                 diff += max(sum([plays_home_against(i, j, z, away=True) 
                                     for i in teams1
                                     for j in teams2 if i != j
@@ -154,8 +155,8 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
                     diff += max(sum([plays_home_against(i, j, slot, away=True) 
                                         for i in teams1
                                         for j in teams2 if i != j]) - c_max, 0)
-        elif constraint["mode1"] == "H":
-            if constraint["mode2"] == "GLOBAL":
+        elif constraint.mode1 == Mode.H:
+            if constraint.mode2 == Mode.GLOBAL:
                 diff += max(sum([plays_home_against(i, j, z) 
                                     for i in teams1
                                     for j in teams2 if i != j
@@ -166,7 +167,7 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
                                         for i in teams1
                                         for j in teams2 if i != j]) - c_max, 0)
         else:
-            if constraint["mode2"] == "GLOBAL":
+            if constraint.mode2 == Mode.GLOBAL:
                 diff += max(sum([plays_home_against(i, j, z, away=True) 
                                     for i in teams1
                                     for j in teams2 if i != j
@@ -188,11 +189,11 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
 
     # Game constraints
     if c_name == "GA1":
-        slots = [int(s) for s in constraint["slots"].split(';')]
-        games = [(int(t.split(',')[0]),int(t.split(',')[1])) for t in constraint["meetings"].split(';') if len(t) > 0]
-        c_min = int(constraint["min"])
-        c_max = int(constraint["max"])
-        penalty = int(constraint["penalty"])
+        slots = constraint.slots
+        games = constraint.meetings
+        c_min = constraint.min
+        c_max = constraint.max
+        penalty = constraint.penalty
         diff += max(sum([plays_home_against(i, j, slot) 
                         for i,j in games
                         for slot in slots]) - c_max, 0)
@@ -204,12 +205,12 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
 
     # Break constraints
     if c_name == "BR1":
-        teams = [int(t) for t in constraint["teams"].split(';')]
-        slots = [int(s) for s in constraint["slots"].split(';')]
-        mode = constraint["mode2"]
-        intp = int(constraint["intp"])
-        penalty = int(constraint["penalty"])
-        if mode == "A":
+        teams = constraint.teams
+        slots = constraint.slots
+        mode = constraint.mode2
+        intp = constraint.intp
+        penalty = constraint.penalty
+        if mode == Mode.A:
             for team in teams:
                 diff += max(sum([has_home_break(team, slot, away=True) 
                                     for slot in slots if slot != 0]) - intp, 0)
@@ -226,10 +227,10 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
         return (diff > 0, diff, penalty * diff)
 
     if c_name == "BR2":
-        teams = [int(t) for t in constraint["teams"].split(';')]
-        slots = [int(s) for s in constraint["slots"].split(';')]
-        intp = int(constraint["intp"])
-        penalty = int(constraint["penalty"])
+        teams = constraint.teams
+        slots = constraint.slots
+        intp = constraint.intp
+        penalty = constraint.penalty
         diff += max(sum([has_home_break(team, slot, away=False) + has_home_break(team, slot, away=True)
                             for team in teams
                             for slot in slots if slot != 0]) - intp, 0)
@@ -238,10 +239,10 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
 
     # Fairness constraints
     if c_name == "FA2":
-        teams = [int(t) for t in constraint["teams"].split(';')]
-        slots = sorted([int(s) for s in constraint["slots"].split(';')])
-        intp = int(constraint["intp"])
-        penalty = int(constraint["penalty"])
+        teams = constraint.teams
+        slots = sorted(constraint.slots)
+        intp = constraint.intp
+        penalty = constraint.penalty
         for team1 in teams:
             for team2 in teams:
                 if team1 == team2:
@@ -262,9 +263,9 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
                         
     # Separation constraints
     if c_name == "SE1":
-        teams = [int(t) for t in constraint["teams"].split(';')]
-        penalty = int(constraint["penalty"])
-        c_min = int(constraint["min"])
+        teams = constraint.teams
+        penalty = constraint.penalty
+        c_min = constraint.min
         for i in range(len(teams)):
             for j in range(i + 1, len(teams)):
                 diff += max(c_min + 1 - abs(sum([slot * plays_home_against(teams[i],teams[j],slot) 
@@ -274,3 +275,237 @@ def validate_constraint(problem: TwoRRProblem, solution, twoRRConstraint):
                             , 0)
         
         return (diff > 0, diff, penalty * diff)
+
+
+class ScheduleTensors():
+    # Dense representation of a schedule used by the vectorized
+    # validator. All the arrays are indexed by team and slot ids.
+    #   home[h, a, s]    1 if team h plays home against team a in slot s
+    #   home_count[t, s] number of home games of team t in slot s
+    #   away_count[t, s] number of away games of team t in slot s
+    #   plays_home[t, s] True if team t plays home in slot s
+    #   plays_away[t, s] True if team t plays away in slot s
+    #   home_break[t, s] True if team t plays home in slots s - 1 and s
+    #   away_break[t, s] True if team t plays away in slots s - 1 and s
+    # As in has_home_break, the previous slot of slot 0 is the last slot.
+    def __init__(self, problem: TwoRRProblem, solution):
+        n_teams = len(problem.teams)
+        n_slots = len(problem.slots)
+        self.n_teams = n_teams
+        self.n_slots = n_slots
+
+        self.home = np.zeros((n_teams, n_teams, n_slots), dtype=np.int64)
+        games = [(h, a, slot) for slot, matches in enumerate(solution) for h, a in matches]
+        if len(games) > 0:
+            h, a, s = np.array(games, dtype=np.int64).T
+            np.add.at(self.home, (h, a, s), 1)
+
+        self.home_count = self.home.sum(axis=1)
+        self.away_count = self.home.sum(axis=0)
+        self.plays_home = self.home_count > 0
+        self.plays_away = self.away_count > 0
+        self.home_break = self.plays_home & np.roll(self.plays_home, 1, axis=1)
+        self.away_break = self.plays_away & np.roll(self.plays_away, 1, axis=1)
+
+        # Cumulative number of home games up to (and including) each slot
+        self.home_cumsum = np.cumsum(self.home_count, axis=1)
+        # Sum of the slots in which h plays home against a
+        self.home_slot_sum = self.home @ np.arange(n_slots, dtype=np.int64)
+
+
+def validate_constraint_tensor(problem: TwoRRProblem, tensors: ScheduleTensors, twoRRConstraint: TwoRRConstraint):
+    # Same as validate_constraint, but evaluates the constraint
+    # as reductions over the arrays of a ScheduleTensors instead
+    # of scanning the solution. It returns exactly the same
+    # (violated, diff, penalty) tuples.
+
+    c_name = twoRRConstraint.name
+    constraint = twoRRConstraint
+
+    n_slots = tensors.n_slots
+    home = tensors.home
+
+    def against(teams1, teams2, slots, away=False):
+        # Number of games that each team in teams1 plays home (or away)
+        # against the teams in teams2 in each slot, ignoring the
+        # pairs of identical teams. The result is indexed by
+        # [teams1 index, slots index].
+        if away:
+            games = home[np.ix_(teams2, teams1, slots)].transpose(1, 0, 2)
+        else:
+            games = home[np.ix_(teams1, teams2, slots)]
+        same = teams1[:, None] == teams2[None, :]
+        return np.where(same[:, :, None], 0, games).sum(axis=1)
+
+    def windows(counts, intp):
+        # Sums of counts over all the windows of intp consecutive slots
+        cumsum = np.concatenate([np.zeros((counts.shape[0], 1), dtype=np.int64),
+                                 np.cumsum(counts, axis=1)], axis=1)
+        return cumsum[:, intp:] - cumsum[:, :-intp]
+
+    def excess(values, bound):
+        return int(np.maximum(values - bound, 0).sum())
+
+    diff = 0
+
+    # Capacity constraints:
+    if c_name == "CA1":
+        slots = constraint.array("slots")
+        teams = constraint.array("teams")
+        c_min = constraint.min
+        c_max = constraint.max
+        penalty = constraint.penalty
+        if (c_min > 0):
+            raise Exception("Min value in CA1 not implemented!")
+        if constraint.mode == Mode.A:
+            diff += excess(tensors.plays_away[np.ix_(teams, slots)].sum(axis=1), c_max)
+        elif constraint.mode == Mode.H:
+            diff += excess(tensors.plays_home[np.ix_(teams, slots)].sum(axis=1), c_max)
+        else:
+            raise Exception("Mode HA for CA1 not implemented!")
+
+        return (diff > 0, diff, penalty * diff)
+
+    if c_name == "CA2":
+        slots = constraint.array("slots")
+        teams1 = constraint.array("teams1")
+        teams2 = constraint.array("teams2")
+        c_min = constraint.min
+        c_max = constraint.max
+        penalty = constraint.penalty
+        if (c_min > 0):
+            raise Exception("Min value in CA2 not implemented!")
+        if constraint.mode1 == Mode.A:
+            games = against(teams1, teams2, slots, away=True)
+        elif constraint.mode1 == Mode.H:
+            games = against(teams1, teams2, slots)
+        else:
+            games = against(teams1, teams2, slots, away=True) + against(teams1, teams2, slots)
+        diff += excess(games.sum(axis=1), c_max)
+
+        return (diff > 0, diff, penalty * diff)
+
+    if c_name == "CA3":
+        teams1 = constraint.array("teams1")
+        teams2 = constraint.array("teams2")
+        c_min = constraint.min
+        c_max = constraint.max
+        intp = constraint.intp
+        penalty = constraint.penalty
+        if (c_min > 0):
+            raise Exception("Min value in CA3 not implemented!")
+        all_slots = np.arange(n_slots)
+        if constraint.mode1 == Mode.A:
+            games = against(teams1, teams2, all_slots, away=True)
+        elif constraint.mode1 == Mode.H:
+            games = against(teams1, teams2, all_slots)
+        else:
+            games = against(teams1, teams2, all_slots, away=True) + against(teams1, teams2, all_slots)
+        if 0 < intp <= n_slots:
+            diff += excess(windows(games, intp), c_max)
+
+        return (diff > 0, diff, penalty * diff)
+
+    if c_name == "CA4":
+        slots = constraint.array("slots")
+        teams1 = constraint.array("teams1")
+        teams2 = constraint.array("teams2")
+        c_min = constraint.min
+        c_max = constraint.max
+        penalty = constraint.penalty
+        if (c_min > 0):
+            raise Exception("Min value in CA4 not implemented!")
+        if constraint.mode1 == Mode.A:
+            games = against(teams1, teams2, slots, away=True)
+        elif constraint.mode1 == Mode.H:
+            games = against(teams1, teams2, slots)
+        else:
+            games = against(teams1, teams2, slots, away=True) + against(teams1, teams2, slots)
+        if constraint.mode2 == Mode.GLOBAL:
+            diff += excess(games.sum(), c_max)
+        else:
+            diff += excess(games.sum(axis=0), c_max)
+
+        return (diff > 0, diff, penalty * diff)
+
+    # Game constraints
+    if c_name == "GA1":
+        slots = constraint.array("slots")
+        games = constraint.array("meetings")
+        c_min = constraint.min
+        c_max = constraint.max
+        penalty = constraint.penalty
+        played = 0
+        if len(games) > 0:
+            h_teams, a_teams = games.T
+            played = int(home[h_teams[:, None], a_teams[:, None], slots[None, :]].sum())
+        diff += max(played - c_max, 0)
+        diff += max(c_min - played, 0)
+
+        return (diff > 0, diff, penalty * diff)
+
+    # Break constraints
+    if c_name == "BR1":
+        teams = constraint.array("teams")
+        slots = constraint.array("slots")
+        slots = slots[slots != 0]
+        mode = constraint.mode2
+        intp = constraint.intp
+        penalty = constraint.penalty
+        away_breaks = tensors.away_break[np.ix_(teams, slots)].sum(axis=1)
+        home_breaks = tensors.home_break[np.ix_(teams, slots)].sum(axis=1)
+        if mode == Mode.A:
+            diff += excess(away_breaks, intp)
+            diff += excess(home_breaks, intp)
+        else:
+            diff += excess(home_breaks + away_breaks, intp)
+
+        return (diff > 0, diff, penalty * diff)
+
+    if c_name == "BR2":
+        teams = constraint.array("teams")
+        slots = constraint.array("slots")
+        slots = slots[slots != 0]
+        intp = constraint.intp
+        penalty = constraint.penalty
+        breaks = tensors.home_break[np.ix_(teams, slots)].sum() + tensors.away_break[np.ix_(teams, slots)].sum()
+        diff += excess(breaks, intp)
+
+        return (diff > 0, diff, penalty * diff)
+
+    # Fairness constraints
+    if c_name == "FA2":
+        teams = constraint.array("teams")
+        slots = np.sort(constraint.array("slots"))
+        intp = constraint.intp
+        penalty = constraint.penalty
+        home_games = tensors.home_cumsum[np.ix_(teams, slots)]
+        gaps = np.maximum(np.abs(home_games[:, None, :] - home_games[None, :, :]) - intp, 0)
+        largest = gaps.max(axis=2)
+        same = teams[:, None] == teams[None, :]
+        diff += int(np.where(same, 0, largest).sum())
+
+        return (diff > 0, diff, penalty * diff)
+
+    # Separation constraints
+    if c_name == "SE1":
+        teams = constraint.array("teams")
+        penalty = constraint.penalty
+        c_min = constraint.min
+        slot_sum = tensors.home_slot_sum[np.ix_(teams, teams)]
+        separation = np.abs(slot_sum - slot_sum.T)
+        gaps = np.maximum(c_min + 1 - separation, 0)
+        diff += int(np.triu(gaps, k=1).sum())
+
+        return (diff > 0, diff, penalty * diff)
+
+
+def validate_solution(problem: TwoRRProblem, solution, constraints=None):
+    # Validates a list of constraints (by default all the constraints
+    # of the problem) against a solution with the vectorized validator.
+    # The schedule tensors are built only once for all the constraints.
+    # Returns the list of (violated, diff, penalty) tuples.
+    if constraints is None:
+        constraints = problem.constraints
+    tensors = ScheduleTensors(problem, solution)
+    return [validate_constraint_tensor(problem, tensors, constraint) for constraint in constraints]
@@ -1,10 +1,17 @@
 # from TwoRRProblem import read_instance
 # from TwoRROptimization import solve_naive
-# prob = read_instance("Instances/EarlyInstances/ITC2021_Early_10.xml")
-# solve_naive(prob, skipSoft=True, lazy=0)
+# filename = "Instances/EarlyInstances/ITC2021_Early_10.xml"
+# prob = read_instance(filename)
+# solve_naive(filename, prob, skipSoft=True, lazy=0)
 
+import sys
 from TwoRRProblem import read_instance
 from TwoRRMaster import solve_master
-filename = "Instances/EarlyInstances/ITC2021_Early_2.xml"
-prob = read_instance(filename)
-solve_master(filename, prob, True)
+
+if __name__=="__main__":
+    # Usage: run.py <instance>
+    if len(sys.argv) < 2:
+        sys.exit("Usage: run.py <instance>")
+    filename = sys.argv[1]
+    prob = read_instance(filename)
+    solve_master(filename, prob, True)
@@ -0,0 +1,169 @@
+# Runs the master on a batch of instances, in parallel. Each run
+# is a run_single.py process (with its slave processes) and gets
+# a share of the cores: Gurobi threads plus slave workers. Runs
+# are stopped at the wall-clock limit, and the best objective and
+# timings of each run are collected in a summary table.
+#
+# Usage: python run_batch.py "Instances/TestInstances/*.xml" --time-limit 600
+
+import os, sys, time
+import re
+import csv
+import glob
+import signal
+import threading
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+LOG_DIR = "Logs"
+# The instance files of a directory
+INSTANCE_PATTERN = "ITC2021_*.xml"
+
+# The lines of a run with a new best objective: the master, the naive
+# model (in run_benchmark.py) and the portfolio
+NEW_BEST = re.compile(r"(?:New best solution:|Portfolio: new best solution) (\d+)")
+
+def instance_files(patterns):
+    # The instance files matching the paths or glob patterns, in order,
+    # without duplicates. For a directory, its ITC2021 instances (not
+    # e.g. TestInstanceDemo.xml, which is in another format).
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, INSTANCE_PATTERN)
+        for filename in sorted(glob.glob(pattern)) or [pattern]:
+            if filename not in files:
+                files.append(filename)
+    return files
+
+def core_split(cores, jobs, threads):
+    # Gurobi threads and slave workers of each run, from the cores
+    # of a run. With slave_workers = 0 the master runs a single
+    # slave at a time (see solve_master).
+    per_run = max(1, cores // jobs)
+    threads = max(1, min(threads, per_run))
+    slave_workers = per_run - threads
+    return threads, slave_workers if slave_workers > 1 else 0
+
+def run_process(command, log_filename, time_limit=None, env=None, on_line=None, grace=10):
+    # Runs the command in its own process group, so that the processes
+    # it starts (e.g. the slaves) are stopped with it: at the time limit
+    # the group gets SIGTERM, then SIGKILL if it is still running after
+    # grace seconds. The output is written to log_filename and each line
+    # is passed to on_line(line, elapsed). Returns a dict with the status
+    # ("done", "time limit" or "error <code>"), the exit code, the wall
+    # time and the resource usage of the process (and of the processes
+    # it waited for), e.g. the peak RSS.
+    result = {"status": "done", "returncode": None, "wall": None, "usage": None}
+    finished = threading.Event()
+    start = time.time()
+    with open(log_filename, "w") as log, \
+         subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                          start_new_session=True, env=env) as process:
+        timer = None
+        if time_limit is not None:
+            timer = threading.Timer(time_limit, stop_process, (process, result, finished, grace))
+            timer.daemon = True
+            timer.start()
+        for line in process.stdout:
+            log.write(line)
+            if on_line is not None:
+                on_line(line, time.time() - start)
+        # wait4 instead of wait, for the resource usage
+        _, status, result["usage"] = os.wait4(process.pid, 0)
+        process.returncode = result["returncode"] = os.waitstatus_to_exitcode(status)
+        finished.set()
+        if timer is not None:
+            timer.cancel()
+    result["wall"] = time.time() - start
+    if process.returncode != 0 and result["status"] == "done":
+        result["status"] = f"error {process.returncode}"
+    return result
+
+def stop_process(process, result, finished, grace=10):
+    # Stops the run at the time limit: SIGTERM to the process
+    # group, then SIGKILL if it has not finished after grace seconds
+    result["status"] = "time limit"
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        if not finished.wait(grace):
+            os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def new_best(line):
+    # The objective of a line of a run with a new best objective,
+    # None for the other lines. The line can start with the output of
+    # another process of the run (e.g. the strategies of a portfolio).
+    match = NEW_BEST.search(line)
+    return int(match.group(1)) if match else None
+
+def run_instance(filename, time_limit, slave_workers, threads, env=None, log_filename=None, args=()):
+    # Runs the master on the instance in its own process group, so
+    # that the slaves are stopped with it. Returns a row of the summary.
+    # env is the environment of the process (default: inherited), args
+    # the extra arguments of run_single.py.
+    if log_filename is None:
+        log_filename = os.path.join(LOG_DIR, os.path.basename(filename) + ".out")
+    row = {"instance": os.path.basename(filename), "status": "done", "best": None,
+           "first": None, "time_best": None, "n_best": 0, "wall": None, "log": log_filename}
+    def on_line(line, elapsed):
+        best = new_best(line)
+        if best is not None:
+            row["best"] = best
+            row["time_best"] = round(elapsed, 1)
+            row["n_best"] += 1
+            if row["first"] is None:
+                row["first"] = round(elapsed, 1)
+    result = run_process([sys.executable, "-u", "run_single.py", filename, str(slave_workers), str(threads)] + list(args),
+                         log_filename, time_limit, env, on_line)
+    row["status"] = result["status"]
+    row["wall"] = round(result["wall"], 1)
+    return row
+
+def print_summary(rows):
+    columns = ["instance", "status", "best", "first", "time_best", "n_best", "wall"]
+    widths = [max([len(column)] + [len(str(row[column])) for row in rows]) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+def write_summary(file_name, rows):
+    with open(file_name, "w", newline="") as myfile:
+        writer = csv.DictWriter(myfile, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Runs the master on a batch of instances in parallel.")
+    parser.add_argument("instances", nargs="+", help="instance files, directories or glob patterns")
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="total cores for all the runs")
+    parser.add_argument("--jobs", type=int, default=None, help="concurrent runs (default: cores / 2)")
+    parser.add_argument("--threads", type=int, default=1, help="Gurobi threads of each run")
+    parser.add_argument("--time-limit", type=float, default=None, help="wall-clock limit of each run, in seconds")
+    parser.add_argument("--summary", default=None, help="CSV file for the summary (default: Logs/batch_<time>.csv)")
+    args = parser.parse_args()
+
+    files = instance_files(args.instances)
+    if len(files) == 0:
+        sys.exit("No instances found")
+    jobs = args.jobs or max(1, args.cores // 2)
+    jobs = min(jobs, len(files))
+    threads, slave_workers = core_split(args.cores, jobs, args.threads)
+    print(f"{len(files)} instances, {jobs} concurrent runs, {threads} Gurobi threads and "
+          f"{slave_workers or 1} slave processes each")
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_instance, filename, args.time_limit, slave_workers, threads) for filename in files]
+        rows = []
+        for future in futures:
+            row = future.result()
+            print(f"{row['instance']}: {row['status']}, best {row['best']} in {row['wall']}s")
+            rows.append(row)
+
+    print_summary(rows)
+    summary = args.summary or os.path.join(LOG_DIR, time.strftime("batch_%Y%m%d_%H%M%S.csv"))
+    write_summary(summary, rows)
+    print(f"Summary written to {summary}")
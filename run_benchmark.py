@@ -0,0 +1,235 @@
+# Benchmark of a solution strategy over the ITC2021 instance sets.
+# Each instance is solved in its own process, one at a time, with
+# a fixed Gurobi seed (through TWORR_PARAMS, see TwoRRProfiles), one
+# thread, a wall-clock limit and empty caches (a fresh TWORR_CACHE, so
+# that neither the parsed instance nor the slave outcomes of an earlier
+# run are reused). For each run the benchmark records
+# the build time (until the optimization starts), the time to the
+# first feasible schedule, the time to the target objective, the
+# final objective and the peak RSS of the run.
+#
+# The results are written as JSON, and can be stored as a baseline.
+# With --baseline the results are compared with the baseline, and
+# the regressions are reported (exit status 1 if there are any).
+#
+# Usage: python run_benchmark.py --strategy master --sets Test Early --time-limit 600 [--save-baseline]
+#        python run_benchmark.py --baseline Benchmarks/baseline_master.json
+#        python run_benchmark.py --diff Logs/benchmark_master_<time>.json --baseline Benchmarks/baseline_master.json
+
+import os, sys, time
+import json
+import platform
+import argparse
+import tempfile
+from run_batch import instance_files, run_process, new_best, LOG_DIR
+from TwoRRProblem import CACHE_ENV
+from TwoRRProfiles import PARAMETERS_ENV
+
+STRATEGIES = ["master", "naive", "naive_matrix", "portfolio"]
+INSTANCE_SETS = ["Test", "Early", "Middle", "Late"]
+INSTANCES_DIR = "Instances"
+BASELINE_DIR = "Benchmarks"
+
+# Must be increased whenever the format of the results changes
+BENCHMARK_VERSION = 1
+
+SOLVING = "Solving..."
+
+# Regressions: a time or the peak RSS is worse than the baseline by
+# more than the relative tolerance and the absolute one (seconds, MB)
+TIME_TOLERANCE = (0.2, 1.0)
+MEMORY_TOLERANCE = (0.2, 50)
+
+class BenchmarkIncumbents():
+    # Stands for the exchange of a portfolio (see TwoRRPortfolio) in
+    # solve_naive, which then reports each new feasible schedule
+    def __init__(self):
+        self.best = None
+
+    def publish(self, objective, solution):
+        if self.best is None or objective < self.best:
+            self.best = objective
+            print(f"New best solution: {objective}")
+
+    def poll(self):
+        return []
+
+def run_child(strategy, filename, time_limit):
+    # Solves the instance with the strategy, in the process of the run
+    from TwoRRProblem import read_instance
+    prob = read_instance(filename)
+    if strategy == "master":
+        from TwoRRMaster import solve_master, MasterOptions
+        solve_master(filename, prob, True, options=MasterOptions(telemetry=False, checkpoint=False))
+    elif strategy in ("naive", "naive_matrix"):
+        from TwoRROptimization import solve_naive
+        solve_naive(filename, prob, matrix=strategy == "naive_matrix", incumbents=BenchmarkIncumbents())
+    else:
+        from TwoRRPortfolio import solve_portfolio
+        solve_portfolio(filename, time_limit, debug=True)
+
+def instance_set_files(sets):
+    return instance_files([os.path.join(INSTANCES_DIR, f"{name}Instances") for name in sets])
+
+def run_instance(strategy, filename, time_limit, seed, target=None, log_filename=None):
+    # Runs the strategy on the instance in its own process group, with
+    # empty caches, and stops it at the time limit (SIGTERM, then
+    # SIGKILL). Returns the result of the run.
+    if log_filename is None:
+        log_filename = os.path.join(LOG_DIR, f"benchmark_{strategy}_{os.path.basename(filename)}.out")
+    env = dict(os.environ)
+    env[PARAMETERS_ENV] = json.dumps({solver: {"Seed": seed, "Threads": 1} for solver in ["master", "slave", "naive"]})
+    result = {"instance": os.path.basename(filename), "status": "done", "build": None, "time_first": None,
+              "target": target, "time_target": None, "objective": None, "peak_rss_mb": None, "wall": None}
+    # The portfolio stops itself at the time limit
+    limit = time_limit + 30 if strategy == "portfolio" else time_limit
+    def on_line(line, elapsed):
+        elapsed = round(elapsed, 2)
+        if result["build"] is None and line.strip() == SOLVING:
+            result["build"] = elapsed
+        objective = new_best(line)
+        if objective is not None:
+            if result["objective"] is None or objective < result["objective"]:
+                result["objective"] = objective
+            if result["time_first"] is None:
+                result["time_first"] = elapsed
+            if target is not None and result["time_target"] is None and objective <= target:
+                result["time_target"] = elapsed
+    with tempfile.TemporaryDirectory(prefix="benchmark_cache_") as cache_dir:
+        run = run_process([sys.executable, "-u", __file__, "--child", strategy, filename, "--time-limit", str(time_limit)],
+                          log_filename, limit, {**env, CACHE_ENV: cache_dir}, on_line)
+    result["status"] = run["status"]
+    result["wall"] = round(run["wall"], 2)
+    result["peak_rss_mb"] = round(run["usage"].ru_maxrss / 1024, 1)
+    return result
+
+def run_benchmark(strategy, files, time_limit, seed=0, targets=None):
+    # The results of the strategy on the instances, with the metadata
+    # of the benchmark. targets maps instance files (base names) to
+    # their target objective.
+    import gurobipy as gp
+    targets = targets or dict()
+    os.makedirs(LOG_DIR, exist_ok=True)
+    results = []
+    for filename in files:
+        result = run_instance(strategy, filename, time_limit, seed, targets.get(os.path.basename(filename)))
+        print(f"{result['instance']}: {result['status']}, objective {result['objective']}, "
+              f"build {result['build']}s, first {result['time_first']}s, target {result['time_target']}s, "
+              f"{result['peak_rss_mb']} MB")
+        results.append(result)
+    return {"version": BENCHMARK_VERSION, "strategy": strategy, "time_limit": time_limit, "seed": seed,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"), "host": platform.node(), "python": platform.python_version(),
+            "gurobi": ".".join(str(v) for v in gp.gurobi.version()), "results": results}
+
+def read_benchmark(file_name):
+    with open(file_name) as myfile:
+        benchmark = json.load(myfile)
+    if benchmark.get("version") != BENCHMARK_VERSION:
+        raise Exception(f"Benchmark {file_name} has version {benchmark.get('version')}, expected {BENCHMARK_VERSION}")
+    return benchmark
+
+def write_benchmark(benchmark, file_name):
+    os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+    with open(file_name, "w") as myfile:
+        json.dump(benchmark, myfile, indent=2)
+        myfile.write("\n")
+
+def baseline_targets(baseline):
+    # The final objectives of the baseline, as targets
+    return {result["instance"]: result["objective"] for result in baseline["results"] if result["objective"] is not None}
+
+def worse(new, old, tolerance):
+    # True if new is worse (larger) than old by more than the tolerance
+    relative, absolute = tolerance
+    return new - old > max(relative * old, absolute)
+
+def compare(benchmark, baseline):
+    # The regressions of the benchmark with respect to the baseline,
+    # as a list of (instance, message)
+    regressions = []
+    if benchmark["strategy"] != baseline["strategy"] or benchmark["time_limit"] != baseline["time_limit"]:
+        regressions.append(("*", f"different setup: {benchmark['strategy']} {benchmark['time_limit']}s, "
+                                 f"baseline {baseline['strategy']} {baseline['time_limit']}s"))
+    old_results = {result["instance"]: result for result in baseline["results"]}
+    for new in benchmark["results"]:
+        old = old_results.get(new["instance"])
+        if old is None:
+            continue
+        name = new["instance"]
+        if old["objective"] is not None:
+            if new["objective"] is None:
+                regressions.append((name, f"no feasible schedule (baseline {old['objective']})"))
+            elif new["objective"] > old["objective"]:
+                regressions.append((name, f"objective {new['objective']} (baseline {old['objective']})"))
+        for key in ["build", "time_first", "time_target"]:
+            if old[key] is None:
+                continue
+            if new[key] is None:
+                if key != "time_target" or new["target"] == old["target"]:
+                    regressions.append((name, f"{key} not reached (baseline {old[key]}s)"))
+            elif worse(new[key], old[key], TIME_TOLERANCE):
+                regressions.append((name, f"{key} {new[key]}s (baseline {old[key]}s)"))
+        if old["peak_rss_mb"] is not None and new["peak_rss_mb"] is not None and \
+           worse(new["peak_rss_mb"], old["peak_rss_mb"], MEMORY_TOLERANCE):
+            regressions.append((name, f"peak RSS {new['peak_rss_mb']} MB (baseline {old['peak_rss_mb']} MB)"))
+    return regressions
+
+def print_results(benchmark):
+    columns = ["instance", "status", "objective", "build", "time_first", "time_target", "peak_rss_mb", "wall"]
+    rows = benchmark["results"]
+    widths = [max([len(column)] + [len(str(row[column])) for row in rows]) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks a strategy over the ITC2021 instance sets.")
+    parser.add_argument("instances", nargs="*", help="instance files, directories or glob patterns (default: --sets)")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="master")
+    parser.add_argument("--sets", nargs="+", choices=INSTANCE_SETS, default=INSTANCE_SETS)
+    parser.add_argument("--time-limit", type=float, default=600, help="wall-clock limit of each run, in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Gurobi seed")
+    parser.add_argument("--targets", default=None, help="JSON file of the target objective of each instance "
+                                                        "(default: the objectives of the baseline)")
+    parser.add_argument("--output", default=None, help="results file (default: Logs/benchmark_<strategy>_<time>.json)")
+    parser.add_argument("--baseline", default=None, help="baseline to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline of the strategy")
+    parser.add_argument("--diff", default=None, help="compare a results file with the baseline, without running")
+    parser.add_argument("--child", nargs=2, metavar=("STRATEGY", "INSTANCE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.child[0], args.child[1], args.time_limit)
+        sys.exit(0)
+
+    baseline = read_benchmark(args.baseline) if args.baseline else None
+    if args.diff is not None:
+        if baseline is None:
+            sys.exit("--diff needs a --baseline")
+        benchmark = read_benchmark(args.diff)
+    else:
+        files = instance_files(args.instances) if args.instances else instance_set_files(args.sets)
+        if len(files) == 0:
+            sys.exit("No instances found")
+        targets = baseline_targets(baseline) if baseline is not None else None
+        if args.targets is not None:
+            with open(args.targets) as myfile:
+                targets = json.load(myfile)
+        print(f"Benchmark of {args.strategy} on {len(files)} instances, {args.time_limit}s each, seed {args.seed}")
+        benchmark = run_benchmark(args.strategy, files, args.time_limit, args.seed, targets)
+        output = args.output or os.path.join(LOG_DIR, time.strftime(f"benchmark_{args.strategy}_%Y%m%d_%H%M%S.json"))
+        write_benchmark(benchmark, output)
+        print_results(benchmark)
+        print(f"Results written to {output}")
+        if args.save_baseline:
+            baseline_file = os.path.join(BASELINE_DIR, f"baseline_{args.strategy}.json")
+            write_benchmark(benchmark, baseline_file)
+            print(f"Baseline written to {baseline_file}")
+
+    if baseline is not None:
+        regressions = compare(benchmark, baseline)
+        for instance, message in regressions:
+            print(f"Regression: {instance}: {message}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
@@ -1,5 +1,3 @@
 #!/bin/bash
-for f in "Instances/TestInstances/*"
-do
-    echo python run_single.py $f > Logs/$f.out &
-done
\ No newline at end of file
+# See run_batch.py for the options (cores, time limit, summary file)
+python run_batch.py "Instances/TestInstances/ITC*.xml" "$@"
@@ -0,0 +1,12 @@
+import sys
+from TwoRRPortfolio import solve_portfolio
+
+if __name__=="__main__":
+    # Usage: run_portfolio.py <instance> [time_limit]
+    filename = sys.argv[1]
+    time_limit = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    objective, solution, strategy, optimal = solve_portfolio(filename, time_limit, debug=True)
+    if objective is None:
+        print("No feasible solution found")
+    else:
+        print(f"Best solution: {objective} from {strategy}" + (" (optimal)" if optimal else ""))
@@ -1,8 +1,17 @@
-import sys
+import argparse
 from TwoRRProblem import read_instance
-from TwoRRMaster import solve_master
+from TwoRRMaster import solve_master, MasterOptions
 
 if __name__=="__main__":
-    filename = sys.argv[1]
-    prob = read_instance(filename)
-    solve_master(filename, prob, True)
+    # Usage: run_single.py <instance> [slave_workers] [threads] [--resume] [--no-checkpoint]
+    parser = argparse.ArgumentParser(description="Solves an instance with the master.")
+    parser.add_argument("instance")
+    parser.add_argument("slave_workers", type=int, nargs="?", default=0)
+    parser.add_argument("threads", type=int, nargs="?", default=1)
+    parser.add_argument("--resume", action="store_true", help="resume from the last checkpoint of the instance")
+    parser.add_argument("--no-checkpoint", action="store_true", help="do not write checkpoints")
+    args = parser.parse_args()
+    prob = read_instance(args.instance)
+    options = MasterOptions(slave_workers=args.slave_workers, threads=args.threads,
+                            checkpoint=not args.no_checkpoint, resume=args.resume)
+    solve_master(args.instance, prob, True, options=options)
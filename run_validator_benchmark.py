@@ -0,0 +1,188 @@
+# Micro-benchmark and equivalence harness of the validator. The
+# schedules are random valid double round robins of each instance
+# (circle method, with random teams, rounds and home/away, phased
+# if the instance is) and the schedules of the instance in Output/.
+# Every alternative implementation in IMPLEMENTATIONS must agree
+# exactly with validate_constraint, the reference, on every schedule
+# and constraint; the penalties of DeltaEvaluator are also checked.
+# The throughput of each implementation is reported for each
+# constraint type, in schedules per second.
+#
+# The reference takes about a second per schedule on the larger
+# instances: the benchmark uses 10 random schedules per instance by
+# default, about 15 minutes on all the sets. With --check only the
+# equivalence is checked, on 50 random schedules per instance by
+# default (thousands over all the sets), with the instances spread
+# over --jobs processes.
+#
+# Usage: python run_validator_benchmark.py [instances...] [--schedules 10] [--seed 0]
+#        python run_validator_benchmark.py --check [--jobs 8]
+
+import os, sys, time
+import glob
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from TwoRRProblem import read_instance, read_solution
+from TwoRRValidator import validate_constraint, validate_constraint_tensor, ScheduleTensors
+from TwoRREvaluator import DeltaEvaluator
+from run_batch import instance_files
+from run_benchmark import instance_set_files, INSTANCE_SETS
+
+CONSTRAINT_TYPES = ["CA1", "CA2", "CA3", "CA4", "GA1", "BR1", "BR2", "FA2", "SE1"]
+
+# Random schedules per instance, for the benchmark and for --check
+BENCHMARK_SCHEDULES = 10
+CHECK_SCHEDULES = 50
+
+# Implementations of the validator: name -> (prepare, validate), where
+# prepare(problem, solution) builds the input of validate(problem, input,
+# constraint) once per schedule. The first one is the reference.
+IMPLEMENTATIONS = {
+    "reference": (lambda problem, solution: solution, validate_constraint),
+    "tensor": (ScheduleTensors, validate_constraint_tensor),
+}
+
+def circle_schedule(n_teams, rng, phased=False):
+    # A random valid double round robin: the single round robin of
+    # the circle method on a random order of the teams, with random
+    # home and away, followed by its mirror with the homes swapped,
+    # and the rounds shuffled (within each half if phased)
+    teams = list(range(n_teams))
+    rng.shuffle(teams)
+    rounds = []
+    for r in range(n_teams - 1):
+        circle = [teams[-1]] + [teams[(r + i) % (n_teams - 1)] for i in range(n_teams - 1)]
+        games = []
+        for i in range(n_teams // 2):
+            game = (circle[i], circle[n_teams - 1 - i])
+            games.append(game if rng.random() < 0.5 else game[::-1])
+        rounds.append(games)
+    mirror = [[(a, h) for h, a in games] for games in rounds]
+    if phased:
+        rng.shuffle(rounds)
+        rng.shuffle(mirror)
+        return rounds + mirror
+    schedule = rounds + mirror
+    rng.shuffle(schedule)
+    return schedule
+
+def output_schedules(filename, directory="Output"):
+    # The schedules of the instance in Output/, as (name, solution)
+    names = glob.glob(os.path.join(directory, f"{glob.escape(os.path.basename(filename))}_solution_*.xml"))
+    return [(os.path.basename(name), read_solution(name)) for name in sorted(names)]
+
+def instance_schedules(filename, prob, n_random, rng, directory="Output"):
+    schedules = output_schedules(filename, directory)
+    phased = prob.game_mode == "P"
+    schedules += [(f"random {i}", circle_schedule(len(prob.teams), rng, phased)) for i in range(n_random)]
+    return schedules
+
+def check_schedule(prob, solution, results):
+    # The mismatches of a schedule, as a list of messages: results is
+    # {implementation: [(violated, diff, penalty) for each constraint]}
+    mismatches = []
+    reference = results["reference"]
+    for name, values in results.items():
+        for constraint, expected, value in zip(prob.constraints, reference, values):
+            if tuple(value) != tuple(expected):
+                mismatches.append(f"{name} {constraint.name}: {value}, reference {expected}")
+    hard = sum(penalty for constraint, (_, _, penalty) in zip(prob.constraints, reference) if constraint.hard)
+    soft = sum(penalty for constraint, (_, _, penalty) in zip(prob.constraints, reference) if not constraint.hard)
+    evaluator = DeltaEvaluator(prob, solution)
+    if (evaluator.hard_penalty, evaluator.soft_penalty) != (hard, soft):
+        mismatches.append(f"evaluator: hard {evaluator.hard_penalty}, soft {evaluator.soft_penalty}, "
+                          f"reference hard {hard}, soft {soft}")
+    return mismatches
+
+def run_instance(filename, n_random, rng, timings, directory="Output"):
+    # Validates the schedules of the instance with each implementation,
+    # adding the time per constraint type to timings[implementation][type]
+    # (the time of prepare goes to the type "prepare"). Returns the
+    # number of schedules and the list of mismatches.
+    prob = read_instance(filename)
+    schedules = instance_schedules(filename, prob, n_random, rng, directory)
+    mismatches = []
+    for schedule_name, solution in schedules:
+        results = dict()
+        for name, (prepare, validate) in IMPLEMENTATIONS.items():
+            timing = timings.setdefault(name, dict())
+            start = time.perf_counter()
+            data = prepare(prob, solution)
+            timing["prepare"] = timing.get("prepare", 0) + time.perf_counter() - start
+            values = []
+            for constraint in prob.constraints:
+                start = time.perf_counter()
+                values.append(validate(prob, data, constraint))
+                timing[constraint.name] = timing.get(constraint.name, 0) + time.perf_counter() - start
+            results[name] = values
+        for message in check_schedule(prob, solution, results):
+            mismatches.append(f"{os.path.basename(filename)}, {schedule_name}: {message}")
+    return len(schedules), mismatches
+
+def instance_rng(seed, filename):
+    # The random schedules of an instance only depend on the seed and
+    # on the instance, not on the order in which the instances are run
+    return random.Random(f"{seed} {os.path.basename(filename)}")
+
+def check_instance(filename, n_random, seed, directory="Output"):
+    # run_instance without the timings, in a worker process of --check
+    return run_instance(filename, n_random, instance_rng(seed, filename), dict(), directory)
+
+def print_throughput(timings, n_schedules):
+    # Schedules per second of each implementation for each constraint
+    # type (all the constraints of the type of each instance), and in
+    # total (prepare included)
+    names = list(timings.keys())
+    types = [t for t in CONSTRAINT_TYPES if any(t in timings[name] for name in names)]
+    print(f"Throughput on {n_schedules} schedules (schedules per second):")
+    print(f"{'type':<10}" + "".join(f"{name:>14}" for name in names))
+    for constraint_type in types + ["prepare", "total"]:
+        row = f"{constraint_type:<10}"
+        for name in names:
+            elapsed = sum(timings[name].values()) if constraint_type == "total" else timings[name].get(constraint_type, 0)
+            row += f"{n_schedules / elapsed:>14.1f}" if elapsed > 0 else f"{'-':>14}"
+        print(row)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the validator and checks its implementations against the reference.")
+    parser.add_argument("instances", nargs="*", help="instance files, directories or glob patterns (default: --sets)")
+    parser.add_argument("--sets", nargs="+", choices=INSTANCE_SETS, default=INSTANCE_SETS)
+    parser.add_argument("--schedules", type=int, default=None,
+                        help=f"random schedules per instance (default: {BENCHMARK_SCHEDULES}, {CHECK_SCHEDULES} with --check)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default="Output", help="directory of the schedules of the instances")
+    parser.add_argument("--check", action="store_true", help="only check the equivalence, without the throughput")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes of --check")
+    args = parser.parse_args()
+
+    files = instance_files(args.instances) if args.instances else instance_set_files(args.sets)
+    if len(files) == 0:
+        sys.exit("No instances found")
+    n_random = args.schedules
+    if n_random is None:
+        n_random = CHECK_SCHEDULES if args.check else BENCHMARK_SCHEDULES
+    timings = dict()
+    n_schedules = 0
+    mismatches = []
+    pool = ProcessPoolExecutor(max_workers=args.jobs) if args.check else None
+    if pool is not None:
+        futures = [pool.submit(check_instance, filename, n_random, args.seed, args.output_dir) for filename in files]
+        results = (future.result() for future in futures)
+    else:
+        results = (run_instance(filename, n_random, instance_rng(args.seed, filename), timings, args.output_dir)
+                   for filename in files)
+    for filename, (n, instance_mismatches) in zip(files, results):
+        n_schedules += n
+        mismatches += instance_mismatches
+        print(f"{os.path.basename(filename)}: {n} schedules, {len(instance_mismatches)} mismatches")
+    if pool is not None:
+        pool.shutdown()
+
+    if not args.check:
+        print_throughput(timings, n_schedules)
+    for message in mismatches[:20]:
+        print(f"Mismatch: {message}")
+    if mismatches:
+        sys.exit(f"{len(mismatches)} mismatches with the reference")
+    print(f"All implementations agree with the reference on {n_schedules} schedules")
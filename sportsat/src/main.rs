@@ -13,6 +13,8 @@ use satcoder::symbolic::*;
 use satcoder::*;
 use std::iter::{once, empty};
 use std::hash::Hash;
+use std::rc::Rc;
+use std::cell::RefCell;
 
 //mod problem;
 ////mod construct;
@@ -91,6 +93,32 @@ impl<L:Lit> Soft<L> {
             _ => panic!(),
         }
     }
+
+    /// Copy of a soft constraint for the next home-away pattern in server mode.
+    /// The optimization relaxes the soft constraints in place, but the encodings
+    /// (totalizers, counters, separation variables) only define new variables,
+    /// so the copies share them instead of adding them to the solver again.
+    pub fn reuse(&self) -> Self {
+        match self {
+            Soft::Relaxable(cost, lit, relax) =>
+                Soft::Relaxable(*cost, *lit, relax.as_ref().map(|(c, r)| (*c, r.reuse()))),
+            Soft::Constructable(cost, relax) => Soft::Constructable(*cost, relax.reuse()),
+            Soft::Undef => panic!(),
+        }
+    }
+}
+
+/// An encoding shared by the copies of a soft constraint (see `Soft::reuse`),
+/// with the highest bound encoded so far.
+pub struct Shared<T> {
+    pub encoding :T,
+    pub bound :u32,
+}
+
+impl<T> Shared<T> {
+    pub fn new(encoding :T, bound :u32) -> Rc<RefCell<Self>> {
+        Rc::new(RefCell::new(Shared { encoding, bound }))
+    }
 }
 
 pub enum Relax<L:Lit> {
@@ -113,9 +141,9 @@ pub enum Relax<L:Lit> {
         bound: usize,
     },
 
-    ExtendTotalizer(Totalizer<L>, u32), // A totalizer
+    ExtendTotalizer(Rc<RefCell<Shared<Totalizer<L>>>>, u32), // A totalizer
     ExtendCumDiff { // A max diff constraint and the current bound
-        diff: CumulativeDiff<L>,
+        diff: Rc<RefCell<Shared<CumulativeDiff<L>>>>,
         bound :usize,
     },
 
@@ -127,6 +155,164 @@ pub enum Relax<L:Lit> {
 
 }
 
+impl<L:Lit> Relax<L> {
+    fn reuse(&self) -> Self {
+        match self {
+            Relax::Seq(lits) => Relax::Seq(lits.clone()),
+            Relax::NewCumDiff { lits, bound } => Relax::NewCumDiff { lits: lits.clone(), bound: *bound },
+            Relax::NewUnary { lits, truncate, min, max } =>
+                Relax::NewUnary { lits: lits.clone(), truncate: *truncate, min: *min, max: *max },
+            Relax::NewTotalizer { lits, bound } => Relax::NewTotalizer { lits: lits.clone(), bound: *bound },
+            Relax::ExtendTotalizer(tot, bound) => Relax::ExtendTotalizer(tot.clone(), *bound),
+            Relax::ExtendCumDiff { diff, bound } => Relax::ExtendCumDiff { diff: diff.clone(), bound: *bound },
+            Relax::Separation { t1, t2, min } => Relax::Separation { t1: *t1, t2: *t2, min: *min },
+        }
+    }
+}
+
+/// Introduce the representation of a constructable soft constraint: the
+/// relaxable soft constraints that replace it, none if it can no longer be
+/// violated.
+pub fn construct_soft<L:Lit + std::fmt::Debug>(solver :&mut impl SatInstance<L>,
+                                               soft :Soft<L>,
+                                               matched_vars :&HashMap<(SlotId, (TeamId, TeamId)), Bool<L>>,
+                                               slot_ids :&[SlotId]) -> Vec<Soft<L>> {
+    match soft {
+
+        Soft::Constructable(cost, Relax::Seq(mut xs)) => {
+            assert!(xs.len() > 0);
+            let x = xs.remove(0);
+            assert!(x.lit().is_some());
+            let relax = if xs.len() > 0 { Some((cost, Relax::Seq(xs))) } else { None };
+            vec![Soft::Relaxable(cost, x, relax)]
+        },
+
+        // TOTALIZER
+        Soft::Constructable(cost, Relax::NewTotalizer { lits, bound }) => {
+            let tot = Totalizer::count(solver, lits.clone(), bound as u32);
+            if (bound as usize) < tot.rhs().len() {
+                assert!(tot.rhs()[bound].lit().is_some());
+                let lit = !tot.rhs()[bound as usize];
+                vec![Soft::Relaxable(cost, lit, Some((cost, Relax::ExtendTotalizer(Shared::new(tot, bound as u32), bound as u32+1))))]
+            } else {
+                debug!("lits {:?}", lits);
+                debug!("bound {}", bound);
+                panic!("created an unnecessary totalizer?!");
+            }
+
+        },
+        Soft::Constructable(cost, Relax::ExtendTotalizer(tot,bound)) => {
+            let lit = {
+                let mut shared = tot.borrow_mut();
+                if bound > shared.bound {
+                    // Not yet extended by a previous pattern
+                    shared.encoding.increase_bound(solver, bound as u32);
+                    shared.bound = bound;
+                }
+                shared.encoding.rhs().get(bound as usize).copied()
+            };
+            if let Some(lit) = lit {
+                assert!(lit.lit().is_some());
+                vec![Soft::Relaxable(cost, !lit, Some((cost, Relax::ExtendTotalizer(tot, bound as u32+1))))]
+            } else {
+                vec![]
+            }
+        },
+
+        // CUMDIFF
+        Soft::Constructable(cost, Relax::NewCumDiff { lits, bound }) => {
+            let diff = CumulativeDiff::new( solver, lits, bound as u32);
+            assert!(diff.exceeds(bound as u32).lit().is_some());
+            let lit = !diff.exceeds(bound as u32);
+            vec![Soft::Relaxable(cost, lit, Some((cost, Relax::ExtendCumDiff { diff: Shared::new(diff, bound as u32), bound: bound +1 })))]
+        }
+
+        Soft::Constructable(cost, Relax::ExtendCumDiff { diff, bound }) => {
+            let lit = {
+                let mut shared = diff.borrow_mut();
+                if bound as u32 > shared.bound {
+                    // Not yet extended by a previous pattern
+                    shared.encoding.extend(solver, bound as u32);
+                    shared.bound = bound as u32;
+                }
+                assert!(shared.encoding.exceeds(bound as u32).lit().is_some());
+                !shared.encoding.exceeds(bound as u32)
+            };
+            vec![Soft::Relaxable(cost, lit, Some((cost, Relax::ExtendCumDiff { diff, bound: bound +1 })))]
+        },
+
+        Soft::Constructable(penalty, Relax::Separation { t1, t2, min }) => {
+            let separation_lte = (1i64..(min as i64 +1)).map(|n| (n, SatInstance::new_var(solver))).collect::<Vec<_>>();
+            // lt x => lt x+1
+            for ((_,a),(_,b)) in separation_lte.iter().copied().zip(separation_lte.iter().skip(1).copied()) {
+                SatInstance::add_clause(solver, vec![!a, b]);
+            }
+
+            for s1 in slot_ids.iter().copied() {
+                for s2 in slot_ids.iter().copied() {
+
+                    if s2 <= s1 { continue; }
+
+                    let diff = s2 - s1;
+                    if let Some((_,sep_var)) = separation_lte.iter().find(|(n,_)| *n == diff) {
+                        SatInstance::add_clause( solver, vec![ !matched_vars[&(s1, (t1, t2))], !matched_vars[&(s2, (t2, t1))], *sep_var ]);
+                        SatInstance::add_clause( solver, vec![ !matched_vars[&(s1, (t1, t2))], !matched_vars[&(s2, (t1, t2))], *sep_var ]);
+                        SatInstance::add_clause( solver, vec![ !matched_vars[&(s1, (t2, t1))], !matched_vars[&(s2, (t1, t2))], *sep_var ]);
+                        SatInstance::add_clause( solver, vec![ !matched_vars[&(s1, (t2, t1))], !matched_vars[&(s2, (t2, t1))], *sep_var ]);
+                    }
+                }
+            }
+            debug!("SE1 t1={} t2={} min={}", t1,t2,min);
+
+            let mut sep = separation_lte.into_iter().rev().map(|(_n,lit)| !lit).collect::<Vec<_>>();
+            let worst = sep.remove(0);
+            vec![Soft::Relaxable(penalty as _, worst, Some((penalty as _, Relax::Seq(sep))))]
+        },
+
+        // UNARY
+
+        Soft::Constructable(cost, Relax::NewUnary { lits, truncate, min, max }) => {
+            let lits_unary = lits.iter().map(|l| Unary::from_bool(*l)).collect::<Vec<_>>();
+            let sum = if let Some(truncate) = truncate {
+                //panic!("Soft constraint unary should not be trunacted.");
+                Unary::sum_truncate(solver, lits_unary, truncate)
+            } else {
+                Unary::sum(solver, lits_unary)
+            };
+
+            debug!("MIN {:?}", min);
+            debug!("MAX {:?}", max);
+            let min_lits = min.map(|min| (1..=min).rev().map(|n| sum.gte_const(n as isize)).collect::<Vec<_>>());
+            let max_lits = max.map(|max| (max..=(lits.len() as usize)).map(|n| sum.lte_const(n as isize)).collect::<Vec<_>>());
+            debug!("MIN_lits {:?}", min_lits);
+            debug!("MAX_lits {:?}", max_lits);
+
+            let mut relaxable = Vec::new();
+            if let Some(mut min_lits) = min_lits {
+                let min_first = min_lits.remove(0);
+                assert!(min_first.lit().is_some());
+
+                relaxable.push(Soft::Relaxable(
+                    cost,
+                    min_first, 
+                    (min_lits.len() > 0).then(|| (cost, Relax::Seq(min_lits)))));
+            }
+
+            if let Some(mut max_lits) = max_lits {
+                let max_first = max_lits.remove(0);
+                assert!(max_first.lit().is_some());
+
+                relaxable.push(Soft::Relaxable(
+                    cost,
+                    max_first, 
+                    (max_lits.len() > 0).then(|| (cost, Relax::Seq(max_lits)))));
+            }
+            relaxable
+        },
+        _ => { panic!(); },
+    }
+}
+
 use structopt::*;
 #[derive(StructOpt, Debug)]
 struct Opt {
@@ -145,6 +331,7 @@ struct Opt {
     #[structopt(short, long)]
     feasibility_only: bool,
 
+    /// File with the home-away pattern to force, "-" to read it from stdin.
     #[structopt(short, long)]
     pattern_home_away: Option<std::path::PathBuf>,
 
@@ -166,6 +353,27 @@ struct Opt {
     #[structopt(long)]
     quiet: bool,
 
+    /// Encode the instance once, then read home-away patterns from stdin
+    /// (one line per pattern) and solve each of them under assumptions.
+    /// See `serve` for the protocol.
+    #[structopt(long)]
+    server: bool,
+
+    /// Write each schedule to stdout as a single line of match triples,
+    /// "schedule <home> <away> <slot> <home> <away> <slot> ...", instead of
+    /// xml (also in server mode).
+    #[structopt(long)]
+    compact: bool,
+
+}
+
+/// How the solution of the problem (or of one home-away pattern) ended.
+/// The core of an infeasible problem is the indices of the assumptions
+/// in the failed assumptions of the SAT solver: the assumptions of the
+/// core alone are already infeasible.
+pub enum Outcome {
+    Infeasible { core :Vec<usize> },
+    Done { lb :usize, optimal :bool },
 }
 
 fn main() {
@@ -306,7 +514,7 @@ fn main() {
     //    assert_phased(&mut solver, &slot_ids, &team_ids, |s,t1,t2| matched_vars[&(s,(t1,t2))]);
     //}
     
-    let mut soft :Vec<Soft<_>>= encode_constraints(&mut solver, &constraints, &matched_vars, &home_vars,&mut break_vars,
+    let soft :Vec<Soft<_>>= encode_constraints(&mut solver, &constraints, &matched_vars, &home_vars,&mut break_vars,
                                               &team_ids ,&slot_ids, options.br2_heuristic);
 
 
@@ -332,27 +540,17 @@ fn main() {
         return;
     }
 
-    if let Some(path) = options.pattern_home_away {
-        let pattern_str = std::fs::read_to_string(path).unwrap();
-        let teams = pattern_str.lines().collect::<Vec<_>>();
-        assert!(teams.len() == team_ids.len());
-        assert!(teams.iter().all(|s| s.len() == slot_ids.len()));
-
-        for (team_idx, slots) in teams.iter().enumerate() {
-            for (slot_idx, home_char) in slots.chars().enumerate() {
-
-                let home = match home_char {
-                    '1' => true,
-                    '0' => false,
-                    _ => panic!(),
-                };
-
-
-                let var = home_vars[&(slot_idx as SlotId,  team_idx as TeamId)];
-                let l = if home { var } else { !var };
-                //println!("slot {} team {} forced to be {:?}", slot_idx, team_idx, l);
-                SatInstance::add_clause(&mut solver, vec![l]);
-            }
+    if let Some(path) = options.pattern_home_away.as_ref() {
+        let pattern_str = if path.to_str() == Some("-") {
+            let mut pattern_str = String::new();
+            std::io::Read::read_to_string(&mut std::io::stdin(), &mut pattern_str).unwrap();
+            pattern_str
+        } else {
+            std::fs::read_to_string(path).unwrap()
+        };
+        for l in pattern_lits(&pattern_str, &home_vars, &team_ids, &slot_ids).unwrap() {
+            //println!("forced {:?}", l);
+            SatInstance::add_clause(&mut solver, vec![l]);
         }
         info!("Forced home-away pattern.");
 
@@ -366,394 +564,444 @@ fn main() {
     solver.cadical.solve();
     info!("Problem has vars{} clauses{}", solver.cadical.num_variables(), solver.cadical.num_clauses());
 
-    //
-    //
-    // Check feasibility
-    //
-    //
-
+    // Solve the problem under the given assumptions, calling on_solution with
+    // the xml and the matches of each schedule found. With guarded=true the clauses learned from
+    // the cores are guarded by an activation literal, which is retired at the
+    // start of the next call, so that the solver can be reused for other patterns.
+    // In server mode, the soft constraints are encoded once for all the
+    // patterns, and each pattern relaxes its own copy (see `Soft::reuse`)
+    let initial_soft = if options.server {
+        let mut encoded = Vec::new();
+        for s in soft {
+            if let Soft::Relaxable(..) = s { encoded.push(s); }
+            else { encoded.extend(construct_soft(&mut solver, s, &matched_vars, &slot_ids)); }
+        }
+        info!("Encoded soft constraints, vars {} clauses {}", solver.cadical.num_variables(), solver.cadical.num_clauses());
+        encoded
+    } else {
+        soft
+    };
+    let print_schedules = !options.quiet && !options.server;
+    let mut last_activation = None;
+    let mut solve = |assumptions :Vec<Bool<_>>, guarded :bool, on_solution :&mut dyn FnMut(&str, &[(SlotId, TeamId, TeamId)])| -> Outcome {
+        //
+        //
+        // Check feasibility
+        //
+        //
+
+
+        if let Some(a) = last_activation.take() {
+            // Retire the clauses learned for the previous pattern
+            SatInstance::add_clause(&mut solver, vec![!a]);
+        }
+        let activation = if guarded { Some(SatInstance::new_var(&mut solver)) } else { None };
+        let mut soft = initial_soft.iter().map(|s| s.reuse()).collect::<Vec<_>>();
 
-    solver.cadical.set_callbacks(None);
-    if let Some(to) = options.feasibility_timeout {
-        println!("setting timeout {:?}", to);
-        solver.cadical.set_callbacks(Some(satcoder::solvers::cadical::Timeout::new(to)));
-    }
+        solver.cadical.set_callbacks(None);
+        if let Some(to) = options.feasibility_timeout {
+            if !options.server {
+                println!("setting timeout {:?}", to);
+            }
+            solver.cadical.set_callbacks(Some(satcoder::solvers::cadical::Timeout::new(to)));
+        }
 
-    let result = solver.solve_with_assumptions(std::iter::empty());
+        // The activation literal must be assumed, or the solver is free to
+        // falsify it and ignore the clauses it guards
+        let start = Instant::now();
+        let result = solver.solve_with_assumptions(assumptions.iter().copied().chain(activation));
 
 
-    match result {
-        SatResultWithCore::Sat(ref model) => {
-            assert!(verify_schedule( &slot_ids, &team_ids, phased, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))])));
-            let out = format_schedule(&slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))]));
-            if !options.quiet {
-                println!("{}", out);
-            }
+        match result {
+            SatResultWithCore::Sat(ref model) => {
+                assert!(verify_schedule( &slot_ids, &team_ids, phased, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))])));
+                let out = format_schedule(&slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))]));
+                if print_schedules {
+                    println!("{}", out);
+                }
 
-            let out = format_schedule_xml(instance_fn.to_str().unwrap(), &slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))])).unwrap();
-            if !options.quiet {
-                println!("{}", out);
-            }
+                let out = format_schedule_xml(instance_fn.to_str().unwrap(), &slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))])).unwrap();
+                if print_schedules {
+                    println!("{}", out);
+                }
 
-            if let Some(xml_out) = options.xml_solutions.clone() {
-                //eprintln!("Writing feasible solution to {:?}", xml_out);
-                use std::fs::OpenOptions;
-                use std::io::prelude::*;
-                let mut file = OpenOptions::new().create(true).append(true).open(xml_out).unwrap(); 
-                writeln!(file, "{}", out).unwrap();
-            }
+                let matches = schedule_matches(&slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))]));
+                on_solution(&out, &matches);
 
-            info!("Feasible solution found.");
-        },
-        SatResultWithCore::Unsat(_) => { panic!("unsat"); }
-    }
-    drop(result);
-
-    if options.br2_heuristic {
-        // make all break vars
-        for slot in slot_ids.iter().copied() {
-            for team in team_ids.iter().copied() {
-                for is_home in vec![true, false ] {
-                    lazy_break_var(&mut solver, &mut break_vars, &home_vars, slot, team, is_home);
+                info!("Feasible solution found.");
+            },
+            SatResultWithCore::Unsat(ref conflict) => { 
+                last_activation = activation;
+                if options.feasibility_timeout.map(|to| start.elapsed().as_secs_f32() >= to).unwrap_or(false) {
+                    // Stopped by the timeout, nothing is proven
+                    info!("Feasibility timeout reached.");
+                    return Outcome::Done { lb: 0, optimal: false };
                 }
+                let failed = conflict.iter().copied().map(Bool::Lit).collect::<HashSet<_>>();
+                let core = assumptions.iter().enumerate()
+                    .filter(|(_, a)| failed.contains(a))
+                    .map(|(i, _)| i).collect();
+                return Outcome::Infeasible { core }; 
             }
         }
+        drop(result);
+
+        if options.br2_heuristic {
+            // make all break vars
+            for slot in slot_ids.iter().copied() {
+                for team in team_ids.iter().copied() {
+                    for is_home in vec![true, false ] {
+                        lazy_break_var(&mut solver, &mut break_vars, &home_vars, slot, team, is_home);
+                    }
+                }
+            }
 
-        br2_heuristic(&mut solver, &constraints, &break_vars, &team_ids, &slot_ids);
-        return;
-    }
+            br2_heuristic(&mut solver, &constraints, &break_vars, &team_ids, &slot_ids);
+            return Outcome::Done { lb: 0, optimal: false };
+        }
 
-    if options.feasibility_only {
-        info!("feasible solution found. exiting.");
-        return;
-    }
+        if options.feasibility_only {
+            info!("feasible solution found. exiting.");
+            last_activation = activation;
+            return Outcome::Done { lb: 0, optimal: false };
+        }
 
-    //
-    //
-    // Then optimize
-    //
-    //
-    //
-    soft.sort_by_key(|s| -(s.weight() as isize));
-    let weight_groups = soft.iter().group_by(|s| s.weight()).into_iter().map(|(key,g)| (key, g.collect::<Vec<_>>())).collect::<Vec<(usize, Vec<_>)>>();
-    let mut current_lb = 0;
-    let mut max_constraints = 
-        vec![
-            weight_groups.iter().nth(0).map(|(_,v)| v.len()).unwrap_or(soft.len()),
-            soft.len() / 10
-        ].into_iter().max().unwrap();
-    let mut max_constraints = 10;
-    let max_constraints_step = max_constraints;
-
-    //assert!(soft.iter().all(|x| x.lit.is_err()));
+        //
+        //
+        // Then optimize
+        //
+        //
+        //
+        soft.sort_by_key(|s| -(s.weight() as isize));
+        let weight_groups = soft.iter().group_by(|s| s.weight()).into_iter().map(|(key,g)| (key, g.collect::<Vec<_>>())).collect::<Vec<(usize, Vec<_>)>>();
+        let mut current_lb = 0;
+        let mut max_constraints = 
+            vec![
+                weight_groups.iter().nth(0).map(|(_,v)| v.len()).unwrap_or(soft.len()),
+                soft.len() / 10
+            ].into_iter().max().unwrap();
+        let mut max_constraints = 10;
+        let max_constraints_step = max_constraints;
+
+        //assert!(soft.iter().all(|x| x.lit.is_err()));
     
-    let mut remaining_optimization_time = options.total_optimization_timeout.clone();
+        let mut remaining_optimization_time = options.total_optimization_timeout.clone();
+        let mut optimal = false;
 
 
-    'optimize: loop {
+        'optimize: loop {
 
-        info!("Preparing soft constraint assumptions");
+            info!("Preparing soft constraint assumptions");
 
-        soft.sort_by_key(|s| -(s.weight() as isize));
-        let weight_groups = soft.iter().group_by(|s| s.weight()).into_iter().map(|(key,g)| (key, g.collect::<Vec<_>>())).collect::<Vec<(usize, Vec<_>)>>();
-        info!("Weight groups: {:?}", weight_groups.iter().map(|(key,g)| (key,g.len())).collect::<Vec<_>>());
-        let highest_weight = weight_groups.iter().map(|(key,_)| *key).nth(0).unwrap_or(1);
-        drop(weight_groups);
+            soft.sort_by_key(|s| -(s.weight() as isize));
+            let weight_groups = soft.iter().group_by(|s| s.weight()).into_iter().map(|(key,g)| (key, g.collect::<Vec<_>>())).collect::<Vec<(usize, Vec<_>)>>();
+            info!("Weight groups: {:?}", weight_groups.iter().map(|(key,g)| (key,g.len())).collect::<Vec<_>>());
+            let highest_weight = weight_groups.iter().map(|(key,_)| *key).nth(0).unwrap_or(1);
+            drop(weight_groups);
 
 
-        let mut n_assumptions = 0;
-        // Pass over the soft list set and assure that we have representations for
-        // the constraints that we want to apply as assumptions in this iteration.
-        loop {
-            if n_assumptions >= soft.len() { break; }
-            if n_assumptions >= max_constraints { break; }
+            let mut n_assumptions = 0;
+            // Pass over the soft list set and assure that we have representations for
+            // the constraints that we want to apply as assumptions in this iteration.
+            loop {
+                if n_assumptions >= soft.len() { break; }
+                if n_assumptions >= max_constraints { break; }
 
-            let s = &mut soft[n_assumptions];
-            //if s.weight <= highest_weight/2 { break; }
+                let s = &mut soft[n_assumptions];
+                //if s.weight <= highest_weight/2 { break; }
 
-            // Introduce the representation of the soft constraint, if necessary.
+                // Introduce the representation of the soft constraint, if necessary.
 
-            if let Soft::Relaxable(c,_,_) = &soft[n_assumptions] {
-                assert!(*c > 0); n_assumptions += 1; 
-            } else {
-                let old = std::mem::take(&mut soft[n_assumptions]);
-                match old {
-
-                    Soft::Constructable(cost, Relax::Seq(mut xs)) => {
-                        assert!(xs.len() > 0);
-                        let x = xs.remove(0);
-                        assert!(x.lit().is_some());
-                        let relax = if xs.len() > 0 { Some((cost, Relax::Seq(xs))) } else { None };
-                        soft[n_assumptions] = Soft::Relaxable(cost, x, relax);
-                        n_assumptions += 1;
-                    },
+                if let Soft::Relaxable(c,_,_) = &soft[n_assumptions] {
+                    assert!(*c > 0); n_assumptions += 1; 
+                } else {
+                    let old = std::mem::take(&mut soft[n_assumptions]);
+                    let relaxable = construct_soft(&mut solver, old, &matched_vars, &slot_ids);
+                    let n = relaxable.len();
+                    soft.splice(n_assumptions..n_assumptions+1, relaxable);
+                    n_assumptions += n;
+                }
+            }
 
-                    // TOTALIZER
-                    Soft::Constructable(cost, Relax::NewTotalizer { lits, bound }) => {
-                        let tot = Totalizer::count(&mut solver, lits.clone(), bound as u32);
-                        if (bound as usize) < tot.rhs().len() {
-                            assert!(tot.rhs()[bound].lit().is_some());
+            debug!("taking {} from soft#{}", n_assumptions, soft.len());
 
-                            soft[n_assumptions] = Soft::Relaxable(cost, !tot.rhs()[bound as usize], Some((cost, Relax::ExtendTotalizer(tot, bound as u32+1))));
-                            n_assumptions += 1;
-                        } else {
-                            debug!("lits {:?}", lits);
-                            debug!("bound {}", bound);
-                            panic!("created an unnecessary totalizer?!");
-                        }
+            let lit_map : HashMap<_,usize> = soft.iter().enumerate().take(n_assumptions)
+                .map(|(idx,soft)| {
+                    let lit = if let Soft::Relaxable(_cost,lit,_) = soft { *lit } else { panic!() };
+                    (lit, idx)
+                }).collect();
+            //println!("lit map {:?}", lit_map);
 
-                    },
-                    Soft::Constructable(cost, Relax::ExtendTotalizer(mut tot,bound)) => {
-                        tot.increase_bound(&mut solver, bound as u32);
-                        if (bound as usize) < tot.rhs().len() {
-                            assert!(tot.rhs()[bound as usize].lit().is_some());
-                            soft[n_assumptions] = Soft::Relaxable(cost, !tot.rhs()[bound as usize], Some((cost, Relax::ExtendTotalizer(tot, bound as u32+1))));
-                            n_assumptions += 1;
-                        } else {
-                            soft.remove(n_assumptions);
-                        }
-                    },
+            assert!(lit_map.iter().all(|(l,_i)| l.lit().is_some()));
 
-                    // CUMDIFF
-                    Soft::Constructable(cost, Relax::NewCumDiff { lits, bound }) => {
-                        let diff = CumulativeDiff::new( &mut solver, lits, bound as u32);
-                        assert!(diff.exceeds(bound as u32).lit().is_some());
-                        soft[n_assumptions] = Soft::Relaxable(cost, !diff.exceeds(bound as u32), Some((cost, Relax::ExtendCumDiff { diff, bound: bound +1 })));
-                        n_assumptions += 1;
-                    }
+            info!("Prepared {}/{} assumptions with weights from {} to {}", 
+                  lit_map.len(),
+                  soft.len(),
+                  lit_map.iter().map(|(_,idx)| soft[*idx].weight()).min().unwrap_or(0),
+                  lit_map.iter().map(|(_,idx)| soft[*idx].weight()).max().unwrap_or(0));
 
-                    Soft::Constructable(cost, Relax::ExtendCumDiff { mut diff, bound }) => {
-                        diff.extend(&mut solver, bound as u32);
-                        assert!(diff.exceeds(bound as u32).lit().is_some());
-                        //s.lit = Ok((!diff.exceeds(bound as u32), Some(Relax::ExtendCumDiff { diff, bound: bound +1 })));
-                        soft[n_assumptions] = Soft::Relaxable(cost, !diff.exceeds(bound as u32), Some((cost, Relax::ExtendCumDiff { diff, bound: bound +1 })));
-                        n_assumptions += 1;
-                    },
 
-                    Soft::Constructable(penalty, Relax::Separation { t1, t2, min }) => {
-                        let separation_lte = (1i64..(min as i64 +1)).map(|n| (n, SatInstance::new_var(&mut solver))).collect::<Vec<_>>();
-                        // lt x => lt x+1
-                        for ((_,a),(_,b)) in separation_lte.iter().copied().zip(separation_lte.iter().skip(1).copied()) {
-                            SatInstance::add_clause(&mut solver, vec![!a, b]);
-                        }
+            info!("solver {:?}", solver);
+            info!("match vars {}, home vars {}", matched_vars.len(), home_vars.len());
+            info!("Solving with vars{} clauses{}", solver.cadical.num_variables(), solver.cadical.num_clauses());
+            info!("LB: {}", current_lb);
+            info!("Solving...");
 
-                        for s1 in slot_ids.iter().copied() {
-                            for s2 in slot_ids.iter().copied() {
 
-                                if s2 <= s1 { continue; }
+            solver.cadical.set_callbacks(None);
 
-                                let diff = s2 - s1;
-                                if let Some((_,sep_var)) = separation_lte.iter().find(|(n,_)| *n == diff) {
-                                    SatInstance::add_clause( &mut solver, vec![ !matched_vars[&(s1, (t1, t2))], !matched_vars[&(s2, (t2, t1))], *sep_var ]);
-                                    SatInstance::add_clause( &mut solver, vec![ !matched_vars[&(s1, (t1, t2))], !matched_vars[&(s2, (t1, t2))], *sep_var ]);
-                                    SatInstance::add_clause( &mut solver, vec![ !matched_vars[&(s1, (t2, t1))], !matched_vars[&(s2, (t1, t2))], *sep_var ]);
-                                    SatInstance::add_clause( &mut solver, vec![ !matched_vars[&(s1, (t2, t1))], !matched_vars[&(s2, (t2, t1))], *sep_var ]);
-                                }
-                            }
-                        }
-                        debug!("SE1 t1={} t2={} min={}", t1,t2,min);
+            let to = remaining_optimization_time.unwrap_or(f32::INFINITY)
+                .min(options.optimization_solution_timeout.unwrap_or(f32::INFINITY));
 
-                        let mut sep = separation_lte.into_iter().rev().map(|(_n,lit)| !lit).collect::<Vec<_>>();
-                        let worst = sep.remove(0);
-                        soft[n_assumptions] = Soft::Relaxable(penalty as _, worst, Some((penalty as _, Relax::Seq(sep))));
-                        n_assumptions += 1;
-                    },
+            if to.is_finite() {
+                solver.cadical.set_callbacks(Some(satcoder::solvers::cadical::Timeout::new(to)));
+            }
 
-                    // UNARY
+            let start = Instant::now();
+            let result = solver.solve_with_assumptions(lit_map.keys().copied().chain(assumptions.iter().copied()).chain(activation));
+            let duration = start.elapsed();
 
-                    Soft::Constructable(cost, Relax::NewUnary { lits, truncate, min, max }) => {
-                        let lits_unary = lits.iter().map(|l| Unary::from_bool(*l)).collect::<Vec<_>>();
-                        let sum = if let Some(truncate) = truncate {
-                            //panic!("Soft constraint unary should not be trunacted.");
-                            Unary::sum_truncate(&mut solver, lits_unary, truncate)
-                        } else {
-                            Unary::sum(&mut solver, lits_unary)
-                        };
-
-                        debug!("MIN {:?}", min);
-                        debug!("MAX {:?}", max);
-                        let min_lits = min.map(|min| (1..=min).rev().map(|n| sum.gte_const(n as isize)).collect::<Vec<_>>());
-                        let max_lits = max.map(|max| (max..=(lits.len() as usize)).map(|n| sum.lte_const(n as isize)).collect::<Vec<_>>());
-                        debug!("MIN_lits {:?}", min_lits);
-                        debug!("MAX_lits {:?}", max_lits);
-
-                        soft.remove(n_assumptions);
-
-                        if let Some(mut min_lits) = min_lits {
-                            let min_first = min_lits.remove(0);
-                            assert!(min_first.lit().is_some());
-
-                            soft.insert(n_assumptions, Soft::Relaxable(
-                                cost,
-                                min_first, 
-                                (min_lits.len() > 0).then(|| (cost, Relax::Seq(min_lits)))));
-                            n_assumptions += 1;
-                        }
 
-                        if let Some(mut max_lits) = max_lits {
-                            let max_first = max_lits.remove(0);
-                            assert!(max_first.lit().is_some());
-
-                            soft.insert(n_assumptions, Soft::Relaxable(
-                                cost,
-                                max_first, 
-                                (max_lits.len() > 0).then(|| (cost, Relax::Seq(max_lits)))));
-                            //soft.insert(n_assumptions, Soft {
-                            //    weight,
-                            //    lit: Ok((max_first, (max_lits.len() > 0).then(|| Relax::Seq(max_lits))))
-                            //});
-                            n_assumptions += 1;
-                        }
-                    },
-                    _ => { panic!(); },
-                };
+            if let Some(to) = remaining_optimization_time.as_mut() {
+                *to -= duration.as_secs_f32();
+                eprintln!("Found solution. Remaining slave opt. time {:?}", std::time::Duration::from_secs_f32(*to));
             }
-        }
 
-        debug!("taking {} from soft#{}", n_assumptions, soft.len());
+            match result {
+                SatResultWithCore::Sat(model) => {
 
-        let lit_map : HashMap<_,usize> = soft.iter().enumerate().take(n_assumptions)
-            .map(|(idx,soft)| {
-                let lit = if let Soft::Relaxable(_cost,lit,_) = soft { *lit } else { panic!() };
-                (lit, idx)
-            }).collect();
-        //println!("lit map {:?}", lit_map);
+                    info!("model");
 
-        assert!(lit_map.iter().all(|(l,_i)| l.lit().is_some()));
+                    assert!(verify_schedule( &slot_ids, &team_ids, phased, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))])));
+                    let out = format_schedule(&slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))]));
+                    if print_schedules {
+                        println!("{}", out);
+                    }
 
-        info!("Prepared {}/{} assumptions with weights from {} to {}", 
-              lit_map.len(),
-              soft.len(),
-              lit_map.iter().map(|(_,idx)| soft[*idx].weight()).min().unwrap_or(0),
-              lit_map.iter().map(|(_,idx)| soft[*idx].weight()).max().unwrap_or(0));
+                    let out = format_schedule_xml(instance_fn.to_str().unwrap(), &slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))])).unwrap();
+                    if print_schedules {
+                        println!("{}", out);
+                    }
 
+                    let matches = schedule_matches(&slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))]));
+                    on_solution(&out, &matches);
 
-        info!("solver {:?}", solver);
-        info!("match vars {}, home vars {}", matched_vars.len(), home_vars.len());
-        info!("Solving with vars{} clauses{}", solver.cadical.num_variables(), solver.cadical.num_clauses());
-        info!("LB: {}", current_lb);
-        info!("Solving...");
+                    if lit_map.len() < soft.len() {
+                        let old_c = max_constraints;
+                        max_constraints += max_constraints_step;
+                        info!("Increasing number of soft constraints from {} to {}.", old_c, max_constraints);
+                    } else {
+                        info!("All done, optimum found as cost {}!", current_lb);
+                        optimal = true;
+                        break 'optimize;
+                    }
+                },
+                SatResultWithCore::Unsat(ref conflict) => {
+                    // The core may contain the pattern assumptions, which are not soft constraints
+                    let conflict = conflict.iter().copied().filter(|l| lit_map.contains_key(&Bool::Lit(*l))).collect::<Vec<_>>();
+                    if conflict.len() == 0 {
+                        // A schedule was already found: the solver was stopped by the timeout
+                        info!("Optimization stopped.");
+                        break 'optimize;
+                    }
+                    debug!("Conflict set:  {:?}", conflict);
 
+                    let conflict_cost = conflict.iter().map(|lit| {
+                        if let Soft::Relaxable(cost,_,_) = &soft[lit_map[&Bool::Lit(*lit)]] {
+                            *cost
+                        } else { panic!(); }}).min().unwrap();
+                    info!("Conflict cost {}", conflict_cost);
 
-        solver.cadical.set_callbacks(None);
+                    let mut remove_softs = Vec::new();
+                    for l in conflict.iter().copied().map(Bool::Lit) {
+                        let idx = lit_map[&l];
 
-        let to = remaining_optimization_time.unwrap_or(f32::INFINITY)
-            .min(options.optimization_solution_timeout.unwrap_or(f32::INFINITY));
+                        if let Soft::Relaxable(cost, _lit, relax) = &mut soft[idx] {
 
-        if to.is_finite() {
-            solver.cadical.set_callbacks(Some(satcoder::solvers::cadical::Timeout::new(to)));
-        }
+                            assert!(*cost >= conflict_cost);
+                            if *cost > conflict_cost {
+                                *cost -= conflict_cost;
+                            } else {
+                                if let Some((new_cost, relax)) = relax.take() {
+                                    soft[idx] = Soft::Constructable(new_cost, relax);
+                                } else {
+                                    remove_softs.push(idx);
+                                }
+                            }
 
-        let start = Instant::now();
-        let result = solver.solve_with_assumptions(lit_map.keys().copied());
-        let duration = start.elapsed();
+                        } else {
+                            panic!("conflict includes not-yet-constructed constraint");
+                        }
+                    }
 
+                    remove_softs.sort_by_key(|x| -(*x as isize));
+                    for idx in remove_softs { soft.remove(idx); }
 
-        if let Some(to) = remaining_optimization_time.as_mut() {
-            *to -= duration.as_secs_f32();
-            eprintln!("Found solution. Remaining slave opt. time {:?}", std::time::Duration::from_secs_f32(*to));
-        }
+                    let c = if conflict.len() > 1 {
+                        let insert_idx :usize = soft.binary_search_by_key(&conflict_cost, |s|  s.weight())
+                            .or_else::<usize,_>(|idx| Ok(idx)).unwrap();
 
-        match result {
-            SatResultWithCore::Sat(model) => {
+                        soft.insert(insert_idx, Soft::Constructable(conflict_cost,
+                            Relax::NewTotalizer {
+                                lits: conflict.iter().copied().map(|l| Bool::Lit(!l)).collect(),
+                                bound: 1
+                            }));
+                        None
+                    } else {
+                        Some(conflict[0])
+                    };
 
-                info!("model");
 
-                assert!(verify_schedule( &slot_ids, &team_ids, phased, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))])));
-                let out = format_schedule(&slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))]));
-                if !options.quiet {
-                    println!("{}", out);
-                }
 
-                let out = format_schedule_xml(instance_fn.to_str().unwrap(), &slot_ids, &team_ids, |s,t1,t2| model.value(&matched_vars[&(s,(t1,t2))])).unwrap();
-                if !options.quiet {
-                    println!("{}", out);
-                }
+                    drop(result);
+                    if let Some(c) = c { 
+                        // Only valid for the current pattern, if any
+                        let mut clause = vec![!Bool::Lit(c)];
+                        clause.extend(activation.map(|a| !a));
+                        SatInstance::add_clause(&mut solver, clause);
+                    }
 
-                if let Some(xml_out) = options.xml_solutions.clone() {
-                    //eprintln!("Writing feasible solution to {:?}", xml_out);
-                    use std::fs::OpenOptions;
-                    use std::io::prelude::*;
-                    let mut file = OpenOptions::new().create(true).append(true).open(xml_out).unwrap(); 
-                    writeln!(file, "{}", out).unwrap();
-                }
+                    let old_lb = current_lb;
+                    current_lb += conflict_cost;
+                    info!("LB increased from {} to {}", old_lb, current_lb);
+                },
+            };
 
-                if lit_map.len() < soft.len() {
-                    let old_c = max_constraints;
-                    max_constraints += max_constraints_step;
-                    info!("Increasing number of soft constraints from {} to {}.", old_c, max_constraints);
-                } else {
-                    info!("All done, optimum found as cost {}!", current_lb);
-                    break 'optimize;
-                }
-            },
-            SatResultWithCore::Unsat(ref conflict) => {
-                if conflict.len() == 0 {
-                    info!("The problem is infeasible!");
-                    println!("infeasible");
-                    break 'optimize;
-                }
-                debug!("Conflict set:  {:?}", conflict);
+        }
 
-                let conflict_cost = conflict.iter().map(|lit| {
-                    if let Soft::Relaxable(cost,_,_) = &soft[lit_map[&Bool::Lit(*lit)]] {
-                        *cost
-                    } else { panic!(); }}).min().unwrap();
-                info!("Conflict cost {}", conflict_cost);
+        last_activation = activation;
+        Outcome::Done { lb: current_lb, optimal }
+    };
 
-                let mut remove_softs = Vec::new();
-                for l in conflict.iter().copied().map(Bool::Lit) {
-                    let idx = lit_map[&l];
+    if options.server {
+        serve(&mut solve, &home_vars, &team_ids, &slot_ids, options.compact);
+        return;
+    }
 
-                    if let Soft::Relaxable(cost, _lit, relax) = &mut soft[idx] {
+    let xml_solutions = options.xml_solutions.clone();
+    let compact = options.compact;
+    let outcome = solve(Vec::new(), false, &mut |out, matches| {
+        if compact {
+            println!("{}", format_schedule_compact(matches));
+        }
+        if let Some(xml_out) = xml_solutions.as_ref() {
+            //eprintln!("Writing feasible solution to {:?}", xml_out);
+            use std::fs::OpenOptions;
+            use std::io::prelude::*;
+            let mut file = OpenOptions::new().create(true).append(true).open(xml_out).unwrap(); 
+            writeln!(file, "{}", out).unwrap();
+        }
+    });
+    // The outcome, as in server mode (see `serve`), so that the caller can
+    // tell apart an infeasible pattern, a timeout and a crash of the slave
+    match outcome {
+        Outcome::Infeasible { .. } => println!("infeasible"),
+        Outcome::Done { lb, optimal } => println!("done {} {}", lb, if optimal { "optimal" } else { "stopped" }),
+    }
+}
 
-                        assert!(*cost >= conflict_cost);
-                        if *cost > conflict_cost {
-                            *cost -= conflict_cost;
-                        } else {
-                            if let Some((new_cost, relax)) = relax.take() {
-                                soft[idx] = Soft::Constructable(new_cost, relax);
-                            } else {
-                                remove_softs.push(idx);
-                            }
-                        }
+/// Server mode: the instance is encoded once, then each line read from stdin is
+/// a home-away pattern (see `pattern_lits`). The pattern is solved under
+/// assumptions and the following lines are written to stdout:
+///
+///   solution <xml>          for each schedule found, as a single line
+///   schedule <h> <a> <s>... the same, with compact=true
+///   core <team> <slot> ...  if the pattern has no feasible schedule, the
+///                           (team, slot) pairs of a subset of the pattern
+///                           that is already infeasible, followed by
+///   infeasible
+///   done <lb> optimal       at the end of the pattern, with the lower bound
+///   done <lb> stopped       found (stopped: a timeout was reached)
+///   error <message>         if the line is not a valid pattern
+///
+/// An empty line or end of input stops the server.
+fn serve<L:Lit>(solve :&mut impl FnMut(Vec<Bool<L>>, bool, &mut dyn FnMut(&str, &[(SlotId, TeamId, TeamId)])) -> Outcome,
+                home_vars :&HashMap<(SlotId, TeamId), Bool<L>>,
+                team_ids :&[TeamId],
+                slot_ids :&[SlotId],
+                compact :bool) {
+    use std::io::prelude::*;
+    info!("Server ready.");
+    let stdin = std::io::stdin();
+    for line in stdin.lock().lines() {
+        let line = line.unwrap();
+        if line.trim().is_empty() {
+            break;
+        }
 
+        match pattern_lits(&line, home_vars, team_ids, slot_ids) {
+            Ok(assumptions) => {
+                let outcome = solve(assumptions, true, &mut |out, matches| {
+                    if compact {
+                        println!("{}", format_schedule_compact(matches));
                     } else {
-                        panic!("conflict includes not-yet-constructed constraint");
+                        println!("solution {}", out.lines().map(|l| l.trim()).collect::<String>());
                     }
+                    std::io::stdout().flush().unwrap();
+                });
+                match outcome {
+                    Outcome::Infeasible { core } => {
+                        println!("{}", format_core(&core, slot_ids.len()));
+                        println!("infeasible");
+                    },
+                    Outcome::Done { lb, optimal } => println!("done {} {}", lb, if optimal { "optimal" } else { "stopped" }),
                 }
+            },
+            Err(msg) => println!("error {}", msg),
+        }
+        std::io::stdout().flush().unwrap();
+    }
+    info!("Server stopped.");
+}
 
-                remove_softs.sort_by_key(|x| -(*x as isize));
-                for idx in remove_softs { soft.remove(idx); }
-
-                let c = if conflict.len() > 1 {
-                    let insert_idx :usize = soft.binary_search_by_key(&conflict_cost, |s|  s.weight())
-                        .or_else::<usize,_>(|idx| Ok(idx)).unwrap();
-
-                    soft.insert(insert_idx, Soft::Constructable(conflict_cost,
-                        Relax::NewTotalizer {
-                            lits: conflict.into_iter().copied().map(|l| Bool::Lit(!l)).collect(),
-                            bound: 1
-                        }));
-                    None
-                } else {
-                    Some(conflict[0])
-                };
-
-
-
-                drop(result);
-                if let Some(c) = c { 
-                    SatInstance::add_clause(&mut solver, vec![!c]);
-                }
+/// Literals forcing a home-away pattern, given as one string of 0 (away)
+/// and 1 (home) per team, separated by whitespace (e.g. one per line).
+/// A team can also be given as a packed bit row: "x" followed by the
+/// hexadecimal value of the row, where bit i is 1 if the team plays home
+/// in slot i (e.g. "x5" is home in the slots 0 and 2 only).
+pub fn pattern_lits<L:Lit>(pattern :&str,
+                           home_vars :&HashMap<(SlotId, TeamId), Bool<L>>,
+                           team_ids :&[TeamId],
+                           slot_ids :&[SlotId]) -> Result<Vec<Bool<L>>, String> {
+    let teams = pattern.split_whitespace().collect::<Vec<_>>();
+    if teams.len() != team_ids.len() {
+        return Err(format!("expected {} teams, got {}", team_ids.len(), teams.len()));
+    }
 
-                let old_lb = current_lb;
-                current_lb += conflict_cost;
-                info!("LB increased from {} to {}", old_lb, current_lb);
-            },
+    let mut lits = Vec::new();
+    for (team_idx, slots) in teams.iter().enumerate() {
+        let unpacked;
+        let slots = if slots.starts_with('x') {
+            unpacked = unpack_bit_row(&slots[1..], slot_ids.len())?;
+            unpacked.as_str()
+        } else {
+            *slots
         };
+        if slots.len() != slot_ids.len() {
+            return Err(format!("expected {} slots for team {}, got {}", slot_ids.len(), team_idx, slots.len()));
+        }
+        for (slot_idx, home_char) in slots.chars().enumerate() {
+            let home = match home_char {
+                '1' => true,
+                '0' => false,
+                c => return Err(format!("invalid character {:?}", c)),
+            };
 
+            let var = home_vars[&(slot_idx as SlotId,  team_idx as TeamId)];
+            lits.push(if home { var } else { !var });
+        }
     }
+    Ok(lits)
+}
+
+/// The core of a pattern (indices of the literals of `pattern_lits`,
+/// ordered by team and slot) as a "core <team> <slot> ..." line.
+pub fn format_core(core :&[usize], n_slots :usize) -> String {
+    let mut out = String::from("core");
+    for idx in core.iter().copied() {
+        out.push_str(&format!(" {} {}", idx / n_slots, idx % n_slots));
+    }
+    out
 }
 
 pub fn br2_heuristic<L:Lit + std::fmt::Debug>(solver :&mut (impl SatInstance<L> + SatSolverWithCore<Lit=L>),
@@ -1941,6 +2189,50 @@ pub fn verify_schedule<SlotId: std::fmt::Display + Copy + Eq, TeamId: std::fmt::
     return true;
 }
 
+/// Unpacks a bit row in hexadecimal (bit i is slot i) to a string of 0 and 1.
+fn unpack_bit_row(hex :&str, n_slots :usize) -> Result<String, String> {
+    if hex.len() > (n_slots + 3) / 4 {
+        return Err(format!("packed row {:?} is longer than {} slots", hex, n_slots));
+    }
+    let digits = hex.chars().rev()
+        .map(|c| c.to_digit(16).ok_or_else(|| format!("invalid character {:?}", c)))
+        .collect::<Result<Vec<_>, _>>()?;
+    Ok((0..n_slots).map(|slot| {
+        let digit = digits.get(slot / 4).copied().unwrap_or(0);
+        if (digit >> (slot % 4)) & 1 == 1 { '1' } else { '0' }
+    }).collect())
+}
+
+/// The (slot, home, away) matches of a schedule.
+pub fn schedule_matches(
+    slot_ids: &[SlotId],
+    team_ids: &[TeamId],
+    is_matched: impl Fn(SlotId, TeamId, TeamId) -> bool,
+) -> Vec<(SlotId, TeamId, TeamId)> {
+    let mut matches = Vec::new();
+    for slot in slot_ids.iter().copied() {
+        for team1 in team_ids.iter().copied() {
+            for team2 in team_ids.iter().copied() {
+                if team1 != team2 && is_matched(slot, team1, team2) {
+                    matches.push((slot, team1, team2));
+                }
+            }
+        }
+    }
+    matches
+}
+
+/// Compact single line format of a schedule: "schedule" followed by
+/// the home, away and slot of each match.
+pub fn format_schedule_compact(matches :&[(SlotId, TeamId, TeamId)]) -> String {
+    use std::fmt::Write;
+    let mut out = String::from("schedule");
+    for (slot, home, away) in matches.iter() {
+        write!(&mut out, " {} {} {}", home, away, slot).unwrap();
+    }
+    out
+}
+
 pub fn format_schedule_xml<SlotId: std::fmt::Display + Copy, TeamId: std::fmt::Display + Eq + Copy>(
     filename :&str,
     slot_ids: &[SlotId],
@@ -2027,3 +2319,58 @@ pub fn format_schedule<SlotId: std::fmt::Display + Copy, TeamId: std::fmt::Displ
 
     out
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_unpack_bit_row() {
+        assert_eq!(unpack_bit_row("5", 4), Ok("1010".to_string()));
+        assert_eq!(unpack_bit_row("0", 3), Ok("000".to_string()));
+        // The least significant digit holds the first slots
+        assert_eq!(unpack_bit_row("1f", 6), Ok("111110".to_string()));
+        assert_eq!(unpack_bit_row("3ff", 10), Ok("1111111111".to_string()));
+        assert!(unpack_bit_row("123", 6).is_err());
+        assert!(unpack_bit_row("g", 4).is_err());
+    }
+
+    #[test]
+    fn test_pattern_lits() {
+        let mut solver = Solver::new();
+        let team_ids = vec![0, 1];
+        let slot_ids = vec![0, 1];
+        let mut home_vars = HashMap::new();
+        for slot in slot_ids.iter().copied() {
+            for team in team_ids.iter().copied() {
+                home_vars.insert((slot, team), SatInstance::new_var(&mut solver));
+            }
+        }
+
+        // Ordered by team and slot, as the indices of format_core
+        let expected = vec![home_vars[&(0, 0)], !home_vars[&(1, 0)], !home_vars[&(0, 1)], home_vars[&(1, 1)]];
+        assert_eq!(pattern_lits("10 01", &home_vars, &team_ids, &slot_ids), Ok(expected.clone()));
+        assert_eq!(pattern_lits("x1 x2", &home_vars, &team_ids, &slot_ids), Ok(expected));
+
+        assert!(pattern_lits("10", &home_vars, &team_ids, &slot_ids).is_err());
+        assert!(pattern_lits("10 0", &home_vars, &team_ids, &slot_ids).is_err());
+        assert!(pattern_lits("10 0a", &home_vars, &team_ids, &slot_ids).is_err());
+        assert!(pattern_lits("x1 x12", &home_vars, &team_ids, &slot_ids).is_err());
+    }
+
+    #[test]
+    fn test_format_core() {
+        assert_eq!(format_core(&[], 10), "core");
+        assert_eq!(format_core(&[3, 29, 59], 10), "core 0 3 2 9 5 9");
+    }
+
+    #[test]
+    fn test_schedule_matches() {
+        let slot_ids = vec![0, 1];
+        let team_ids = vec![0, 1];
+        let is_matched = |s, t1, t2| (s, t1, t2) == (0, 0, 1) || (s, t1, t2) == (1, 1, 0);
+        let matches = schedule_matches(&slot_ids, &team_ids, is_matched);
+        assert_eq!(matches, vec![(0, 0, 1), (1, 1, 0)]);
+        assert_eq!(format_schedule_compact(&matches), "schedule 0 1 0 1 0 1");
+    }
+}
@@ -0,0 +1,62 @@
+# Checks that the vectorized validator and the delta evaluator agree
+# with the reference validator, on random double round robins and on
+# schedules perturbed by neighbourhood moves of Test4 (the Test
+# instance with every constraint type). The full cross-check over the
+# instance sets is run_validator_benchmark.py --check.
+#
+# Usage: python -m pytest -q test_equivalence.py
+
+import os
+import random
+import pytest
+from TwoRRProblem import read_instance
+from TwoRRValidator import validate_constraint, validate_constraint_tensor, ScheduleTensors
+from TwoRREvaluator import DeltaEvaluator
+from TwoRRLocalSearch import random_move
+from run_validator_benchmark import circle_schedule
+
+INSTANCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Instances", "TestInstances", "ITC2021_Test4.xml")
+SEEDS = range(5)
+MOVES_PER_SCHEDULE = 20
+
+@pytest.fixture(scope="module")
+def prob():
+    return read_instance(INSTANCE, use_cache=False)
+
+def reference_penalties(prob, solution):
+    # The reference results of each constraint, and the hard and soft totals
+    results = [tuple(validate_constraint(prob, solution, constraint)) for constraint in prob.constraints]
+    hard = sum(penalty for constraint, (_, _, penalty) in zip(prob.constraints, results) if constraint.hard)
+    soft = sum(penalty for constraint, (_, _, penalty) in zip(prob.constraints, results) if not constraint.hard)
+    return results, hard, soft
+
+def check_tensor(prob, solution, expected):
+    tensors = ScheduleTensors(prob, solution)
+    for constraint, value in zip(prob.constraints, expected):
+        assert tuple(validate_constraint_tensor(prob, tensors, constraint)) == value, constraint.name
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("phased", [False, True])
+def test_circle_schedules(prob, seed, phased):
+    solution = circle_schedule(len(prob.teams), random.Random(seed), phased)
+    expected, hard, soft = reference_penalties(prob, solution)
+    check_tensor(prob, solution, expected)
+    evaluator = DeltaEvaluator(prob, solution)
+    assert (evaluator.hard_penalty, evaluator.soft_penalty) == (hard, soft)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_perturbed_schedules(prob, seed):
+    # Each move is predicted by delta(), then applied: the totals of the
+    # evaluator must follow those of the reference on the new schedule
+    rng = random.Random(seed)
+    evaluator = DeltaEvaluator(prob, circle_schedule(len(prob.teams), rng, prob.game_mode == "P"))
+    for _ in range(MOVES_PER_SCHEDULE):
+        move = random_move(evaluator, rng)
+        delta_hard, delta_soft = evaluator.delta(move)
+        obj = (evaluator.hard_penalty + delta_hard, evaluator.soft_penalty + delta_soft)
+        evaluator.apply(move)
+        solution = evaluator.solution()
+        expected, hard, soft = reference_penalties(prob, solution)
+        check_tensor(prob, solution, expected)
+        assert obj == (hard, soft), move
+        assert (evaluator.hard_penalty, evaluator.soft_penalty) == (hard, soft), move
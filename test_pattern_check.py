@@ -0,0 +1,56 @@
+# Checks that the pattern checks (see TwoRRPatternCheck) never reject
+# the ha pattern of a feasible schedule: on random double round robins
+# of every ITC2021 instance, the base checks always pass, and a failed
+# check of a hard constraint means that the schedule violates it.
+#
+# Usage: python -m pytest -q test_pattern_check.py
+
+import os
+import random
+import pytest
+import numpy as np
+from TwoRRProblem import read_instance
+from TwoRRValidator import validate_constraint
+from TwoRRPatternCheck import PatternChecker
+from run_batch import instance_files
+from run_validator_benchmark import circle_schedule, instance_rng
+
+INSTANCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Instances")
+INSTANCE_SETS = ["Test", "Early", "Middle", "Late"]
+FILES = instance_files([os.path.join(INSTANCES_DIR, f"{name}Instances") for name in INSTANCE_SETS])
+SCHEDULES = 18 # over 256 per set of 15 instances
+
+def pattern_of(solution, n_teams):
+    # pattern[team][slot] = 1 if the team plays home in the slot
+    pattern = np.zeros((n_teams, len(solution)), dtype=np.int64)
+    for slot, games in enumerate(solution):
+        for home, _ in games:
+            pattern[home, slot] = 1
+    return pattern
+
+@pytest.mark.parametrize("filename", FILES, ids=os.path.basename)
+def test_valid_schedules(filename):
+    # Each check on its own, as check() stops at the first failed one
+    prob = read_instance(filename, use_cache=False)
+    checker = PatternChecker(prob)
+    rng = instance_rng(0, filename)
+    for _ in range(SCHEDULES):
+        solution = circle_schedule(len(prob.teams), rng, prob.game_mode == "P")
+        pattern = pattern_of(solution, len(prob.teams)) > 0
+        # The base checks hold for every double round robin
+        for check in [checker.check_balance, checker.check_pairs, checker.check_phased, checker.check_forced_games]:
+            assert check(pattern) is None
+        for ind, constraint in checker.hard:
+            check = getattr(checker, "check_" + constraint.name, None)
+            if check is None or check(pattern, constraint) is None:
+                continue
+            violated, _, _ = validate_constraint(prob, solution, constraint)
+            assert violated, f"{constraint.name} (constraint {ind}): {check(pattern, constraint)[0]}"
+
+def test_invalid_pattern():
+    prob = read_instance(FILES[0], use_cache=False)
+    pattern = pattern_of(circle_schedule(len(prob.teams), random.Random(0), prob.game_mode == "P"), len(prob.teams))
+    pattern[0, 0] = 1 - pattern[0, 0]
+    check, _, cells = PatternChecker(prob).check(pattern)
+    assert check == "slot balance"
+    assert (0, 0) in cells
@@ -0,0 +1,62 @@
+# Checks that the lines written by the slave solver in server mode
+# (see serve in sportsat/src/main.rs) are read back by parse_slave_line,
+# and that the home away patterns sent to it round trip.
+#
+# Usage: python -m pytest -q test_protocol.py
+
+import random
+import pytest
+from TwoRRProtocol import pack_pattern, unpack_pattern, format_schedule, parse_slave_line
+from run_validator_benchmark import circle_schedule
+
+N_TEAMS = 6
+
+def server_solution_line(solution):
+    # As format_schedule_xml, with the lines trimmed and joined
+    games = ['<ScheduledMatch home="{}" away="{}" slot="{}" />'.format(h, a, slot)
+             for slot, matches in enumerate(solution) for h, a in sorted(matches)]
+    return ("solution <Solution><MetaData><InstanceName>ITC2021_Test4.xml</InstanceName>"
+            "<SolutionName>ITC2021_Test4_bjornarl_0_99999999_today.xml</SolutionName>"
+            '<ObjectiveValue infeasibility="0" objective="99999999" /></MetaData>'
+            "<Games>" + "".join(games) + "</Games></Solution>\n")
+
+def server_core_line(core, n_slots):
+    # As format_core, for the indices of the literals of pattern_lits
+    return "core" + "".join(" {} {}".format(idx // n_slots, idx % n_slots) for idx in core) + "\n"
+
+def sorted_schedule(solution):
+    return [sorted(matches) for matches in solution]
+
+@pytest.mark.parametrize("seed", range(3))
+def test_schedule_lines(seed):
+    solution = circle_schedule(N_TEAMS, random.Random(seed), seed % 2 == 0)
+    assert parse_slave_line(format_schedule(solution)) == ("schedule", solution)
+    kind, parsed = parse_slave_line(server_solution_line(solution))
+    assert kind == "solution"
+    assert sorted_schedule(parsed) == sorted_schedule(solution)
+
+def test_compact_schedule_line():
+    assert parse_slave_line("schedule 0 1 0 2 3 0 1 2 1 3 0 1\n") == ("schedule", [[(0, 1), (2, 3)], [(1, 2), (3, 0)]])
+
+def test_core_line():
+    n_slots = 2 * (N_TEAMS - 1)
+    assert parse_slave_line("core 0 3 2 9\n") == ("core", [(0, 3), (2, 9)])
+    assert parse_slave_line(server_core_line([3, 29, 59], n_slots)) == ("core", [(0, 3), (2, 9), (5, 9)])
+
+def test_outcome_lines():
+    assert parse_slave_line("infeasible\n") == ("infeasible", "")
+    assert parse_slave_line("done 12 optimal\n") == ("done", "12 optimal")
+    assert parse_slave_line("done 0 stopped\n") == ("done", "0 stopped")
+    assert parse_slave_line("error expected 6 teams, got 5\n") == ("error", "expected 6 teams, got 5")
+
+@pytest.mark.parametrize("n_slots", [1, 4, 10, 38])
+def test_pattern_round_trip(n_slots):
+    rng = random.Random(n_slots)
+    pattern = [[rng.randint(0, 1) for _ in range(n_slots)] for _ in range(N_TEAMS)]
+    line = pack_pattern(pattern)
+    assert line.endswith("\n") and line.count("x") == N_TEAMS
+    assert unpack_pattern(line, n_slots) == pattern
+
+def test_packed_row():
+    # Bit i is slot i, as unpack_bit_row in the slave
+    assert pack_pattern([[1, 0, 1, 0], [0, 0, 0, 0]]) == "x5 x0\n"